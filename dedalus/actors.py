@@ -0,0 +1,207 @@
+from collections import defaultdict
+from typing import Any, DefaultDict, Dict, List, Optional, Set, Tuple
+import asyncio
+
+from explore import _relative
+from run import Process, spawn, step
+import asts
+
+
+# A message is a batch of async tuples sent from one location to another.
+Message = List[Tuple[asts.Predicate, Tuple[Any, ...]]]
+
+
+def _rule_location(rule: asts.Rule) -> asts.Term:
+    # Location restriction guarantees that all the atoms of a rule's body
+    # have the same location. Rules without a body are located at their head.
+    if len(rule.body) == 0:
+        return rule.head.terms[0]
+    return rule.body[0].atom.terms[0]
+
+def locations(program: asts.Program) -> Set[str]:
+    """
+    `locations(program)` returns the location constants at which the rules of
+    `program` are evaluated. For example, the program
+
+        p(#a, x) :- .
+        q(#b, x)@3 :- .
+        r(#Y)@async :- p(#X, Y).
+
+    has locations a and b.
+    """
+    return {_rule_location(r).x for r in program.rules
+            if isinstance(_rule_location(r), asts.Constant)}
+
+def local_program(program: asts.Program, location: str) -> asts.Program:
+    """
+    `local_program(program, location)` returns the rules of `program` that
+    are evaluated at location `location`: the rules located at a variable and
+    the rules located at the constant `location`.
+    """
+    def is_local(rule: asts.Rule) -> bool:
+        term = _rule_location(rule)
+        return isinstance(term, asts.Variable) or term.x == location
+    return asts.Program(tuple(r for r in program.rules if is_local(r)))
+
+class Actor:
+    """
+    An actor runs the rules of a single location with its own process, clock,
+    and inbox. Every timestep, an actor
+
+      1. delivers every message in its inbox into its current timestep,
+      2. steps its process, and
+      3. sends the tuples produced by its async rules, batched by
+         destination, to the inboxes of the actors at their locations.
+
+    That is, an async tuple is delayed by however many timesteps the
+    receiver takes before it gets around to its inbox, rather than by a
+    random number of timesteps.
+
+    An actor whose last timestep sent no tuples and left its database and
+    (relative) async buffer unchanged, and that has no constant time rules in
+    its future, has reached a fixpoint: every later timestep would be
+    identical unless it receives a message. Rather than step through
+    identical timesteps, an actor at a fixpoint waits on its inbox, so idle
+    actors cost nothing.
+    """
+    def __init__(self, runtime: 'Runtime', location: str) -> None:
+        self.runtime = runtime
+        self.location = location
+        self.process = spawn(local_program(runtime.program, location))
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.constant_times = \
+            [r.rule_type.time for r in self.process.program.rules
+             if isinstance(r.rule_type, asts.ConstantTimeRule)]
+        self.waiting = False
+        self.quiet = False
+        self.sent = 0
+        self.received = 0
+
+    def _at_fixpoint(self) -> bool:
+        t = self.process.timestep
+        return (self.quiet and
+                all(len(r) == 0 for db in self.process.async_buffer.values()
+                                for r in db.values()) and
+                all(time < t for time in self.constant_times))
+
+    def _deliver(self, message: Message) -> None:
+        bucket = self.process.async_buffer[self.process.timestep]
+        for (p, tuple_) in message:
+            bucket[p].add(tuple_)
+        self.received += len(message)
+
+    async def run(self, timesteps: int) -> None:
+        try:
+            while self.process.timestep < timesteps:
+                if self._at_fixpoint() and self.inbox.empty():
+                    self.runtime.wait(self)
+                    self._deliver(await self.inbox.get())
+                while not self.inbox.empty():
+                    self._deliver(self.inbox.get_nowait())
+
+                before = _relative(self.process)
+                outbox: DefaultDict[str, Message] = defaultdict(list)
+                def send(p: asts.Predicate, tuple_: Tuple[Any, ...]) -> None:
+                    outbox[tuple_[0]].append((p, tuple_))
+                self.process = step(self.process, send)
+                self.quiet = (len(outbox) == 0 and
+                              _relative(self.process) == before)
+                for (location, message) in outbox.items():
+                    self.runtime.send(location, message)
+                    self.sent += len(message)
+
+                # Let the other actors run.
+                await asyncio.sleep(0)
+        finally:
+            self.runtime.finish(self)
+
+class Runtime:
+    """
+    A `Runtime` runs a Dedalus program as a set of actors, one per location,
+    in a single asyncio event loop. There is no global timestep: every actor
+    advances its own clock (see `Actor`). Actors are created for the location
+    constants of the program and, lazily, for every location that is sent a
+    message. The runtime stops once every actor has either performed
+    `timesteps` timesteps or is waiting at a fixpoint for a message that will
+    never come.
+    """
+    def __init__(self, program: asts.Program) -> None:
+        self.program = program
+        self.actors: Dict[str, Actor] = {}
+        self.tasks: List[asyncio.Future] = []
+        self.timesteps = 0
+        self.running = 0
+        self.dropped = 0
+        self.done: Optional[asyncio.Event] = None
+
+    def _spawn(self, location: str) -> Actor:
+        actor = Actor(self, location)
+        self.actors[location] = actor
+        self.running += 1
+        self.tasks.append(asyncio.ensure_future(actor.run(self.timesteps)))
+        return actor
+
+    def send(self, location: str, message: Message) -> None:
+        actor = self.actors.get(location) or self._spawn(location)
+        if actor.process.timestep >= self.timesteps:
+            self.dropped += len(message)
+            return
+        if actor.waiting:
+            actor.waiting = False
+            self.running += 1
+        actor.inbox.put_nowait(message)
+
+    def wait(self, actor: Actor) -> None:
+        actor.waiting = True
+        self._stop_running()
+
+    def finish(self, actor: Actor) -> None:
+        if not actor.waiting:
+            self._stop_running()
+
+    def _stop_running(self) -> None:
+        self.running -= 1
+        if self.running == 0:
+            assert self.done is not None
+            self.done.set()
+
+    async def _run(self, timesteps: int) -> None:
+        self.timesteps = timesteps
+        self.done = asyncio.Event()
+        for location in sorted(locations(self.program)):
+            self._spawn(location)
+        if self.running > 0:
+            await self.done.wait()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        for task in self.tasks:
+            if not task.cancelled():
+                exception = task.exception()
+                if exception is not None:
+                    raise exception
+
+    def statistics(self) -> List[Tuple[str, int, int, int]]:
+        """
+        `runtime.statistics()` returns the location, timestep, number of
+        tuples sent, and number of tuples received of every actor.
+        """
+        return [(l, a.process.timestep, a.sent, a.received)
+                for (l, a) in sorted(self.actors.items())]
+
+    def run(self, timesteps: int) -> Dict[str, Process]:
+        """
+        `runtime.run(timesteps)` runs the program until quiescence or until
+        every actor has performed `timesteps` timesteps, and returns the
+        process of every actor.
+        """
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self._run(timesteps))
+        return {l: a.process for (l, a) in self.actors.items()}
+
+def run(program: asts.Program, timesteps: int) -> Dict[str, Process]:
+    """
+    `run(program, timesteps)` runs `program` with one actor per location. See
+    `Runtime`.
+    """
+    return Runtime(program).run(timesteps)
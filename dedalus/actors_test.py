@@ -0,0 +1,77 @@
+import unittest
+
+from actors import Runtime, local_program, locations
+from desugar import desugar
+from run import run, spawn
+from typecheck import typecheck
+import asts
+import parser
+
+
+class TestActors(unittest.TestCase):
+    def program(self, source: str) -> asts.Program:
+        return typecheck(desugar(parser.parse(source)))
+
+    def test_locations(self) -> None:
+        program = self.program("""
+            p(#a, x) :- .
+            q(#b, x)@3 :- .
+            r(#Y)@async :- p(#X, Y).
+        """)
+        self.assertEqual(locations(program), {'a', 'b'})
+        self.assertEqual([str(r) for r in local_program(program, 'a').rules],
+                         ['p(#a, x) :- .', 'r(#Y)@async :- p(#X, Y).'])
+
+    def test_run(self) -> None:
+        # a pings b and b pings c, every timestep. c's actor is created when
+        # b first sends it a message.
+        program = self.program("""
+            node(#a, b) :- .
+            node(#b, c) :- .
+            ping(#Y, X)@async :- node(#X, Y).
+            got(#X, Y) :- ping(#X, Y).
+            got(#X, Y)@next :- got(#X, Y).
+        """)
+        runtime = Runtime(program)
+        processes = runtime.run(10)
+        self.assertEqual(set(processes), {'a', 'b', 'c'})
+
+        got = asts.Predicate('got')
+        self.assertEqual(processes['a'].database[got], set())
+        self.assertEqual(processes['b'].database[got], {('b', 'a')})
+        self.assertEqual(processes['c'].database[got], {('c', 'b')})
+        self.assertEqual(runtime.statistics(), [('a', 10, 10, 0),
+                                                ('b', 10, 10, 10),
+                                                ('c', 10, 0, 10)])
+
+    def test_quiescence(self) -> None:
+        program = self.program("""
+            ping(#b, x)@async :- start(#a).
+            pong(#a, X)@async :- ping(#b, X).
+            done(#a, X) :- pong(#a, X).
+            start(#a)@0 :- .
+        """)
+        runtime = Runtime(program)
+        runtime.run(1000)
+        statistics = runtime.statistics()
+        self.assertEqual([(l, s, r) for (l, t, s, r) in statistics],
+                         [('a', 1, 1), ('b', 1, 1)])
+        self.assertTrue(all(t < 5 for (l, t, s, r) in statistics))
+
+    def test_sender_without_inputs(self) -> None:
+        # a receives nothing, but sends to b every timestep from a deductive
+        # fact, so it must keep stepping rather than wait on its inbox.
+        program = self.program("""
+            node(#a, b) :- .
+            ping(#Y, X)@async :- node(#X, Y).
+            got(#X, Y) :- ping(#X, Y).
+        """)
+        processes = Runtime(program).run(10)
+        expected = run(spawn(program, lambda: 1), 10)
+        got = asts.Predicate('got')
+        self.assertEqual(processes['a'].timestep, 10)
+        self.assertEqual(expected.database[got], {('b', 'a')})
+        self.assertEqual(processes['b'].database[got], {('b', 'a')})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,83 @@
+from contextlib import contextmanager
 from enum import Enum
-from typing import List, NamedTuple, NewType, Set, Union
+from typing import (Any, Dict, Iterator, List, NamedTuple, NewType, Optional,
+                    Set, Tuple, TypeVar, Union)
+import threading
 
 import networkx as nx
 
 
+T = TypeVar('T')
+
+class _Tables(threading.local):
+    # The interned AST nodes, keyed by their type and fields (see `_key`), and
+    # the ids of the interned nodes, of the innermost `interning` scope of the
+    # current thread. See `intern`.
+    def __init__(self) -> None:
+        self.interned: Dict[Any, Any] = {}
+        self.ids: Set[int] = set()
+
+_TABLES = _Tables()
+
+def _canonical(value: Any) -> Any:
+    # The interned copy of a field of a node. Fields are nodes, tuples of
+    # nodes, or plain values like strings.
+    if not isinstance(value, tuple) or id(value) in _TABLES.ids:
+        return value
+    if hasattr(value, '_fields'):
+        return intern(value)
+    return tuple(_canonical(v) for v in value)
+
+def _key(value: Any) -> Any:
+    # Nodes are compared as tuples, so `DeductiveRule() == InductiveRule()`
+    # and `Constant('a', False) == Variable('a', False)`. The key of a node
+    # includes its type, and its children are identified by their ids.
+    if id(value) in _TABLES.ids:
+        return id(value)
+    if isinstance(value, tuple):
+        return (type(value),) + tuple(_key(v) for v in value)
+    return value
+
+def intern(node: T) -> T:
+    """
+    `intern(node)` returns the canonical copy of the AST node `node`: the
+    first interned node of the same type with the same fields. AST nodes are
+    immutable, so equal nodes can be shared. The parser and desugarer intern
+    every node they build, so every distinct term, atom, literal, and rule of
+    a program is stored once no matter how many times it appears, and two
+    interned nodes are equal if and only if they are the same object.
+
+        a = intern(Atom(Predicate('p'), (Constant('a', False),)))
+        b = intern(Atom(Predicate('p'), (Constant('a', False),)))
+        a is b
+
+    Interned nodes are kept until their `interning` scope exits (see
+    `interning`). Every thread has its own tables.
+    """
+    if id(node) in _TABLES.ids:
+        return node
+    node = type(node)(*(_canonical(v) for v in node)) # type: ignore
+    canonical = _TABLES.interned.setdefault(_key(node), node)
+    _TABLES.ids.add(id(canonical))
+    return canonical
+
+@contextmanager
+def interning() -> Iterator[None]:
+    """
+    `with interning(): ...` interns the nodes built in its body into fresh
+    tables, which are dropped when the body exits. Nodes interned in the body
+    are shared with each other but not with nodes interned outside of it. A
+    long running process that builds many programs, like `server.py`, builds
+    every program in its own scope, so the nodes of the programs it forgets
+    can be freed.
+    """
+    saved = (_TABLES.interned, _TABLES.ids)
+    (_TABLES.interned, _TABLES.ids) = ({}, set())
+    try:
+        yield
+    finally:
+        (_TABLES.interned, _TABLES.ids) = saved
+
 class Constant(NamedTuple):
     x: str
     is_location: bool
@@ -20,7 +94,27 @@ class Variable(NamedTuple):
         hash_ = "#" if self.is_location else ""
         return hash_ + self.x
 
-Term = Union[Constant, Variable]
+# The aggregate functions, applied to the distinct values of a variable.
+AGGREGATES = ('count', 'sum', 'min', 'max')
+
+class Aggregate(NamedTuple):
+    """
+    An aggregate term, like `count<X>`, in the head of a rule. The tuples
+    derived by the rule are grouped by the other terms of the head, and the
+    aggregate is the result of applying `function` (one of `AGGREGATES`) to
+    the distinct values of the variable `x` in the group.
+    """
+    function: str
+    x: str
+
+    def __str__(self) -> str:
+        return f"{self.function}<{self.x}>"
+
+    @property
+    def is_location(self) -> bool:
+        return False
+
+Term = Union[Constant, Variable, Aggregate]
 
 class Predicate(NamedTuple):
     x: str
@@ -30,7 +124,7 @@ class Predicate(NamedTuple):
 
 class Atom(NamedTuple):
     predicate: Predicate
-    terms: List[Term]
+    terms: Tuple[Term, ...]
 
     def __str__(self) -> str:
         terms_string = ", ".join(str(term) for term in self.terms)
@@ -42,6 +136,9 @@ class Atom(NamedTuple):
     def variables(self) -> List[Variable]:
         return [term for term in self.terms if isinstance(term, Variable)]
 
+    def aggregates(self) -> List[Aggregate]:
+        return [term for term in self.terms if isinstance(term, Aggregate)]
+
 class Literal(NamedTuple):
     negative: bool
     atom: Atom
@@ -56,6 +153,62 @@ class Literal(NamedTuple):
     def is_positive(self) -> bool:
         return not self.is_negative()
 
+# The operators of built-in predicates, like `X < Y` and `Z = X + 1`.
+COMPARISONS = ('=', '!=', '<', '<=', '>', '>=')
+OPERATORS = ('+', '-', '*', '/', '%')
+
+class Arithmetic(NamedTuple):
+    op: str
+    left: Union[Constant, Variable]
+    right: Union[Constant, Variable]
+
+    def __str__(self) -> str:
+        return f"{self.left} {self.op} {self.right}"
+
+    def variables(self) -> List[Variable]:
+        return [t for t in [self.left, self.right] if isinstance(t, Variable)]
+
+Expression = Union[Constant, Variable, Arithmetic]
+
+def _expression_variables(e: Expression) -> List[Variable]:
+    if isinstance(e, Arithmetic):
+        return e.variables()
+    return [e] if isinstance(e, Variable) else []
+
+class Builtin(NamedTuple):
+    """
+    A built-in predicate in the body of a rule: a comparison `left op right`
+    of two expressions, where `op` is one of `COMPARISONS`. Comparisons other
+    than `=` and `!=` are between integers, and so is arithmetic.
+    """
+    op: str
+    left: Expression
+    right: Expression
+
+    def __str__(self) -> str:
+        return f"{self.left} {self.op} {self.right}"
+
+    def variables(self) -> List[Variable]:
+        return (_expression_variables(self.left) +
+                _expression_variables(self.right))
+
+    def assignment(self, bound: Set[str]) -> Optional[Tuple[str, Expression]]:
+        """
+        `builtin.assignment(bound)` returns the variable that `builtin` binds
+        and the expression it's bound to, given the variables in `bound`, or
+        None if it doesn't bind one. An equality with an unbound variable on
+        one side and only bound variables on the other binds the variable. For
+        example, `Z = X + 1` binds Z to X + 1 if X is bound and Z isn't.
+        """
+        if self.op != '=':
+            return None
+        for (x, e) in [(self.left, self.right), (self.right, self.left)]:
+            if (isinstance(x, Variable) and
+                x.x not in bound and
+                all(v.x in bound for v in _expression_variables(e))):
+                return (x.x, e)
+        return None
+
 class DeductiveRule(NamedTuple):
     pass
 
@@ -85,10 +238,12 @@ RuleType = Union[DeductiveRule, InductiveRule, AsyncRule, ConstantTimeRule]
 class Rule(NamedTuple):
     head: Atom
     rule_type: RuleType
-    body: List[Literal]
+    body: Tuple[Literal, ...]
+    builtins: Tuple[Builtin, ...] = ()
 
     def __str__(self) -> str:
-        body_string = ", ".join([str(l) for l in self.body])
+        body = [str(l) for l in self.body] + [str(b) for b in self.builtins]
+        body_string = ", ".join(body)
         return f"{self.head}{str(self.rule_type)} :- {body_string}."
 
     def is_deductive(self) -> bool:
@@ -103,8 +258,14 @@ class Rule(NamedTuple):
     def is_constant_time(self) -> bool:
         return isinstance(self.rule_type, ConstantTimeRule)
 
-class Program(NamedTuple):
-    rules: List[Rule]
+    def is_aggregate(self) -> bool:
+        return len(self.head.aggregates()) > 0
+
+# Pylint can't see the methods of a class-syntax NamedTuple once it infers a
+# call to its constructor, so the fields of `Program` are declared in a base
+# class instead.
+class Program(NamedTuple('Program', [('rules', Tuple[Rule, ...])])):
+    __slots__ = ()
 
     def __str__(self) -> str:
         return "\n".join(str(rule) for rule in self.rules)
@@ -180,12 +341,13 @@ class Program(NamedTuple):
         Both `p` and `q` are EDB predicates, but only `q` is persistent. `p` is
         not persistent because the first rule is not deductive.
         """
+        edb = self.edb()
         not_persistent: Set[Predicate] = set()
         for rule in self.rules:
             p = rule.head.predicate
-            if p in self.edb() and not rule.is_deductive():
+            if p in edb and not rule.is_deductive():
                 not_persistent.add(p)
-        return self.edb() - not_persistent
+        return edb - not_persistent
 
     def is_positive(self) -> bool:
         """
@@ -217,7 +379,9 @@ class Program(NamedTuple):
         `program`. Vertices in the PDG are predicates in the program. There is
         an edge from predicate p to predicate q if there exists a rule of the
         form `p :- ..., q, ...`. The edge is labelled `negative` if `q` is
-        negative. The edge is labelled `async` if the rule is `async`.
+        negative or the rule is an aggregate rule, since, like negation, an
+        aggregate can only be computed once `q` is complete. The edge is
+        labelled `async` if the rule is `async`.
         """
         g = nx.DiGraph()
         g.add_nodes_from(self.predicates())
@@ -229,7 +393,9 @@ class Program(NamedTuple):
                 if p not in g[q]:
                     g.add_edge(q, p, negative=False, async=False)
                 edge = g[q][p]
-                edge['negative'] = edge['negative'] or literal.is_negative()
+                edge['negative'] = (edge['negative'] or
+                                    literal.is_negative() or
+                                    rule.is_aggregate())
                 edge['async'] = edge['async'] or rule.is_async()
 
         return g
@@ -237,10 +403,12 @@ class Program(NamedTuple):
     def deductive_pdg(self) -> nx.DiGraph:
         """
         `program.deductive_pdg()` returns the PDG for the deductive rules of
-        dedalus program `program`.
+        dedalus program `program`. As in `pdg`, the edges of aggregate rules
+        are negative.
         """
         deductive_rules = [rule for rule in self.rules if rule.is_deductive()]
-        deductive_predicates = {rule.head.predicate for rule in deductive_rules}
+        deductive_predicates = {rule.head.predicate
+                                for rule in deductive_rules}
 
         g = nx.DiGraph()
         g.add_nodes_from(deductive_predicates)
@@ -254,7 +422,9 @@ class Program(NamedTuple):
                 if p not in g[q]:
                     g.add_edge(q, p, negative=False)
                 edge = g[q][p]
-                edge['negative'] = edge['negative'] or literal.is_negative()
+                edge['negative'] = (edge['negative'] or
+                                    literal.is_negative() or
+                                    rule.is_aggregate())
 
         return g
 
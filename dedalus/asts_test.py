@@ -12,6 +12,42 @@ class TestAsts(unittest.TestCase):
     def predicate(self, x: str) -> asts.Predicate:
         return parser.predicate.parse_strict(x)
 
+    def test_intern(self) -> None:
+        a = asts.Constant('a', False)
+        atom = asts.Atom(asts.Predicate('p'), (a,))
+        self.assertIs(asts.intern(atom),
+                      asts.intern(asts.Atom(asts.Predicate('p'), (a,))))
+        self.assertIs(asts.intern(atom).terms[0], asts.intern(a))
+
+        # Nodes that compare equal as tuples but have different types are
+        # not merged.
+        self.assertEqual(asts.DeductiveRule(), asts.InductiveRule())
+        deductive = asts.Rule(atom, asts.DeductiveRule(), ())
+        inductive = asts.Rule(atom, asts.InductiveRule(), ())
+        self.assertIsNot(asts.intern(deductive), asts.intern(inductive))
+        self.assertTrue(asts.intern(inductive).is_inductive())
+        variable = asts.Variable('a', False)
+        self.assertIsInstance(asts.intern(variable), asts.Variable)
+
+        # The parser interns every node.
+        program = parser.parse('p(#a, b) :- q(#a). r(#a) :- q(#a).')
+        self.assertIs(program.rules[0].body[0].atom,
+                      program.rules[1].body[0].atom)
+
+    def test_interning(self) -> None:
+        def atom() -> asts.Atom:
+            return asts.Atom(asts.Predicate('p'), (asts.Constant('a', False),))
+
+        outside = asts.intern(atom())
+        size = len(asts._TABLES.interned)
+        with asts.interning():
+            inside = asts.intern(atom())
+            self.assertIsNot(inside, outside)
+            self.assertIs(asts.intern(atom()), inside)
+            self.assertEqual(inside, outside)
+        self.assertIs(asts.intern(atom()), outside)
+        self.assertEqual(len(asts._TABLES.interned), size)
+
     def test_program_predicates(self) -> None:
         test_cases: List[Tuple[str, Set[str]]] = [
             ('p(#a) :- .', {'p'}),
@@ -0,0 +1,116 @@
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import operator
+
+import asts
+
+
+def number(value: Any) -> int:
+    """
+    `number(value)` returns the integer that the constant `value` denotes.
+    Constants are strings, so `number('42') == 42`. A constant that isn't an
+    integer raises a ValueError.
+    """
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'The constant {value} is not an integer.') from None
+
+def _divide(x: int, y: int) -> Optional[int]:
+    # Like SQLite, division truncates toward zero and dividing by zero is
+    # undefined.
+    if y == 0:
+        return None
+    q = abs(x) // abs(y)
+    return q if (x < 0) == (y < 0) else -q
+
+def _modulo(x: int, y: int) -> Optional[int]:
+    q = _divide(x, y)
+    return None if q is None else x - y * q
+
+OPERATORS: Dict[str, Callable[[int, int], Optional[int]]] = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': _divide,
+    '%': _modulo,
+}
+
+COMPARISONS: Dict[str, Callable[[int, int], bool]] = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+def arithmetic(op: str, x: Any, y: Any) -> Optional[str]:
+    """
+    `arithmetic(op, x, y)` returns the constant `x op y`, or None if it's
+    undefined (e.g. `x / 0`). For example, `arithmetic('+', '1', '2') ==
+    '3'`.
+    """
+    result = OPERATORS[op](number(x), number(y))
+    return None if result is None else str(result)
+
+def compare(op: str, x: Any, y: Any) -> bool:
+    """
+    `compare(op, x, y)` returns whether `x op y` holds. `=` and `!=` compare
+    constants; the other comparisons compare integers. Nothing is equal or
+    unequal to an undefined value.
+    """
+    if x is None or y is None:
+        return False
+    if op == '=':
+        return x == y
+    if op == '!=':
+        return x != y
+    return COMPARISONS[op](number(x), number(y))
+
+Evaluator = Callable[[Dict[str, Any]], Optional[str]]
+
+def evaluator(expression: asts.Expression) -> Evaluator:
+    """
+    `evaluator(expression)` returns a function that evaluates `expression`
+    given the bindings of its variables.
+    """
+    if isinstance(expression, asts.Arithmetic):
+        op = expression.op
+        left = evaluator(expression.left)
+        right = evaluator(expression.right)
+        def evaluate(b: Dict[str, Any]) -> Optional[str]:
+            x = left(b)
+            y = right(b)
+            if x is None or y is None:
+                return None
+            return arithmetic(op, x, y)
+        return evaluate
+    elif isinstance(expression, asts.Constant):
+        value = expression.x
+        return lambda b: value
+    else:
+        x = expression.x
+        return lambda b: b[x]
+
+Scheduled = List[Tuple[asts.Builtin, Optional[Tuple[str, asts.Expression]]]]
+
+def ready(pending: List[asts.Builtin], bound: Set[str]) -> Scheduled:
+    """
+    `ready(pending, bound)` removes from `pending` and returns the built-in
+    predicates that can be applied once the variables in `bound` are bound,
+    and adds the variables they bind to `bound`. Every built-in is paired with
+    the variable it binds and the expression it binds it to (see
+    `asts.Builtin.assignment`), or with None if it's a filter.
+    """
+    scheduled: Scheduled = []
+    progress = True
+    while progress:
+        progress = False
+        for b in list(pending):
+            assignment = b.assignment(bound)
+            if assignment is not None:
+                bound.add(assignment[0])
+            elif any(v.x not in bound for v in b.variables()):
+                continue
+            scheduled.append((b, assignment))
+            pending.remove(b)
+            progress = True
+    return scheduled
@@ -0,0 +1,293 @@
+from collections import defaultdict, deque
+from typing import (Any, Deque, Dict, List, NamedTuple, Optional, Set, Sized,
+                    Tuple)
+import hashlib
+import itertools
+import os
+import tempfile
+
+from explore import _relative, fingerprint
+from run import AsyncBuffer, Process, _empty_default_database, spawn, step
+import asts
+
+
+# An async tuple sent during a timestep.
+Sent = Tuple[asts.Predicate, Tuple[Any, ...]]
+
+# The delay chosen for every async tuple sent during a timestep.
+Choice = Tuple[int, asts.Predicate, Tuple[Any, ...], int]
+
+# A trace is a linked list of the choices made to reach a state, most recent
+# first, so that states can share the choices of their common ancestors.
+Trace = Optional[Tuple[Tuple[Choice, ...], Any]]
+
+class Outcome(NamedTuple):
+    fingerprint: str
+    states: int # The number of terminal states with this database.
+    witness: List[Choice] # The choices that lead to one of them.
+    process: Process
+
+class Statistics(NamedTuple):
+    states: int # The number of distinct states explored.
+    transitions: int
+    duplicates: int # The number of transitions to an already visited state.
+    terminal: int # The number of quiescent or final states.
+    spilled: int # The number of visited states spilled to disk.
+
+_DIGEST_SIZE = 20
+
+def digest(process: Process) -> bytes:
+    """
+    `digest(process)` returns a canonical hash of the timestep, database, and
+    async buffer of `process`: processes with the same tuples in the same
+    relations at the same timesteps have the same digest, no matter the order
+    in which the tuples were inserted.
+    """
+    h = hashlib.sha1(repr(process.timestep).encode())
+    h.update(fingerprint(process.database).encode())
+    for (t, db) in sorted(process.async_buffer.items()):
+        for p in sorted(db):
+            if len(db[p]) > 0:
+                h.update(repr((t, p.x, sorted(db[p]))).encode())
+    return h.digest()
+
+class VisitedSet(Sized):
+    """
+    A `VisitedSet` is a set of state digests that holds at most `budget`
+    digests in memory. When the in-memory set fills up, its digests are
+    written, sorted, to a segment file in `directory` and looked up there
+    with a binary search. Digests are fixed size, so the i-th digest of a
+    segment is at byte i * 20.
+    """
+    def __init__(self, budget: int = None, directory: str = None) -> None:
+        self.budget = budget
+        self.directory = directory
+        self.memory: Set[bytes] = set()
+        self.segments: List[Tuple[str, int]] = []
+
+    def __len__(self) -> int:
+        return len(self.memory) + self.spilled()
+
+    def spilled(self) -> int:
+        return sum(n for (_, n) in self.segments)
+
+    def _in_segment(self, path: str, n: int, d: bytes) -> bool:
+        with open(path, 'rb') as f:
+            (lo, hi) = (0, n)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                f.seek(mid * _DIGEST_SIZE)
+                x = f.read(_DIGEST_SIZE)
+                if x == d:
+                    return True
+                elif x < d:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return False
+
+    def add(self, d: bytes) -> bool:
+        """
+        `visited.add(d)` adds digest `d` to the set and returns whether it
+        wasn't already in it.
+        """
+        if d in self.memory:
+            return False
+        if any(self._in_segment(path, n, d) for (path, n) in self.segments):
+            return False
+        self.memory.add(d)
+        if self.budget is not None and len(self.memory) >= self.budget:
+            self._spill()
+        return True
+
+    def _spill(self) -> None:
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='dedalus-')
+        (fd, path) = tempfile.mkstemp(dir=self.directory, suffix='.visited')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b''.join(sorted(self.memory)))
+        self.segments.append((path, len(self.memory)))
+        self.memory = set()
+
+    def close(self) -> None:
+        for (path, _) in self.segments:
+            os.unlink(path)
+        self.segments = []
+
+def _trace(trace: Trace) -> List[Choice]:
+    choices: List[Choice] = []
+    while trace is not None:
+        (step_choices, trace) = trace
+        choices[:0] = step_choices
+    return choices
+
+def _delays(timestep: int, timesteps: int, low: int, high: int) -> List[int]:
+    # Tuples delivered after the last timestep are never seen, so all of the
+    # delays that deliver a tuple after it are equivalent, and only the
+    # smallest of them is explored.
+    delays = [d for d in range(low, high + 1) if timestep + d < timesteps]
+    if timestep + high >= timesteps:
+        delays.append(max(low, timesteps - timestep))
+    return delays
+
+def _with(async_buffer: AsyncBuffer,
+          choices: Tuple[Choice, ...]) \
+          -> AsyncBuffer:
+    # `_with(async_buffer, choices)` returns a copy of `async_buffer` with the
+    # tuples in `choices` added. Relations that don't change are shared, which
+    # is safe because `step` never modifies the process it's given.
+    copy: AsyncBuffer = defaultdict(_empty_default_database, async_buffer)
+    copied: Dict[int, Set[asts.Predicate]] = {}
+    for (t, p, tuple_, delay) in choices:
+        when = t + delay
+        if when not in copied:
+            copy[when] = _empty_default_database()
+            copy[when].update(async_buffer.get(when, {}))
+            copied[when] = set()
+        if p not in copied[when]:
+            copy[when][p] = set(copy[when][p])
+            copied[when].add(p)
+        copy[when][p].add(tuple_)
+    return copy
+
+def _step(process: Process) -> Tuple[Process, List[Sent], bool]:
+    # `_step(process)` steps `process` without buffering the async tuples it
+    # sends, and returns the new process, the async tuples, and whether the
+    # process is quiescent.
+    sent: Set[Sent] = set()
+    after = step(process, lambda p, tuple_: sent.add((p, tuple_)))
+    if len(sent) > 0:
+        return (after, sorted(sent), False)
+    constant = any(isinstance(r.rule_type, asts.ConstantTimeRule) and
+                   r.rule_type.time >= after.timestep
+                   for r in process.program.rules)
+    quiescent = not constant and _relative(after) == _relative(process)
+    return (after, [], quiescent)
+
+def _successors(process: Process,
+                timesteps: int,
+                low: int,
+                high: int) \
+                -> Tuple[List[Tuple[Process, Tuple[Choice, ...]]], bool]:
+    # `_successors(process, timesteps, low, high)` returns every state that
+    # can follow `process`, one for every assignment of delays to the async
+    # tuples sent during its timestep, and whether the process is quiescent.
+    t = process.timestep
+    (after, tuples, quiescent) = _step(process)
+    if len(tuples) == 0:
+        return ([(after, ())], quiescent)
+
+    delays = _delays(t, timesteps, low, high)
+    successors: List[Tuple[Process, Tuple[Choice, ...]]] = []
+    for assignment in itertools.product(delays, repeat=len(tuples)):
+        choices = tuple((t, p, tuple_, d)
+                        for ((p, tuple_), d) in zip(tuples, assignment))
+        async_buffer = _with(after.async_buffer, choices)
+        successors.append((after._replace(async_buffer=async_buffer),
+                           choices))
+    return (successors, False)
+
+def replay(program: asts.Program,
+           witness: List[Choice],
+           timesteps: int) \
+           -> Process:
+    """
+    `replay(program, witness, timesteps)` runs `program` for `timesteps`
+    timesteps (or until the choices of `witness` run out at a fixpoint),
+    delaying every async tuple as chosen in `witness`.
+    """
+    delays = {(t, p, tuple_): d for (t, p, tuple_, d) in witness}
+    process = spawn(program)
+    while process.timestep < timesteps:
+        t = process.timestep
+        (after, tuples, quiescent) = _step(process)
+        if quiescent:
+            return after
+        choices = tuple((t, p, tuple_, delays[(t, p, tuple_)])
+                        for (p, tuple_) in tuples)
+        process = after._replace(async_buffer=_with(after.async_buffer,
+                                                    choices))
+    return process
+
+def check(program: asts.Program,
+          timesteps: int,
+          low: int = 1,
+          high: int = 10,
+          search: str = 'bfs',
+          max_states: int = None,
+          visited_budget: int = None,
+          spill_directory: str = None) \
+          -> Tuple[List[Outcome], Statistics]:
+    """
+    `check(program, timesteps, ...)` explores every run of `program` for
+    `timesteps` timesteps, over every delay in [`low`, `high`] of every async
+    tuple, and returns the distinct databases in which the runs end along with
+    some statistics. A run ends when it reaches a fixpoint (see
+    `explore.explore_one`) or its last timestep. The program is confluent (up
+    to `timesteps` timesteps) if and only if there is one outcome.
+
+    States are searched breadth-first (`search='bfs'`) or depth-first
+    (`search='dfs'`), and every state is only explored once (see `digest`).
+    At most `visited_budget` visited states are kept in memory; the rest are
+    spilled to `spill_directory` (see `VisitedSet`). If more than `max_states`
+    states are explored, a ValueError is raised.
+    """
+    if not 1 <= low <= high:
+        raise ValueError(f'Invalid async delay range [{low}, {high}].')
+    if search not in ['bfs', 'dfs']:
+        raise ValueError(f'Unknown search order "{search}".')
+
+    visited = VisitedSet(visited_budget, spill_directory)
+    outcomes: Dict[str, Outcome] = {}
+    transitions = 0
+    duplicates = 0
+    terminal = 0
+
+    def end(process: Process, trace: Trace) -> None:
+        f = fingerprint(process.database)
+        if f in outcomes:
+            outcome = outcomes[f]
+            outcomes[f] = outcome._replace(states=outcome.states + 1)
+        else:
+            outcomes[f] = Outcome(f, 1, _trace(trace), process)
+
+    initial = spawn(program)
+    visited.add(digest(initial))
+    frontier: Deque[Tuple[Process, Trace]] = deque([(initial, None)])
+    try:
+        while len(frontier) > 0:
+            if search == 'bfs':
+                (process, trace) = frontier.popleft()
+            else:
+                (process, trace) = frontier.pop()
+            if process.timestep >= timesteps:
+                end(process, trace)
+                terminal += 1
+                continue
+
+            (successors, quiescent) = \
+                _successors(process, timesteps, low, high)
+            if quiescent:
+                end(successors[0][0], trace)
+                terminal += 1
+                continue
+
+            for (successor, choices) in successors:
+                transitions += 1
+                if not visited.add(digest(successor)):
+                    duplicates += 1
+                    continue
+                if max_states is not None and len(visited) > max_states:
+                    raise ValueError(
+                        f'More than {max_states} states. Try fewer '
+                        f'timesteps or a smaller delay range.')
+                next_trace = (choices, trace) if len(choices) > 0 else trace
+                frontier.append((successor, next_trace))
+        statistics = Statistics(len(visited), transitions, duplicates,
+                                terminal, visited.spilled())
+    finally:
+        visited.close()
+
+    ordered = sorted(outcomes.values(),
+                     key=lambda o: (-o.states, o.fingerprint))
+    return (ordered, statistics)
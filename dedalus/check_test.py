@@ -0,0 +1,89 @@
+import tempfile
+import unittest
+
+from check import VisitedSet, check, digest, replay
+from desugar import desugar
+from explore import explore, fingerprint
+from run import spawn, step
+from typecheck import typecheck
+import asts
+import parser
+
+
+class TestCheck(unittest.TestCase):
+    def program(self, source: str) -> asts.Program:
+        return typecheck(desugar(parser.parse(source)))
+
+    def test_digest(self) -> None:
+        program = self.program("""
+            p(#a, x) :- .
+            p(#a, y) :- .
+            q(#a, X)@next :- p(#a, X).
+        """)
+        a = step(spawn(program))
+        b = step(spawn(program))
+        self.assertEqual(digest(a), digest(b))
+        self.assertNotEqual(digest(a), digest(step(a)))
+        self.assertNotEqual(digest(a), digest(spawn(program)))
+
+    def test_visited_set(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            visited = VisitedSet(budget=3, directory=directory)
+            digests = [bytes([i]) * 20 for i in range(10)]
+            for d in digests:
+                self.assertTrue(visited.add(d))
+            for d in digests:
+                self.assertFalse(visited.add(d))
+            self.assertEqual(len(visited), 10)
+            self.assertEqual(visited.spilled(), 9)
+            visited.close()
+
+    def test_check(self) -> None:
+        # Whether x or y arrives first is a race.
+        program = self.program("""
+            start(#a)@0 :- .
+            m(#a, x)@async :- start(#a).
+            m(#a, y)@async :- start(#a).
+            first(#a, X) :- m(#a, X), !seen(#a).
+            seen(#a)@next :- m(#a, X).
+            seen(#a)@next :- seen(#a).
+            first(#a, X)@next :- first(#a, X).
+        """)
+        first = asts.Predicate('first')
+        expected = [{('a', 'x')}, {('a', 'y')}, {('a', 'x'), ('a', 'y')}]
+        for search in ['bfs', 'dfs']:
+            (outcomes, statistics) = check(program, 10, 1, 3, search,
+                                           visited_budget=4)
+            self.assertCountEqual([o.process.database[first]
+                                   for o in outcomes], expected)
+            self.assertGreater(statistics.duplicates, 0)
+            self.assertGreater(statistics.spilled, 0)
+
+        # Every sampled outcome is one of the checked outcomes, and can be
+        # reproduced from its witness.
+        fingerprints = {o.fingerprint for o in outcomes}
+        for sample in explore(program, 50, 10, low=1, high=3, processes=1):
+            self.assertIn(sample.fingerprint, fingerprints)
+        for o in outcomes:
+            process = replay(program, o.witness, 10)
+            self.assertEqual(fingerprint(process.database), o.fingerprint)
+
+    def test_confluent(self) -> None:
+        program = self.program("""
+            start(#a)@0 :- .
+            m(#a, x)@async :- start(#a).
+            m(#a, y)@async :- start(#a).
+            got(#a, X) :- m(#a, X).
+            got(#a, X)@next :- got(#a, X).
+        """)
+        (outcomes, statistics) = check(program, 100, 1, 5)
+        self.assertEqual(len(outcomes), 1)
+        self.assertEqual(outcomes[0].states, statistics.terminal)
+
+        with self.assertRaises(ValueError):
+            check(program, 100, 1, 5, max_states=10)
+        with self.assertRaises(ValueError):
+            check(program, 100, 1, 5, search='random')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,355 @@
+from collections import defaultdict
+from typing import Any, DefaultDict, Dict, List, NamedTuple, Tuple
+import marshal
+import multiprocessing
+import os
+import select
+import socket
+import struct
+import tempfile
+import time
+import zlib
+
+from actors import local_program, locations
+from run import AsyncBuffer, Database, Process, spawn, step
+import asts
+
+
+# Every frame sent between two workers is a header followed by a payload.
+# The header contains the length of the payload and the time at which the
+# frame was sent. The payload is a `marshal`ed list of (predicate, tuple)
+# pairs. A frame with an empty payload tells the receiver that the sender
+# has finished its last timestep.
+_HEADER = struct.Struct('!Id')
+
+Message = List[Tuple[str, Tuple[Any, ...]]]
+
+# The timestep, database, and async buffer of a location's process. Processes
+# can't be sent between OS processes as is because their `randint` usually
+# can't be pickled.
+State = Tuple[int, Database, AsyncBuffer]
+
+class LinkStatistics(NamedTuple):
+    src: int
+    dst: int
+    frames: int
+    tuples: int
+    bytes: int
+    latency: float # The total latency of every frame, in seconds.
+
+class WorkerResult(NamedTuple):
+    worker: int
+    states: Dict[str, State]
+    links: List[LinkStatistics]
+    duration: float
+    dropped: int # The tuples received after the worker finished.
+
+def worker_of(location: str, workers: int) -> int:
+    """
+    `worker_of(location, workers)` returns the worker, out of `workers`
+    workers, that runs location `location`. Locations are assigned to workers
+    by hash, so every worker knows where to send a tuple without asking.
+    """
+    return zlib.crc32(location.encode()) % workers
+
+class _Link:
+    """
+    A `_Link` is a connection from this worker to worker `dst`. Frames are
+    written to a buffer and flushed without blocking, so two workers sending
+    each other lots of tuples can't deadlock.
+    """
+    def __init__(self, src: int, dst: int, sock: socket.socket) -> None:
+        self.src = src
+        self.dst = dst
+        self.sock = sock
+        self.out = bytearray()
+        self.frames = 0
+        self.tuples = 0
+        self.bytes = 0
+
+    def send(self, message: Message) -> None:
+        payload: bytes = b''
+        if len(message) > 0:
+            payload = marshal.dumps(message) # type: ignore
+        self.out += _HEADER.pack(len(payload), time.time()) + payload
+        if len(message) > 0:
+            self.frames += 1
+            self.tuples += len(message)
+            self.bytes += _HEADER.size + len(payload)
+        self.flush()
+
+    def flush(self) -> None:
+        if len(self.out) == 0:
+            return
+        try:
+            n = self.sock.send(self.out)
+        except BlockingIOError:
+            return
+        del self.out[:n]
+
+class _Receiver:
+    """
+    A `_Receiver` reads and decodes the frames sent to this worker by worker
+    `src`.
+    """
+    def __init__(self, src: int, dst: int, sock: socket.socket) -> None:
+        self.src = src
+        self.dst = dst
+        self.sock = sock
+        self.data = bytearray()
+        self.finished = False
+        self.frames = 0
+        self.tuples = 0
+        self.bytes = 0
+        self.latency = 0.0
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def read(self) -> List[Message]:
+        try:
+            data = self.sock.recv(1 << 20)
+        except BlockingIOError:
+            return []
+        if len(data) == 0:
+            self.finished = True
+            return []
+        self.data += data
+
+        messages: List[Message] = []
+        while len(self.data) >= _HEADER.size:
+            (length, sent) = _HEADER.unpack_from(self.data)
+            if len(self.data) < _HEADER.size + length:
+                break
+            payload = bytes(self.data[_HEADER.size:_HEADER.size + length])
+            del self.data[:_HEADER.size + length]
+            if length == 0:
+                self.finished = True
+                continue
+            message = marshal.loads(payload) # type: ignore
+            self.frames += 1
+            self.tuples += len(message)
+            self.bytes += _HEADER.size + length
+            self.latency += time.time() - sent
+            messages.append(message)
+        return messages
+
+class _Worker:
+    """
+    A worker runs the locations assigned to it (see `worker_of`), each with its
+    own process, in lockstep. Every timestep, a worker
+
+      1. reads every frame that has arrived from the other workers and
+         delivers its tuples into the current timestep of their locations,
+      2. steps the process of every location, and
+      3. sends one frame to every other worker with all the async tuples
+         produced for its locations during the timestep. Async tuples for
+         locations on the same worker are delivered at the next timestep.
+
+    Workers don't synchronize their clocks, so the delay of an async tuple
+    is however long it takes to reach the receiver. A worker creates the
+    process of a location the first time it receives a tuple for it.
+    """
+    def __init__(self,
+                 program: asts.Program,
+                 worker: int,
+                 workers: int,
+                 listener: socket.socket,
+                 directory: str) \
+                 -> None:
+        self.program = program
+        self.worker = worker
+        self.workers = workers
+        self.processes: Dict[str, Process] = {}
+        for location in sorted(locations(program)):
+            if worker_of(location, workers) == worker:
+                self._process(location)
+
+        # Every worker connects to every other worker. Every worker's listener
+        # is created before any worker starts, so connecting never fails.
+        self.links: Dict[int, _Link] = {}
+        for dst in range(workers):
+            if dst != worker:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(os.path.join(directory, f'{dst}.sock'))
+                sock.sendall(struct.pack('!I', worker))
+                sock.setblocking(False)
+                self.links[dst] = _Link(worker, dst, sock)
+        self.receivers: List[_Receiver] = []
+        for _ in range(workers - 1):
+            (sock, _) = listener.accept()
+            (src,) = struct.unpack('!I', _recv_exactly(sock, 4))
+            sock.setblocking(False)
+            self.receivers.append(_Receiver(src, worker, sock))
+        listener.close()
+        self.dropped = 0
+
+    def _process(self, location: str) -> Process:
+        if location not in self.processes:
+            program = local_program(self.program, location)
+            self.processes[location] = spawn(program)
+        return self.processes[location]
+
+    def _deliver(self, message: Message) -> None:
+        for (p, tuple_) in message:
+            process = self._process(tuple_[0])
+            bucket = process.async_buffer[process.timestep]
+            bucket[asts.Predicate(p)].add(tuple_)
+
+    def _poll(self, timeout: float, deliver: bool = True) -> None:
+        # Frames read with `deliver` false are read and discarded.
+        readable = [r for r in self.receivers if not r.finished]
+        writable = [l.sock for l in self.links.values() if len(l.out) > 0]
+        if len(readable) == 0 and len(writable) == 0:
+            return
+        select.select(readable, writable, [], timeout)
+        for receiver in readable:
+            for message in receiver.read():
+                if deliver:
+                    self._deliver(message)
+        for link in self.links.values():
+            link.flush()
+
+    def run(self, timesteps: int) -> WorkerResult:
+        start = time.time()
+        for _ in range(timesteps):
+            self._poll(0)
+
+            outboxes: DefaultDict[int, Message] = defaultdict(list)
+            local: Message = []
+            for (location, process) in list(self.processes.items()):
+                def send(p: asts.Predicate, tuple_: Tuple[Any, ...]) -> None:
+                    dst = worker_of(tuple_[0], self.workers)
+                    if dst == self.worker:
+                        local.append((p.x, tuple_))
+                    else:
+                        outboxes[dst].append((p.x, tuple_))
+                self.processes[location] = step(process, send)
+            self._deliver(local)
+            for (dst, message) in outboxes.items():
+                self.links[dst].send(message)
+        duration = time.time() - start
+
+        # Tell every other worker that we're done, and keep reading until
+        # they're done too, so that no worker blocks on a full socket buffer.
+        # Tuples that arrive now are too late for any timestep, so they're
+        # discarded and counted as dropped.
+        for link in self.links.values():
+            link.send([])
+        while (any(not r.finished for r in self.receivers) or
+               any(len(l.out) > 0 for l in self.links.values())):
+            before = sum(r.tuples for r in self.receivers)
+            self._poll(None, deliver=False)
+            self.dropped += sum(r.tuples for r in self.receivers) - before
+        for link in self.links.values():
+            link.sock.close()
+        for receiver in self.receivers:
+            receiver.sock.close()
+
+        links = [LinkStatistics(r.src, r.dst, r.frames, r.tuples, r.bytes,
+                                r.latency)
+                 for r in self.receivers]
+        states = {l: (p.timestep, p.database, p.async_buffer)
+                  for (l, p) in self.processes.items()}
+        return WorkerResult(self.worker, states, links, duration,
+                            self.dropped)
+
+def _recv_exactly(sock: socket.socket, n: int) -> bytes:
+    data = b''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if len(chunk) == 0:
+            raise ValueError('Connection closed unexpectedly.')
+        data += chunk
+    return data
+
+def _run_worker(program: asts.Program,
+                worker: int,
+                workers: int,
+                listener: socket.socket,
+                directory: str,
+                timesteps: int,
+                connection: Any) \
+                -> None:
+    result = _Worker(program, worker, workers, listener, directory) \
+        .run(timesteps)
+    connection.send(result)
+    connection.close()
+
+def run(program: asts.Program,
+        timesteps: int,
+        workers: int) \
+        -> Tuple[Dict[str, Process], List[WorkerResult]]:
+    """
+    `run(program, timesteps, workers)` runs `program` for `timesteps`
+    timesteps on `workers` OS processes (see `_Worker`) connected by Unix
+    sockets, and returns the process of every location along with the
+    statistics of every worker. Async tuples that reach a worker after it has
+    finished its last timestep are discarded rather than added to the async
+    buffers of its processes, and are counted in its `dropped` statistic.
+    """
+    if workers < 1:
+        msg = f'A cluster needs at least one worker, not {workers}.'
+        raise ValueError(msg)
+
+    context = multiprocessing.get_context('fork')
+    with tempfile.TemporaryDirectory(prefix='dedalus-') as directory:
+        listeners: List[socket.socket] = []
+        for worker in range(workers):
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listener.bind(os.path.join(directory, f'{worker}.sock'))
+            listener.listen(workers)
+            listeners.append(listener)
+
+        pipes: List[Any] = []
+        children: List[Any] = []
+        for (worker, listener) in enumerate(listeners):
+            (receive, send) = context.Pipe(duplex=False)
+            child = context.Process(
+                target=_run_worker,
+                args=(program, worker, workers, listener, directory,
+                      timesteps, send))
+            child.start()
+            send.close()
+            pipes.append(receive)
+            children.append(child)
+        for listener in listeners:
+            listener.close()
+
+        results: List[WorkerResult] = []
+        for (worker, (receive, child)) in enumerate(zip(pipes, children)):
+            try:
+                results.append(receive.recv())
+            except EOFError:
+                raise ValueError(f'Worker {worker} failed.')
+            finally:
+                child.join()
+
+    processes: Dict[str, Process] = {}
+    for result in results:
+        for (location, (timestep, database, async_buffer)) \
+                in result.states.items():
+            process = spawn(local_program(program, location))
+            processes[location] = process._replace(
+                timestep=timestep, database=database,
+                async_buffer=async_buffer)
+    return (processes, results)
+
+def link_table(results: List[WorkerResult]) -> List[List[Any]]:
+    """
+    `link_table(results)` returns a row of statistics for every link between
+    two workers: the number of frames, tuples, and bytes sent over the link,
+    the throughput of the link in tuples per second (over the receiver's
+    run), and the mean latency of a frame in milliseconds.
+    """
+    durations = {r.worker: r.duration for r in results}
+    rows: List[List[Any]] = []
+    for result in results:
+        for link in sorted(result.links):
+            duration = durations[link.dst]
+            throughput = link.tuples / duration if duration > 0 else 0.0
+            latency = (1000 * link.latency / link.frames
+                       if link.frames > 0 else 0.0)
+            rows.append([link.src, link.dst, link.frames, link.tuples,
+                         link.bytes, round(throughput, 1), round(latency, 3)])
+    return rows
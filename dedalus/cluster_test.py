@@ -0,0 +1,51 @@
+import unittest
+
+from cluster import link_table, run, worker_of
+from desugar import desugar
+from typecheck import typecheck
+import asts
+import parser
+
+
+class TestCluster(unittest.TestCase):
+    def test_worker_of(self) -> None:
+        for location in ['a', 'b', 'c', 'node1']:
+            self.assertEqual(worker_of(location, 1), 0)
+            self.assertEqual(worker_of(location, 4), worker_of(location, 4))
+            self.assertIn(worker_of(location, 4), range(4))
+
+    def test_run(self) -> None:
+        # Every location pings the next, and remembers every ping it gets.
+        source = """
+            node(#a, b) :- .
+            node(#b, c) :- .
+            node(#c, d) :- .
+            node(#d, a) :- .
+            ping(#Y, X)@async :- node(#X, Y).
+            got(#X, Y) :- ping(#X, Y).
+            got(#X, Y)@next :- got(#X, Y).
+        """
+        program = typecheck(desugar(parser.parse(source)))
+        got = asts.Predicate('got')
+        for workers in [1, 2, 4]:
+            (processes, results) = run(program, 20, workers)
+            self.assertEqual(set(processes), {'a', 'b', 'c', 'd'})
+            self.assertEqual(len(results), workers)
+            for process in processes.values():
+                self.assertEqual(process.timestep, 20)
+            self.assertEqual(processes['a'].database[got], {('a', 'd')})
+            self.assertEqual(processes['b'].database[got], {('b', 'a')})
+
+            rows = link_table(results)
+            self.assertEqual(len(rows), workers * (workers - 1))
+            sent = sum(r.tuples for result in results for r in result.links)
+            dropped = sum(result.dropped for result in results)
+            self.assertGreaterEqual(sent, dropped)
+
+    def test_workers(self) -> None:
+        program = typecheck(desugar(parser.parse('p(#a) :- .')))
+        with self.assertRaises(ValueError):
+            run(program, 1, 0)
+
+if __name__ == '__main__':
+    unittest.main()
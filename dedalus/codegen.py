@@ -0,0 +1,224 @@
+from collections import OrderedDict
+from typing import (Any, Callable, Dict, Iterable, List, Mapping, Sequence,
+                    Set, Tuple)
+import hashlib
+import threading
+
+import asts
+import builtin
+
+
+# `index(p, columns)` returns an index on `columns` of the relation of p: a
+# dictionary that maps the values of `columns` to the tuples of p with those
+# values (see `run._Indexes.table`).
+Index = Callable[[asts.Predicate, Tuple[int, ...]],
+                 Mapping[Tuple[Any, ...], Iterable[Tuple[Any, ...]]]]
+
+# A compiled rule takes a database and an index function and returns the
+# tuples derived by the rule.
+CompiledRule = Callable[[Mapping[asts.Predicate, Any], Index],
+                        Iterable[Tuple[Any, ...]]]
+
+# The number of compiled programs kept in memory.
+CACHE_SIZE = 32
+
+# Compiled programs, keyed by a hash of their source (see `compile_rules`).
+_cache: 'OrderedDict[str, List[CompiledRule]]' = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _tuple(exprs: Sequence[str]) -> str:
+    if len(exprs) == 1:
+        return f'({exprs[0]},)'
+    return '(' + ', '.join(exprs) + ')'
+
+def _is_scan(atom: asts.Atom) -> bool:
+    variables = {t.x for t in atom.terms if isinstance(t, asts.Variable)}
+    return len(variables) == len(atom.terms)
+
+def rule_source(name: str,
+                rule: asts.Rule,
+                atoms: Sequence[asts.Atom],
+                predicates: Dict[asts.Predicate, str]) \
+                -> List[str]:
+    """
+    `rule_source(name, rule, atoms, predicates)` returns the lines of a Python
+    function `name(db, index)` that evaluates `rule` (see `CompiledRule`),
+    joining the positive atoms of the rule in the order of `atoms`. Every atom
+    is a loop over either its whole relation or, if it has constants or bound
+    variables, the tuples found by probing an index. Every negative atom is
+    checked as soon as its variables are bound, and so is every built-in
+    predicate, which either filters the bindings or computes a new local
+    variable. The head tuple is built directly from local variables.
+    `predicates` maps every predicate to the name of the global variable that
+    holds it, and new predicates are added to it. For example,
+    `p(X, Z) :- q(X, Y), r(Y, Z, a), !s(Z).` becomes
+
+        def rule_0(db, index):
+            out = set()
+            add = out.add
+            n0 = db[P0]
+            r0 = db[P1]
+            i1 = index(P2, (0, 2)).get
+            for (v0, v1) in r0:
+                for (_, v2, _) in i1((v1, 'a'), ()):
+                    if (v2,) in n0:
+                        continue
+                    add((v0, v2))
+            return out
+    """
+    def predicate(p: asts.Predicate) -> str:
+        if p not in predicates:
+            predicates[p] = f'P{len(predicates)}'
+        return predicates[p]
+
+    names: Dict[str, str] = {}
+    def term(t: asts.Term) -> str:
+        if isinstance(t, asts.Constant):
+            return repr(t.x)
+        return names[t.x]
+
+    def expression(e: asts.Expression) -> str:
+        if isinstance(e, asts.Arithmetic):
+            return f'arithmetic({e.op!r}, {term(e.left)}, {term(e.right)})'
+        return term(e)
+
+    negatives = [l.atom for l in rule.body if l.is_negative()]
+
+    # Rules like `p(X, Y)@next :- p(X, Y), !q(X, Y).` are a set difference.
+    if (len(atoms) == 1 and
+        len(rule.builtins) == 0 and
+        _is_scan(atoms[0]) and
+        rule.head.terms == atoms[0].terms and
+        all(a.terms == atoms[0].terms for a in negatives)):
+        relations = [f'db[{predicate(a.predicate)}]'
+                     for a in [atoms[0]] + negatives]
+        return [f'def {name}(db, index):',
+                f'    return {" - ".join(relations)}']
+
+    # The relations of the rule are fetched from `db` once, in `header`.
+    header = [f'def {name}(db, index):',
+              '    out = set()',
+              '    add = out.add']
+    for (i, atom) in enumerate(negatives):
+        header.append(f'    n{i} = db[{predicate(atom.predicate)}]')
+    body: List[str] = []
+    indent = '    '
+    checked: Set[int] = set()
+
+    pending = list(rule.builtins)
+    def apply_builtins(exit: str) -> None:
+        for (b, assignment) in builtin.ready(pending, set(names)):
+            if assignment is not None:
+                (x, e) = assignment
+                names[x] = f'v{len(names)}'
+                body.append(f'{indent}{names[x]} = {expression(e)}')
+                if isinstance(e, asts.Arithmetic):
+                    body.append(f'{indent}if {names[x]} is None:')
+                    body.append(f'{indent}    {exit}')
+            elif (b.op in ['=', '!='] and
+                  not isinstance(b.left, asts.Arithmetic) and
+                  not isinstance(b.right, asts.Arithmetic)):
+                negated = '!=' if b.op == '=' else '=='
+                body.append(f'{indent}if {term(b.left)} {negated} '
+                            f'{term(b.right)}:')
+                body.append(f'{indent}    {exit}')
+            else:
+                body.append(f'{indent}if not compare({b.op!r}, '
+                            f'{expression(b.left)}, {expression(b.right)}):')
+                body.append(f'{indent}    {exit}')
+
+    def check_negatives(exit: str) -> None:
+        for (i, atom) in enumerate(negatives):
+            variables = {v.x for v in atom.variables()}
+            if i not in checked and variables <= set(names):
+                checked.add(i)
+                terms = [term(t) for t in atom.terms]
+                body.append(f'{indent}if {_tuple(terms)} in n{i}:')
+                body.append(f'{indent}    {exit}')
+
+    apply_builtins('return out')
+    check_negatives('return out')
+    for (k, atom) in enumerate(atoms):
+        # Constants and bound variables form the key of an index lookup, new
+        # variables are unpacked from the tuple, and repeated new variables
+        # (e.g. Y in `p(Y, Y)`) are unpacked and checked for equality.
+        columns: List[str] = []
+        key: List[str] = []
+        targets: List[str] = []
+        checks: List[Tuple[str, str]] = []
+        new: Set[str] = set()
+        for (i, t) in enumerate(atom.terms):
+            if isinstance(t, asts.Variable) and t.x in new:
+                targets.append(f't{k}_{i}')
+                checks.append((f't{k}_{i}', names[t.x]))
+            elif isinstance(t, asts.Constant) or t.x in names:
+                columns.append(str(i))
+                key.append(term(t))
+                targets.append('_')
+            else:
+                new.add(t.x)
+                names[t.x] = f'v{len(names)}'
+                targets.append(names[t.x])
+
+        if len(columns) == 0:
+            header.append(f'    r{k} = db[{predicate(atom.predicate)}]')
+            source = f'r{k}'
+        else:
+            header.append(f'    i{k} = index({predicate(atom.predicate)}, '
+                          f'{_tuple(columns)}).get')
+            source = f'i{k}({_tuple(key)}, ())'
+        target = _tuple(targets) if len(targets) > 0 else '_'
+        body.append(f'{indent}for {target} in {source}:')
+        indent += '    '
+        for (a, b) in checks:
+            body.append(f'{indent}if {a} != {b}:')
+            body.append(f'{indent}    continue')
+        apply_builtins('continue')
+        check_negatives('continue')
+
+    head = [term(t) for t in rule.head.terms]
+    body.append(f'{indent}add({_tuple(head) if len(head) > 0 else "()"})')
+    body.append('    return out')
+    return header + body
+
+def program_source(rules: Sequence[Tuple[asts.Rule, Sequence[asts.Atom]]]) \
+        -> str:
+    """
+    `program_source(rules)` returns the source of a Python module with a
+    function `rule_i` (see `rule_source`) for the i-th rule of `rules`, which
+    is a list of rules and the join orders of their positive atoms. The
+    predicates of the rules are global variables of the module.
+    """
+    predicates: Dict[asts.Predicate, str] = {}
+    functions = ['\n'.join(rule_source(f'rule_{i}', rule, atoms, predicates))
+                 for (i, (rule, atoms)) in enumerate(rules)]
+    globals_ = [f'{name} = Predicate({p.x!r})'
+                for (p, name) in predicates.items()]
+    return '\n'.join(globals_) + '\n\n' + '\n\n'.join(functions) + '\n'
+
+def compile_rules(rules: Sequence[Tuple[asts.Rule, Sequence[asts.Atom]]]) \
+        -> List[CompiledRule]:
+    """
+    `compile_rules(rules)` compiles the source of `rules` (see
+    `program_source`) and returns the compiled function of every rule. A
+    program's source is compiled once: the functions are cached by a hash of
+    the source, so a program that is planned again, or another program with
+    the same rules, reuses them.
+    """
+    source = program_source(rules)
+    key = hashlib.sha1(source.encode()).hexdigest()
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    namespace: Dict[str, Any] = {'Predicate': asts.Predicate,
+                                 'arithmetic': builtin.arithmetic,
+                                 'compare': builtin.compare}
+    exec(compile(source, f'<dedalus {key[:8]}>', 'exec'), namespace)
+    functions = [namespace[f'rule_{i}'] for i in range(len(rules))]
+    with _cache_lock:
+        _cache[key] = functions
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return functions
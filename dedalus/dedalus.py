@@ -1,18 +1,31 @@
 #! /usr/bin/env python
 
-from typing import Callable
+from typing import Any, Callable, List, Optional
 import argparse
 import json
 import random
 
+from tabulate import tabulate
 import networkx as nx
 
 from desugar import desugar
-from parser import parse
+from parser import parse, parse_atom
+from relation import SYMBOLS, Storage
 from repl import repl
-from run import run, spawn
+from run import Process, memory_usage, run, spawn
+from slicing import slice_program
+from spill import SpillingAsyncBuffer
 from typecheck import typecheck
+import actors
 import asts
+import check
+import cluster
+import explore
+import ingest
+import magic
+import output
+import server
+import sql
 
 
 def _parse_from_file(filename: str) -> asts.Program:
@@ -40,13 +53,187 @@ def _pdg(filename: str) -> None:
     pdg_json = nx.node_link_data(pdg)
     print(json.dumps(pdg_json, indent=4))
 
-def _run(filename: str, timesteps: int, randint: Callable[[], int]) -> None:
+def _observed(observe: Optional[str]) -> List[asts.Predicate]:
+    if observe is None:
+        return []
+    return [asts.Predicate(p.strip()) for p in observe.split(',')]
+
+def _storage(spec: Optional[str], compact: bool) -> Storage:
+    if spec is None:
+        return Storage('compact' if compact else 'set')
+    return Storage.parse(spec)
+
+def _megabytes(mb: Optional[float]) -> Optional[int]:
+    return None if mb is None else int(mb * 1024 * 1024)
+
+def _run(filename: str,
+         timesteps: int,
+         randint: Callable[[], int],
+         inputs: List[str],
+         wait: bool,
+         observed: List[asts.Predicate],
+         storage: Storage,
+         memory: bool,
+         memory_budget: Optional[int],
+         spill_directory: Optional[str],
+         incremental: bool,
+         skip_unchanged: bool,
+         engine: str,
+         sqlite_file: str,
+         use_actors: bool,
+         format_: str,
+         output_path: str,
+         limit: Optional[int],
+         sort: Optional[bool]) -> None:
+    program = _parse_from_file(filename)
+    program = desugar(program)
+    program = typecheck(program)
+    # Input facts are checked against the whole program, even if it's sliced.
+    full = program
+    if len(observed) != 0:
+        program = slice_program(program, set(observed))
+    if use_actors:
+        _run_actors(program, timesteps)
+        return
+    if engine == 'sqlite':
+        if len(inputs) != 0:
+            raise ValueError('The sqlite engine does not read --input.')
+        sqlite_engine = sql.Engine(program, randint, sqlite_file)
+        sqlite_engine.run(timesteps)
+        output.write(sqlite_engine.process(), format_, output_path, limit,
+                     sort)
+        return
+    process = spawn(program, randint, False, memory_budget, spill_directory,
+                    incremental, engine == 'codegen', storage, skip_unchanged)
+    if len(inputs) == 0:
+        process = run(process, timesteps)
+    else:
+        channels = [ingest.open_channel(address) for address in inputs]
+        try:
+            process = ingest.run(process, timesteps, channels, wait, full)
+        finally:
+            for channel in channels:
+                channel.close()
+    output.write(process, format_, output_path, limit, sort)
+    if memory:
+        _print_memory_usage(process)
+
+def _run_actors(program: asts.Program, timesteps: int) -> None:
+    runtime = actors.Runtime(program)
+    processes = runtime.run(timesteps)
+    for (location, process) in sorted(processes.items()):
+        header = f'Location {location}.'
+        print(header + '\n' + ('#' * len(header)))
+        print(str(process))
+    print(tabulate(runtime.statistics(),
+                   headers=['location', 'timestep', 'sent', 'received'],
+                   tablefmt='orgtbl'))
+
+def _cluster(filename: str, timesteps: int, workers: int) -> None:
+    program = typecheck(desugar(_parse_from_file(filename)))
+    (processes, results) = cluster.run(program, timesteps, workers)
+    for (location, process) in sorted(processes.items()):
+        header = f'Location {location}.'
+        print(header + '\n' + ('#' * len(header)))
+        print(str(process))
+    print(tabulate(cluster.link_table(results),
+                   headers=['src', 'dst', 'frames', 'tuples', 'bytes',
+                            'tuples/s', 'latency (ms)'],
+                   tablefmt='orgtbl'))
+    dropped = sum(result.dropped for result in results)
+    if dropped > 0:
+        print(f'{dropped} async tuples arrived after their worker finished.')
+
+def _explore(filename: str,
+             schedules: int,
+             timesteps: int,
+             seed: int,
+             low: int,
+             high: int,
+             processes: Optional[int],
+             show: bool) -> None:
+    program = typecheck(desugar(_parse_from_file(filename)))
+    outcomes = explore.explore(program, schedules, timesteps, seed, low, high,
+                               processes)
+    rows = [[i, o.fingerprint[:12], o.schedules,
+             f'{100 * o.schedules / schedules:.2f}%', o.quiescent,
+             ', '.join(str(s) for s in o.seeds)]
+            for (i, o) in enumerate(outcomes)]
+    print(tabulate(rows, headers=['outcome', 'fingerprint', 'schedules',
+                                  'frequency', 'quiescent', 'seeds'],
+                   tablefmt='orgtbl'))
+    print(f'{len(outcomes)} distinct outcome(s) in {schedules} schedules.')
+    if show:
+        for (i, o) in enumerate(outcomes):
+            (process, _) = explore.explore_one(program, timesteps, o.seeds[0],
+                                               low, high)
+            header = f'Outcome {i} (seed {o.seeds[0]}).'
+            print(header + '\n' + ('#' * len(header)))
+            print(str(process))
+
+def _check(filename: str,
+           timesteps: int,
+           low: int,
+           high: int,
+           search: str,
+           max_states: Optional[int],
+           visited_budget: Optional[int],
+           spill_directory: Optional[str],
+           show: bool) -> None:
+    program = typecheck(desugar(_parse_from_file(filename)))
+    (outcomes, statistics) = check.check(program, timesteps, low, high, search,
+                                         max_states, visited_budget,
+                                         spill_directory)
+    rows = [[i, o.fingerprint[:12], o.states, len(o.witness)]
+            for (i, o) in enumerate(outcomes)]
+    print(tabulate(rows, headers=['outcome', 'fingerprint', 'states',
+                                  'choices'],
+                   tablefmt='orgtbl'))
+    print(tabulate([list(statistics)], headers=list(statistics._fields),
+                   tablefmt='orgtbl'))
+    if len(outcomes) == 1:
+        print(f'Confluent for {timesteps} timesteps.')
+    else:
+        print(f'Not confluent: {len(outcomes)} outcomes.')
+    if show:
+        for (i, o) in enumerate(outcomes):
+            header = f'Outcome {i}.'
+            print(header + '\n' + ('#' * len(header)))
+            print(tabulate([[t, p.x, tuple_, d] for (t, p, tuple_, d)
+                                                in o.witness],
+                           headers=['timestep', 'predicate', 'tuple',
+                                    'delay'],
+                           tablefmt='orgtbl'))
+            print(str(o.process))
+
+def _print_memory_usage(process: Process) -> None:
+    usage = memory_usage(process)
+    rows: List[List[Any]] = [[p.x, size, bytes_]
+                             for (p, (size, bytes_)) in sorted(usage.items())]
+    rows.append(['(total)',
+                 sum(size for (size, _) in usage.values()),
+                 sum(bytes_ for (_, bytes_) in usage.values())])
+    if len(SYMBOLS.values) > 0:
+        rows.append(['(symbols)', len(SYMBOLS.values), SYMBOLS.nbytes()])
+    if isinstance(process.async_buffer, SpillingAsyncBuffer):
+        rows.append(['(spilled)', '', process.async_buffer.spilled_bytes()])
+    print(tabulate(rows, headers=['predicate', 'tuples', 'bytes'],
+                   tablefmt='orgtbl'))
+
+def _query(filename: str,
+           atom: str,
+           timestep: int,
+           randint: Callable[[], int]) -> None:
     program = _parse_from_file(filename)
     program = desugar(program)
     program = typecheck(program)
-    process = spawn(program, randint)
-    process = run(process, timesteps)
-    print(str(process))
+    query = magic.desugar_query(parse_atom(atom))
+    program = slice_program(program, {query.predicate})
+    tuples = magic.run_query(program, query, timestep, randint)
+    if len(query.variables()) == 0:
+        print(len(tuples) > 0)
+    else:
+        print(tabulate(sorted(tuples), tablefmt='orgtbl'))
 
 def main(args: argparse.Namespace) -> None:
     if args.subcommand == 'parse':
@@ -62,9 +249,30 @@ def main(args: argparse.Namespace) -> None:
     elif args.subcommand == 'run':
         assert 1 <= args.low <= args.high
         randint = lambda: random.randint(args.low, args.high)
-        _run(args.filename, args.timesteps, randint)
+        _run(args.filename, args.timesteps, randint, args.input, args.wait,
+             _observed(args.observe), _storage(args.storage, args.compact),
+             args.memory, _megabytes(args.memory_budget), args.spill_dir,
+             args.incremental, args.skip_unchanged, args.engine,
+             args.sqlite_file, args.actors, args.format, args.output,
+             args.limit, args.sort)
+    elif args.subcommand == 'cluster':
+        _cluster(args.filename, args.timesteps, args.workers)
+    elif args.subcommand == 'explore':
+        _explore(args.filename, args.schedules, args.timesteps, args.seed,
+                 args.low, args.high, args.processes, args.show)
+    elif args.subcommand == 'check':
+        _check(args.filename, args.timesteps, args.low, args.high,
+               args.search, args.max_states, args.visited_budget,
+               args.spill_dir, args.show)
+    elif args.subcommand == 'query':
+        assert 1 <= args.low <= args.high
+        randint = lambda: random.randint(args.low, args.high)
+        _query(args.filename, args.atom, args.timestep, randint)
     elif args.subcommand == 'repl':
         repl(args.filename)
+    elif args.subcommand == 'serve':
+        server.serve(args.filename, args.host, args.port, args.timesteps,
+                     args.low, args.high)
     else:
         print(f'Unrecognized subcommand "{args.subcommand}".')
 
@@ -83,11 +291,127 @@ def get_parser() -> argparse.ArgumentParser:
     run.add_argument('--timesteps', type=int, default=10)
     run.add_argument('--low', type=int, default=1)
     run.add_argument('--high', type=int, default=10)
+    run.add_argument('--input', action='append', default=[],
+                     help='Stream of timestamped facts: a file, a pipe, '
+                          '"-" for stdin, or "unix:<path>" for a Unix socket.')
+    run.add_argument('--no_wait', dest='wait', action='store_false',
+                     help="Don't wait for input before each timestep.")
+    run.add_argument('--observe', default=None,
+                     help='Comma separated list of predicates to observe. '
+                          'Rules that cannot affect them are not run, and '
+                          'input facts of the predicates they remove are '
+                          'dropped.')
+    run.add_argument('--compact', action='store_true',
+                     help='Store relations as packed arrays of interned '
+                          'constants.')
+    run.add_argument('--storage', default=None,
+                     help='Relation backends: a default backend followed by '
+                          'comma separated predicate=backend pairs, e.g. '
+                          '"set,kvs=compact". The backends are set, compact '
+                          'and indexed. Overrides --compact.')
+    run.add_argument('--memory', action='store_true',
+                     help='Print the memory used by every relation.')
+    run.add_argument('--memory_budget', type=float, default=None,
+                     help='Spill async tuples for future timesteps to disk '
+                          'once the async buffer uses this many megabytes.')
+    run.add_argument('--spill_dir', default=None,
+                     help='Directory for spilled async tuples. Defaults to '
+                          'a temporary directory.')
+    run.add_argument('--incremental', action='store_true',
+                     help='Maintain deductive relations incrementally '
+                          'across timesteps rather than recomputing them.')
+    run.add_argument('--skip_unchanged', action='store_true',
+                     help="Don't evaluate strata and rules whose inputs "
+                          "didn't change since the previous timestep.")
+    run.add_argument('--engine', choices=['interpreter', 'codegen', 'sqlite'],
+                     default='interpreter',
+                     help='Interpret rules, compile every rule to a '
+                          'specialized Python function, or store relations '
+                          'in SQLite and run rules as SQL.')
+    run.add_argument('--sqlite_file', default=':memory:',
+                     help='Database file of the sqlite engine. Defaults to '
+                          'an in-memory database.')
+    run.add_argument('--actors', action='store_true',
+                     help='Run every location as an actor with its own '
+                          'clock in an asyncio event loop.')
+    run.add_argument('--format', choices=output.FORMATS, default='text',
+                     help='Format of the final state. The csv format writes '
+                          'a file per predicate to the --output directory.')
+    run.add_argument('--output', default='-',
+                     help='File (or directory) to write the final state to. '
+                          'Defaults to stdout.')
+    run.add_argument('--limit', type=int, default=None,
+                     help='Write at most this many tuples of every relation.')
+    run.add_argument('--sort', action='store_const', const=True, default=None,
+                     help='Sort tuples. Only the text format is sorted by '
+                          'default.')
+
+    cluster = subparsers.add_parser('cluster')
+    cluster.add_argument('filename', help='Dedalus file.')
+    cluster.add_argument('--timesteps', type=int, default=10)
+    cluster.add_argument('--workers', type=int, default=2,
+                         help='Number of OS processes. Locations are '
+                              'assigned to processes by hash.')
+
+    explore = subparsers.add_parser('explore')
+    explore.add_argument('filename', help='Dedalus file.')
+    explore.add_argument('--schedules', type=int, default=1000,
+                         help='Number of async delay schedules to run.')
+    explore.add_argument('--timesteps', type=int, default=100,
+                         help='Maximum number of timesteps of a schedule. '
+                              'Schedules stop early at a fixpoint.')
+    explore.add_argument('--seed', type=int, default=0,
+                         help='Schedule i is seeded with seed + i.')
+    explore.add_argument('--low', type=int, default=1)
+    explore.add_argument('--high', type=int, default=10)
+    explore.add_argument('--processes', type=int, default=None,
+                         help='Number of OS processes. Defaults to one per '
+                              'core.')
+    explore.add_argument('--show', action='store_true',
+                         help='Print the final state of every outcome.')
+
+    check = subparsers.add_parser('check')
+    check.add_argument('filename', help='Dedalus file.')
+    check.add_argument('--timesteps', type=int, default=10)
+    check.add_argument('--low', type=int, default=1)
+    check.add_argument('--high', type=int, default=3)
+    check.add_argument('--search', choices=['bfs', 'dfs'], default='bfs')
+    check.add_argument('--max_states', type=int, default=None,
+                       help='Give up after exploring this many states.')
+    check.add_argument('--visited_budget', type=int, default=None,
+                       help='Spill visited states to disk once there are '
+                            'this many in memory.')
+    check.add_argument('--spill_dir', default=None,
+                       help='Directory for spilled visited states. Defaults '
+                            'to a temporary directory.')
+    check.add_argument('--show', action='store_true',
+                       help='Print the final state of every outcome and '
+                            'the delays that lead to it.')
+
+    query = subparsers.add_parser('query')
+    query.add_argument('filename', help='Dedalus file.')
+    query.add_argument('atom', help='Query atom, e.g. "path(#node, a, Y)".')
+    query.add_argument('--timestep', type=int, default=0,
+                       help='Timestep to query. Earlier timesteps run only '
+                            'the rules that carry tuples to later timesteps, '
+                            'and the relations they read are computed in '
+                            'full.')
+    query.add_argument('--low', type=int, default=1)
+    query.add_argument('--high', type=int, default=10)
 
     repl = subparsers.add_parser('repl')
-    repl.add_argument('filename', nargs='?', default=None, help='Dedalus file.')
+    repl.add_argument('filename', nargs='?', default=None,
+                      help='Dedalus file.')
 
-    # TODO(mwhittaker): Add server.
+    serve = subparsers.add_parser('serve')
+    serve.add_argument('filename', nargs='?', default=None,
+                       help='Dedalus file.')
+    serve.add_argument('--host', default='localhost')
+    serve.add_argument('--port', type=int, default=8000)
+    serve.add_argument('--timesteps', type=int, default=1000,
+                       help='Maximum number of timesteps of a run.')
+    serve.add_argument('--low', type=int, default=1)
+    serve.add_argument('--high', type=int, default=10)
 
     return parser
 
@@ -1,13 +1,12 @@
-import copy
-
 import asts
 
 def _atom_contains_location(atom: asts.Atom) -> bool:
     return any(term.is_location for term in atom.terms)
 
-def desugar(program: asts.Program) -> asts.Program:
-    program = copy.deepcopy(program)
+def _locate(atom: asts.Atom, location: asts.Term) -> asts.Atom:
+    return asts.intern(atom._replace(terms=(location,) + atom.terms))
 
+def desugar(program: asts.Program) -> asts.Program:
     # If a rule doesn't have any explicit location specifiers, then we inject a
     # location specifier to the head of every atom in the rule. For example,
     # this rule:
@@ -21,13 +20,17 @@ def desugar(program: asts.Program) -> asts.Program:
     # The variable name `_L` begins with an underscore, so it is guaranteed not
     # to conflict with any of the constants or variables in the rule. If any
     # atom in the rule has an explicit location specifier, then the rule is
-    # left unchanged.
+    # left unchanged. ASTs are immutable, so unchanged rules are shared with
+    # `program` rather than copied.
+    L = asts.intern(asts.Variable("_L", is_location=True))
+    rules = []
     for rule in program.rules:
         atoms = [rule.head] + [literal.atom for literal in rule.body]
         if any(_atom_contains_location(atom) for atom in atoms):
+            rules.append(rule)
             continue
-        L = asts.Variable("_L", is_location=True)
-        for atom in atoms:
-            atom.terms.insert(0, L)
-
-    return program
+        body = tuple(asts.intern(l._replace(atom=_locate(l.atom, L)))
+                     for l in rule.body)
+        rules.append(asts.intern(rule._replace(head=_locate(rule.head, L),
+                                               body=body)))
+    return asts.Program(tuple(rules))
@@ -55,5 +55,11 @@ class TestDesugar(unittest.TestCase):
         # Test that desugaring doesn't affect the original program.
         self.assertEqual(program, get_program())
 
+        # Rules that aren't desugared are shared with the original program,
+        # and identical rules are desugared into the same rule.
+        self.assertIs(desugared.rules[3], program.rules[3])
+        twice = desugar.desugar(parser.parse('p(X) :- q(X). p(X) :- q(X).'))
+        self.assertIs(twice.rules[0], twice.rules[1])
+
 if __name__ == '__main__':
     unittest.main()
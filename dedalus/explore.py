@@ -0,0 +1,152 @@
+from collections import defaultdict
+from typing import Any, DefaultDict, Dict, Iterable, List, NamedTuple, Tuple
+import hashlib
+import multiprocessing
+import random
+
+from run import Database, Process, spawn, step
+import asts
+
+
+class Schedule(NamedTuple):
+    seed: int
+    fingerprint: str
+    # The timestep at which the schedule reached a fixpoint, or None if it
+    # ran for every timestep without reaching one.
+    quiescent: Any
+
+class Outcome(NamedTuple):
+    fingerprint: str
+    schedules: int
+    seeds: List[int] # The first few seeds that produced the outcome.
+    quiescent: int # The number of schedules that reached a fixpoint.
+
+# The number of seeds kept for every outcome.
+_SEEDS = 5
+
+def fingerprint(database: Database) -> str:
+    """
+    `fingerprint(database)` returns a hash of the contents of `database` that
+    doesn't depend on the order in which relations or tuples are stored.
+    """
+    h = hashlib.sha1()
+    for p in sorted(database):
+        if len(database[p]) > 0:
+            h.update(repr((p.x, sorted(database[p]))).encode())
+    return h.hexdigest()
+
+def _relative(process: Process) -> Tuple[Database, Dict[int, Any]]:
+    # The state of a process with the timesteps of its async buffer relative
+    # to its clock.
+    buffer = {t - process.timestep: {p: r for (p, r) in db.items()
+                                     if len(r) > 0}
+              for (t, db) in process.async_buffer.items()}
+    return (process.database,
+            {t: db for (t, db) in buffer.items() if len(db) > 0})
+
+def _step(process: Process) -> Tuple[Process, bool]:
+    # `_step(process)` is `run.step(process)`, but also returns whether the
+    # step produced any async tuples.
+    sent: List[Tuple[asts.Predicate, Tuple[Any, ...]]] = []
+    timestep = process.timestep
+    process = step(process, lambda p, tuple_: sent.append((p, tuple_)))
+    # Tuples are sent in the iteration order of sets, which depends on the
+    # hash seed, so they're sorted before their delays are drawn. Otherwise,
+    # a seed wouldn't reproduce a schedule in another interpreter.
+    for (p, tuple_) in sorted(sent):
+        async_timestep = timestep + process.randint()
+        process.async_buffer[async_timestep][p].add(tuple_)
+    return (process, len(sent) > 0)
+
+def explore_one(program: asts.Program,
+                timesteps: int,
+                seed: int,
+                low: int = 1,
+                high: int = 10) \
+                -> Tuple[Process, Any]:
+    """
+    `explore_one(program, timesteps, seed, low, high)` runs `program` for
+    `timesteps` timesteps with async delays drawn uniformly from [low, high]
+    by a random number generator seeded with `seed`. It returns the final
+    process and the timestep at which the process reached a fixpoint, or
+    None if it never did.
+
+    A process is at a fixpoint when a timestep leaves its database and
+    (relative) async buffer unchanged, produces no async tuples, and no
+    constant time rules remain: every later timestep would be identical, so
+    the run stops early.
+    """
+    rng = random.Random(seed)
+    process = spawn(program, lambda: rng.randint(low, high))
+    constant_times = [r.rule_type.time for r in program.rules
+                      if isinstance(r.rule_type, asts.ConstantTimeRule)]
+    before = _relative(process)
+    while process.timestep < timesteps:
+        (process, sent) = _step(process)
+        after = _relative(process)
+        if (not sent and after == before and
+                all(t < process.timestep for t in constant_times)):
+            return (process, process.timestep)
+        before = after
+    return (process, None)
+
+# The arguments of every schedule, set in every worker of the pool.
+_ARGS: Tuple[asts.Program, int, int, int] = None # type: ignore
+
+def _init(program: asts.Program, timesteps: int, low: int, high: int) -> None:
+    global _ARGS
+    _ARGS = (program, timesteps, low, high)
+
+def _explore(seed: int) -> Schedule:
+    (program, timesteps, low, high) = _ARGS
+    (process, quiescent) = explore_one(program, timesteps, seed, low, high)
+    return Schedule(seed, fingerprint(process.database), quiescent)
+
+def _aggregate(schedules: Iterable[Schedule]) -> List[Outcome]:
+    counts: DefaultDict[str, int] = defaultdict(int)
+    seeds: DefaultDict[str, List[int]] = defaultdict(list)
+    quiescent: DefaultDict[str, int] = defaultdict(int)
+    for schedule in schedules:
+        counts[schedule.fingerprint] += 1
+        seeds[schedule.fingerprint].append(schedule.seed)
+        if schedule.quiescent is not None:
+            quiescent[schedule.fingerprint] += 1
+    outcomes = [Outcome(f, counts[f], sorted(seeds[f])[:_SEEDS], quiescent[f])
+                for f in counts]
+    return sorted(outcomes, key=lambda o: (-o.schedules, o.seeds[0]))
+
+def explore(program: asts.Program,
+            schedules: int,
+            timesteps: int,
+            seed: int = 0,
+            low: int = 1,
+            high: int = 10,
+            processes: int = None) \
+            -> List[Outcome]:
+    """
+    `explore(program, schedules, timesteps, seed, low, high, processes)` runs
+    `program` under `schedules` different async delay schedules (see
+    `explore_one`) in a pool of `processes` OS processes (by default, one per
+    core) and returns the distinct final databases, most frequent first.
+
+    Schedule i is seeded with `seed + i`, so the outcomes don't depend on the
+    number of processes or the order in which schedules run, and the final
+    database of an outcome can be reproduced with `explore_one` and any of
+    its seeds. A program is confluent (for these schedules) if it has one
+    outcome.
+    """
+    if not 1 <= low <= high:
+        raise ValueError(f'Invalid async delay range [{low}, {high}].')
+    seeds = range(seed, seed + schedules)
+    if processes == 1:
+        _init(program, timesteps, low, high)
+        return _aggregate(_explore(s) for s in seeds)
+
+    # Schedules are handed out in chunks, a few per process, to keep the
+    # overhead of sending them small.
+    processes = processes or multiprocessing.cpu_count()
+    chunksize = max(1, schedules // (4 * processes))
+    context = multiprocessing.get_context('fork')
+    with context.Pool(processes, _init,
+                      (program, timesteps, low, high)) as pool:
+        return _aggregate(pool.imap_unordered(_explore, seeds, chunksize))
@@ -0,0 +1,120 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from desugar import desugar
+from explore import explore, explore_one, fingerprint
+from run import Database
+from typecheck import typecheck
+import asts
+import parser
+
+
+class TestExplore(unittest.TestCase):
+    def program(self, source: str) -> asts.Program:
+        return typecheck(desugar(parser.parse(source)))
+
+    def test_fingerprint(self) -> None:
+        p = asts.Predicate('p')
+        q = asts.Predicate('q')
+        a: Database = {p: {('a', 'b'), ('b', 'c')}, q: set()}
+        b: Database = {q: set(), p: {('b', 'c'), ('a', 'b')}}
+        c: Database = {p: {('a', 'b')}}
+        self.assertEqual(fingerprint(a), fingerprint(b))
+        self.assertNotEqual(fingerprint(a), fingerprint(c))
+
+    def test_explore_one(self) -> None:
+        program = self.program("""
+            start(#a)@0 :- .
+            p(#a, x)@async :- start(#a).
+            q(#a, x) :- p(#a, x).
+            q(#a, x)@next :- q(#a, x).
+        """)
+        (process, quiescent) = explore_one(program, 100, 0)
+        self.assertIsNotNone(quiescent)
+        self.assertLess(quiescent, 100)
+        self.assertEqual(process.database[asts.Predicate('q')],
+                         {('a', 'x')})
+
+        # Schedules are deterministic.
+        (again, quiescent_again) = explore_one(program, 100, 0)
+        self.assertEqual(again.database, process.database)
+        self.assertEqual(quiescent_again, quiescent)
+
+        # A process that never quiesces runs for every timestep.
+        (process, quiescent) = explore_one(self.program("""
+            p(#a, x)@async :- p(#a, x).
+            p(#a, x)@0 :- .
+        """), 10, 0)
+        self.assertIsNone(quiescent)
+        self.assertEqual(process.timestep, 10)
+
+    def test_explore_one_hash_seed(self) -> None:
+        # A seed reproduces a schedule in another interpreter, whose sets of
+        # tuples iterate in a different order.
+        script = '''if True:
+            from desugar import desugar
+            from explore import explore_one, fingerprint
+            from typecheck import typecheck
+            import parser
+            program = typecheck(desugar(parser.parse("""
+                item(#a, v)@0 :- .
+                item(#a, w)@0 :- .
+                item(#a, x)@0 :- .
+                item(#a, y)@0 :- .
+                item(#a, z)@0 :- .
+                m(#a, X)@async :- item(#a, X).
+                first(#a, X) :- m(#a, X), !seen(#a).
+                seen(#a)@next :- m(#a, X).
+                seen(#a)@next :- seen(#a).
+                first(#a, X)@next :- first(#a, X).
+            """)))
+            (process, quiescent) = explore_one(program, 30, 7)
+            print(fingerprint(process.database), quiescent)
+        '''
+        directory = os.path.dirname(os.path.abspath(__file__))
+        outputs = set()
+        for hash_seed in ['1', '2', '3', '4']:
+            env = dict(os.environ, PYTHONHASHSEED=hash_seed)
+            outputs.add(subprocess.check_output([sys.executable, '-c', script],
+                                                cwd=directory, env=env))
+        self.assertEqual(len(outputs), 1)
+
+    def test_explore(self) -> None:
+        # Whether x or y arrives first is a race.
+        program = self.program("""
+            start(#a)@0 :- .
+            m(#a, x)@async :- start(#a).
+            m(#a, y)@async :- start(#a).
+            first(#a, X) :- m(#a, X), !seen(#a).
+            seen(#a)@next :- m(#a, X).
+            seen(#a)@next :- seen(#a).
+            first(#a, X)@next :- first(#a, X).
+        """)
+        outcomes = explore(program, 200, 30, low=1, high=3, processes=2)
+        self.assertEqual(sum(o.schedules for o in outcomes), 200)
+        self.assertGreater(len(outcomes), 1)
+        for o in outcomes:
+            (process, _) = explore_one(program, 30, o.seeds[0], 1, 3)
+            self.assertEqual(fingerprint(process.database), o.fingerprint)
+
+        serial = explore(program, 200, 30, low=1, high=3, processes=1)
+        self.assertEqual(serial, outcomes)
+
+        confluent = self.program("""
+            start(#a)@0 :- .
+            m(#a, x)@async :- start(#a).
+            m(#a, y)@async :- start(#a).
+            got(#a, X) :- m(#a, X).
+            got(#a, X)@next :- got(#a, X).
+        """)
+        outcomes = explore(confluent, 50, 30, processes=2)
+        self.assertEqual(len(outcomes), 1)
+        self.assertEqual(outcomes[0].quiescent, 50)
+
+        with self.assertRaises(ValueError):
+            explore(program, 1, 1, low=0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,249 @@
+from typing import Dict, List, Optional, Tuple
+import os
+import re
+import select
+import socket
+import sys
+
+from run import Process, step
+import asts
+
+
+# A fact `p(#a, b, c)@t.` is represented as the triple (t, p, (a, b, c)).
+Fact = Tuple[int, asts.Predicate, Tuple[str, ...]]
+
+# The number of bytes read from a channel at a time.
+BATCH_SIZE = 1 << 16
+
+_fact_re = re.compile(r'\s*([a-z]\w*)\s*\((.*)\)\s*@\s*(\d+)\s*\.?\s*$')
+_constant_re = re.compile(r'\s*#?\s*([a-z0-9]\w*)\s*$')
+
+
+def parse_fact(line: str) -> Fact:
+    """
+    `parse_fact(line)` parses a single timestamped fact. Facts are written
+    using the same syntax as the body-less constant time rules of a Dedalus
+    program, though the trailing period is optional:
+
+        parse_fact('p(#a, b, c)@3.') == (3, Predicate('p'), ('a', 'b', 'c'))
+        parse_fact('p(#a)@0') == (0, Predicate('p'), ('a',))
+
+    Facts are parsed with regular expressions rather than with the parser in
+    `parser.py` because input streams can contain millions of facts.
+    """
+    m = _fact_re.match(line)
+    if m is None:
+        raise ValueError(f'Malformed fact "{line}".')
+    (predicate, terms_string, time) = m.groups()
+
+    values: List[str] = []
+    if terms_string.strip() != '':
+        for term in terms_string.split(','):
+            c = _constant_re.match(term)
+            if c is None:
+                msg = f'The fact "{line}" contains the non-constant "{term}".'
+                raise ValueError(msg)
+            values.append(c.group(1))
+    return (int(time), asts.Predicate(predicate), tuple(values))
+
+
+class Channel:
+    """
+    A channel is a non-blocking stream of newline-separated facts read from a
+    file descriptor: a regular file, a pipe, a FIFO, or a Unix socket. Facts
+    in a channel must appear in non-decreasing timestep order. The largest
+    timestep read so far is the channel's `watermark`; once a channel's
+    watermark exceeds a timestep, the channel won't produce any more facts for
+    that timestep.
+    """
+    def __init__(self, fd: Optional[int], name: str) -> None:
+        self.fd = fd
+        self.name = name
+        self.closed = False
+        self.watermark = -1
+        self._partial = b''
+        if fd is not None:
+            os.set_blocking(fd, False)
+
+    def fileno(self) -> int:
+        assert self.fd is not None
+        return self.fd
+
+    def read(self) -> List[Fact]:
+        """
+        `channel.read()` reads one batch of at most `BATCH_SIZE` bytes from the
+        channel without blocking and returns the complete facts in it. Partial
+        lines are buffered until the rest of the line arrives.
+        """
+        if self.closed or self.fd is None:
+            return []
+
+        try:
+            data = os.read(self.fd, BATCH_SIZE)
+        except BlockingIOError:
+            return []
+
+        if len(data) == 0:
+            self.close()
+            lines = [self._partial]
+            self._partial = b''
+        else:
+            lines = (self._partial + data).split(b'\n')
+            self._partial = lines.pop()
+
+        facts: List[Fact] = []
+        for line in lines:
+            s = line.decode()
+            if s.strip() == '' or s.lstrip().startswith('//'):
+                continue
+            fact = parse_fact(s)
+            if fact[0] < self.watermark:
+                msg = (f'The fact "{s}" in channel {self.name} is out of '
+                       f'order. Facts must be in non-decreasing timestep '
+                       f'order.')
+                raise ValueError(msg)
+            self.watermark = fact[0]
+            facts.append(fact)
+        return facts
+
+    def close(self) -> None:
+        if not self.closed and self.fd is not None:
+            os.close(self.fd)
+        self.closed = True
+
+
+class SocketChannel(Channel):
+    """
+    A `SocketChannel` listens on a Unix socket and reads facts from the first
+    client that connects to it. The channel is closed when the client closes
+    its end of the connection.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen(1)
+        self.listener.setblocking(False)
+        self.connection: Optional[socket.socket] = None
+        super().__init__(None, f'unix:{path}')
+
+    def fileno(self) -> int:
+        if self.connection is None:
+            return self.listener.fileno()
+        return super().fileno()
+
+    def read(self) -> List[Fact]:
+        if self.closed:
+            return []
+
+        if self.connection is None:
+            try:
+                (self.connection, _) = self.listener.accept()
+            except BlockingIOError:
+                return []
+            self.fd = self.connection.detach()
+            os.set_blocking(self.fd, False)
+            self.listener.close()
+            os.unlink(self.path)
+        return super().read()
+
+    def close(self) -> None:
+        if self.connection is None and not self.closed:
+            self.listener.close()
+            os.unlink(self.path)
+        super().close()
+
+
+def open_channel(address: str) -> Channel:
+    """
+    `open_channel(address)` opens a channel. `-` is standard input,
+    `unix:<path>` is a Unix socket listening at `<path>`, and anything else is
+    the path of a file, pipe, or FIFO.
+    """
+    if address == '-':
+        return Channel(os.dup(sys.stdin.fileno()), '<stdin>')
+    elif address.startswith('unix:'):
+        return SocketChannel(address[len('unix:'):])
+    else:
+        return Channel(os.open(address, os.O_RDONLY), address)
+
+
+def _arities(program: asts.Program) -> Dict[asts.Predicate, int]:
+    arities: Dict[asts.Predicate, int] = {}
+    for rule in program.rules:
+        for atom in [rule.head] + [l.atom for l in rule.body]:
+            arities[atom.predicate] = len(atom.terms)
+    return arities
+
+def feed(process: Process,
+         facts: List[Fact],
+         program: Optional[asts.Program] = None) \
+         -> None:
+    """
+    `feed(process, facts, program)` buffers `facts` into the async buffer of
+    `process` at their target timesteps. Facts whose timestep has already
+    passed are buffered for the current timestep. Every fact must be an
+    instance of a predicate of `program` (by default, the program of
+    `process`) with the correct arity. Facts of predicates of `program` that
+    don't appear in the program of `process`, e.g. because it was sliced (see
+    `slicing.py`), are dropped.
+    """
+    arities = _arities(program or process.program)
+    relevant = _arities(process.program)
+    for (t, p, tuple_) in facts:
+        if p not in arities:
+            msg = f'The predicate {p} does not appear in the program.'
+            raise ValueError(msg)
+        if arities[p] != len(tuple_):
+            msg = (f'The fact {p}{tuple_} does not have the arity '
+                   f'{arities[p]} of predicate {p}.')
+            raise ValueError(msg)
+        if p not in relevant:
+            continue
+        t = max(t, process.timestep)
+        process.async_buffer[t][p].add(tuple_)
+
+def poll(process: Process,
+         channels: List[Channel],
+         wait: bool,
+         program: Optional[asts.Program] = None) \
+         -> None:
+    """
+    `poll(process, channels, wait, program)` reads batches of facts from
+    `channels` and feeds them into `process` (see `feed`). If `wait` is false,
+    `poll` reads whatever is available without blocking. If `wait` is true,
+    `poll` blocks until every channel is either closed or has a watermark past
+    the current timestep. In both cases, facts for future timesteps are
+    buffered as soon as they are read.
+    """
+    def pending(channel: Channel) -> bool:
+        return not channel.closed and channel.watermark <= process.timestep
+
+    for channel in channels:
+        feed(process, channel.read(), program)
+
+    if not wait:
+        return
+
+    while any(pending(c) for c in channels):
+        waiting = [c for c in channels if pending(c)]
+        (readable, _, _) = select.select(waiting, [], [])
+        for channel in readable:
+            feed(process, channel.read(), program)
+
+def run(process: Process,
+        timesteps: int,
+        channels: List[Channel],
+        wait: bool = True,
+        program: Optional[asts.Program] = None) \
+        -> Process:
+    """
+    `run(process, timesteps, channels, wait, program)` performs multiple steps
+    of a Dedalus program, feeding facts read from `channels` into the process
+    before every step. See `poll` for a description of `wait` and `feed` for a
+    description of `program`.
+    """
+    for _ in range(timesteps):
+        poll(process, channels, wait, program)
+        process = step(process)
+    return process
@@ -0,0 +1,134 @@
+import os
+import socket
+import tempfile
+import unittest
+
+from desugar import desugar
+from ingest import Channel, SocketChannel, feed, parse_fact, run
+from run import spawn
+from slicing import slice_program
+from typecheck import typecheck
+import asts
+import parser
+
+
+class TestIngest(unittest.TestCase):
+    def predicate(self, x: str) -> asts.Predicate:
+        return parser.predicate.parse_strict(x)
+
+    def program(self, source: str) -> asts.Program:
+        return typecheck(desugar(parser.parse(source)))
+
+    def test_parse_fact(self) -> None:
+        p = self.predicate('p')
+        test_cases = [
+            ('p()@0', (0, p, ())),
+            ('p()@0.', (0, p, ())),
+            ('p(#a)@1.', (1, p, ('a',))),
+            ('p(#a, b, 42)@10.', (10, p, ('a', 'b', '42'))),
+            ('  p ( # a , b ) @ 3 .  ', (3, p, ('a', 'b'))),
+        ]
+        for line, expected in test_cases:
+            self.assertEqual(parse_fact(line), expected)
+
+        bad_lines = [
+            'p(#a)',
+            'p(#a)@next.',
+            'p(#a, X)@0.',
+            'P(#a)@0.',
+            'p(#a) :- q(#a).',
+        ]
+        for line in bad_lines:
+            with self.assertRaises(ValueError):
+                parse_fact(line)
+
+    def test_feed(self) -> None:
+        program = self.program('q(X) :- p(X).')
+        p = self.predicate('p')
+        r = self.predicate('r')
+
+        process = spawn(program)
+        process = process._replace(timestep=2)
+        feed(process, [(0, p, ('l', 'a')), (2, p, ('l', 'b')),
+                       (5, p, ('l', 'c'))])
+        self.assertEqual(process.async_buffer[2][p], {('l', 'a'), ('l', 'b')})
+        self.assertEqual(process.async_buffer[5][p], {('l', 'c')})
+
+        with self.assertRaises(ValueError):
+            feed(process, [(0, r, ('l', 'a'))])
+        with self.assertRaises(ValueError):
+            feed(process, [(0, p, ('l',))])
+
+    def test_run_pipe(self) -> None:
+        program = self.program(r"""
+            seen(X) :- req(X).
+            seen(X)@next :- seen(X).
+        """)
+        req = self.predicate('req')
+        seen = self.predicate('seen')
+
+        (r, w) = os.pipe()
+        channel = Channel(r, 'pipe')
+        os.write(w, b'req(#l, a)@0.\nreq(#l, b)@0.\nreq(#l, c)@2.\nreq(#l, ')
+        os.write(w, b'd)@2.\n// A comment.\n\nreq(#l, e)@9.\n')
+        os.close(w)
+
+        process = run(spawn(program), 3, [channel])
+        self.assertEqual(process.database[req], {('l', 'c'), ('l', 'd')})
+        self.assertEqual(process.database[seen],
+                         {('l', 'a'), ('l', 'b'), ('l', 'c'), ('l', 'd')})
+        self.assertEqual(process.async_buffer[9][req], {('l', 'e')})
+        self.assertTrue(channel.closed)
+
+    def test_run_out_of_order(self) -> None:
+        program = self.program('q(X) :- p(X).')
+        (r, w) = os.pipe()
+        os.write(w, b'p(#l)@2.\np(#l)@1.\n')
+        os.close(w)
+        with self.assertRaises(ValueError):
+            run(spawn(program), 1, [Channel(r, 'pipe')])
+
+    def test_run_sliced(self) -> None:
+        # Facts of predicates that slicing removed are checked against the
+        # full program and then dropped.
+        program = self.program(r"""
+            q(X) :- p(X).
+            t(X) :- s(X).
+        """)
+        q = self.predicate('q')
+        s = self.predicate('s')
+        sliced = slice_program(program, {q})
+
+        (r, w) = os.pipe()
+        os.write(w, b'p(#l, a)@0.\ns(#l, b)@0.\np(#l, c)@1.\n')
+        os.close(w)
+        process = run(spawn(sliced), 2, [Channel(r, 'pipe')], True, program)
+        self.assertEqual(process.database[q], {('l', 'c')})
+        self.assertNotIn(s, process.database)
+
+        (r, w) = os.pipe()
+        os.write(w, b's(#l, b, c)@0.\n')
+        os.close(w)
+        with self.assertRaises(ValueError):
+            run(spawn(sliced), 1, [Channel(r, 'pipe')], True, program)
+
+    def test_run_socket(self) -> None:
+        program = self.program('q(X) :- p(X).')
+        p = self.predicate('p')
+        q = self.predicate('q')
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'input.sock')
+            channel = SocketChannel(path)
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(path)
+            client.sendall(b'p(#l, a)@0.\np(#l, b)@1.\n')
+            client.close()
+
+            process = run(spawn(program), 2, [channel])
+            self.assertEqual(process.database[q], {('l', 'b')})
+            self.assertTrue(channel.closed)
+            self.assertFalse(os.path.exists(path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+from collections import defaultdict
+from typing import Any, DefaultDict, Dict, Iterable, List, Set, Tuple
+import math
+
+import networkx as nx
+
+
+# The distance between two adjacent predicates.
+SPACING = 100.0
+
+def _name(p: Any) -> str:
+    # PDG nodes are predicates, but any node with a name will do.
+    return getattr(p, 'x', str(p))
+
+def _component_id(c: int) -> str:
+    return f'scc:{c}'
+
+class Layout:
+    """
+    A `Layout` positions the nodes of a PDG ahead of time, so that a browser
+    can draw a PDG with thousands of predicates without laying it out itself.
+
+    Every strongly connected component of the PDG is drawn as one node, so the
+    graph that's drawn is a DAG. The components are assigned to levels by the
+    longest path that reaches them, and the components of every level are
+    ordered by the mean x coordinate of their predecessors, which keeps most
+    edges short. Every component is given a square box big enough for a grid of
+    its predicates, so a component can be expanded into its predicates (see
+    `view`) without moving anything else.
+    """
+    def __init__(self, pdg: nx.DiGraph) -> None:
+        # The components, numbered in order of their smallest predicate.
+        components = sorted((sorted(c, key=_name)
+                             for c in nx.strongly_connected_components(pdg)),
+                            key=lambda c: _name(c[0]))
+        self.members: List[List[Any]] = components
+        self.component: Dict[Any, int] = {}
+        self.index: Dict[Any, int] = {}
+        for (i, members) in enumerate(components):
+            for (j, p) in enumerate(members):
+                self.component[p] = i
+                self.index[p] = j
+
+        # The edges between components, and their labels.
+        self.edges: List[Tuple[Any, Any, bool, bool]] = []
+        predecessors: DefaultDict[int, Set[int]] = defaultdict(set)
+        for (q, p, data) in pdg.edges(data=True):
+            self.edges.append((q, p, data.get('negative', False),
+                               data.get('async', False)))
+            (cq, cp) = (self.component[q], self.component[p])
+            if cq != cp:
+                predecessors[cp].add(cq)
+
+        # Assign every component the length of the longest path to it.
+        dag = nx.DiGraph()
+        dag.add_nodes_from(range(len(components)))
+        dag.add_edges_from((cq, cp) for (cp, cqs) in predecessors.items()
+                                    for cq in cqs)
+        level: Dict[int, int] = {}
+        for c in nx.topological_sort(dag):
+            level[c] = max((level[q] + 1 for q in predecessors[c]), default=0)
+        levels: DefaultDict[int, List[int]] = defaultdict(list)
+        for c in range(len(components)):
+            levels[level[c]].append(c)
+
+        # Order every level and lay out its boxes left to right, centered.
+        self.width = [math.ceil(math.sqrt(len(m))) for m in components]
+        self.x: Dict[int, float] = {}
+        self.y: Dict[int, float] = {}
+        y = 0.0
+        for l in range(len(levels)):
+            def barycenter(c: int) -> Tuple[float, int]:
+                qs = predecessors[c]
+                if len(qs) == 0:
+                    return (0.0, c)
+                return (sum(self.x[q] for q in qs) / len(qs), c)
+            row = sorted(levels[l], key=barycenter)
+            total = sum(self.width[c] for c in row) * SPACING
+            x = -total / 2
+            for c in row:
+                box = self.width[c] * SPACING
+                self.x[c] = x + box / 2
+                self.y[c] = y + box / 2
+                x += box
+            y += max(self.width[c] for c in row) * SPACING
+
+    def _position(self, p: Any) -> Tuple[float, float]:
+        # The position of predicate `p` in the grid of its component's box.
+        c = self.component[p]
+        w = self.width[c]
+        (row, column) = divmod(self.index[p], w)
+        offset = (w - 1) / 2
+        return (self.x[c] + (column - offset) * SPACING,
+                self.y[c] + (row - offset) * SPACING)
+
+    def view(self, expanded: Iterable[int] = ()) -> Dict[str, Any]:
+        """
+        `layout.view(expanded)` returns the nodes and edges of the PDG with
+        every component collapsed into a single node, except for the
+        components in `expanded` and the components of one predicate, whose
+        predicates are shown. For example,
+
+            {"nodes": [{"id": "scc:0", "component": 0, "size": 2,
+                        "members": ["p", "q"], "x": 0.0, "y": 50.0},
+                       {"id": "r", "component": 1, "size": 1,
+                        "x": 0.0, "y": 150.0}],
+             "links": [{"source": "scc:0", "target": "r",
+                        "negative": false, "async": false}]}
+
+        The edges into and out of a collapsed component are merged, and an
+        edge is negative (or async) if any of the edges merged into it is.
+        """
+        expanded = {c for c in expanded if 0 <= c < len(self.members)}
+        expanded |= {c for (c, m) in enumerate(self.members) if len(m) == 1}
+
+        def node(p: Any) -> str:
+            c = self.component[p]
+            return _name(p) if c in expanded else _component_id(c)
+
+        nodes: List[Dict[str, Any]] = []
+        for (c, members) in enumerate(self.members):
+            if c in expanded:
+                for p in members:
+                    (x, y) = self._position(p)
+                    nodes.append({'id': _name(p), 'component': c,
+                                  'size': len(members), 'x': x, 'y': y})
+            else:
+                nodes.append({'id': _component_id(c), 'component': c,
+                              'size': len(members),
+                              'members': [_name(p) for p in members],
+                              'x': self.x[c], 'y': self.y[c]})
+
+        links: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for (q, p, negative, async_) in self.edges:
+            (source, target) = (node(q), node(p))
+            if source == target and self.component[p] not in expanded:
+                continue
+            link = links.setdefault((source, target),
+                                    {'source': source, 'target': target,
+                                     'negative': False, 'async': False})
+            link['negative'] = link['negative'] or negative
+            link['async'] = link['async'] or async_
+        return {'nodes': nodes,
+                'links': [links[k] for k in sorted(links)]}
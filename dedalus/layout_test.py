@@ -0,0 +1,68 @@
+import unittest
+
+from desugar import desugar
+from layout import Layout
+import parser
+
+
+class TestLayout(unittest.TestCase):
+    def layout(self, source: str) -> Layout:
+        return Layout(desugar(parser.parse(source)).pdg())
+
+    def test_view(self) -> None:
+        layout = self.layout("""
+            a(#n, x) :- .
+            p(X) :- a(X), q(X).
+            q(X) :- p(X).
+            q(X)@async :- p(X), !b(X).
+            r(X) :- q(X).
+            r(X) :- r(X).
+        """)
+        names = [[p.x for p in c] for c in layout.members]
+        self.assertEqual(names, [['a'], ['b'], ['p', 'q'], ['r']])
+
+        view = layout.view()
+        self.assertEqual([n['id'] for n in view['nodes']],
+                         ['a', 'b', 'scc:2', 'r'])
+        self.assertEqual(view['nodes'][2]['members'], ['p', 'q'])
+        self.assertEqual(
+            [(l['source'], l['target'], l['negative'], l['async'])
+             for l in view['links']],
+            [('a', 'scc:2', False, False),
+             ('b', 'scc:2', True, True),
+             ('r', 'r', False, False),
+             ('scc:2', 'r', False, False)])
+
+        # Components are laid out top to bottom by the longest path to them.
+        y = {n['id']: n['y'] for n in view['nodes']}
+        self.assertEqual(y['a'], y['b'])
+        self.assertLess(y['b'], y['scc:2'])
+        self.assertLess(y['scc:2'], y['r'])
+
+        # Expanding a component doesn't move any other node.
+        expanded = layout.view([2])
+        self.assertEqual([n['id'] for n in expanded['nodes']],
+                         ['a', 'b', 'p', 'q', 'r'])
+        positions = {n['id']: (n['x'], n['y']) for n in expanded['nodes']}
+        for n in view['nodes']:
+            if n['id'] in positions:
+                self.assertEqual(positions[n['id']], (n['x'], n['y']))
+        self.assertEqual(len(set(positions.values())), len(positions))
+        self.assertEqual(
+            [(l['source'], l['target']) for l in expanded['links']],
+            [('a', 'p'), ('b', 'q'), ('p', 'q'), ('q', 'p'), ('q', 'r'),
+             ('r', 'r')])
+
+    def test_large(self) -> None:
+        # A chain of n cycles of two predicates each.
+        n = 500
+        rules = [f'p{i}(X) :- q{i}(X), p{i - 1}(X). q{i}(X) :- p{i}(X).'
+                 for i in range(1, n + 1)]
+        layout = self.layout('p0(#a) :- .\n' + '\n'.join(rules))
+        view = layout.view()
+        self.assertEqual(len(view['nodes']), n + 1)
+        self.assertEqual(len(view['links']), n)
+        self.assertEqual(len({n['y'] for n in view['nodes']}), n + 1)
+
+if __name__ == '__main__':
+    unittest.main()
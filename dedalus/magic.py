@@ -0,0 +1,233 @@
+from collections import defaultdict
+from typing import Callable, Dict, List, Set, Tuple
+
+import networkx as nx
+
+from desugar import desugar
+from run import (AsyncBuffer, Database, Process, Relation,
+                 _empty_default_database, _eval_deductive, _eval_inputs,
+                 _unify, run, spawn)
+from slicing import relevant_predicates
+import asts
+
+
+# An adornment is a string of b's and f's, one per term of an atom. A `b`
+# marks a term that is bound when the atom is evaluated and an `f` marks a
+# term that is free. For example, when answering the query `path(#a, b, Y)`,
+# the atom `path(#L, X, Y)` has the adornment `bbf`.
+Adornment = str
+
+def _adornment(atom: asts.Atom, bound: Set[str]) -> Adornment:
+    def is_bound(term: asts.Term) -> bool:
+        return isinstance(term, asts.Constant) or term.x in bound
+    return ''.join('b' if is_bound(term) else 'f' for term in atom.terms)
+
+def _bound_terms(atom: asts.Atom, adornment: Adornment) \
+        -> Tuple[asts.Term, ...]:
+    return tuple(t for (t, a) in zip(atom.terms, adornment) if a == 'b')
+
+# Adorned and magic predicates begin with an underscore, so they are
+# guaranteed not to conflict with any of the predicates in the program. See
+# `desugar.py` for a similar trick.
+def _adorned(p: asts.Predicate, adornment: Adornment) -> asts.Predicate:
+    return asts.Predicate(f'_{p.x}_{adornment}')
+
+def _magic(p: asts.Predicate, adornment: Adornment) -> asts.Predicate:
+    return asts.Predicate(f'_magic_{p.x}_{adornment}')
+
+def _magic_atom(atom: asts.Atom, adornment: Adornment) -> asts.Atom:
+    return asts.Atom(_magic(atom.predicate, adornment),
+                     _bound_terms(atom, adornment))
+
+def rewrite(program: asts.Program,
+            query: asts.Atom) \
+            -> Tuple[asts.Program, asts.Predicate]:
+    """
+    `rewrite(program, query)` performs the magic sets rewrite of the deductive
+    rules of `program` for the query `query`. It returns the rewritten program
+    and the predicate of the rewritten program that holds the answers to the
+    query. The rewritten program computes only the tuples that are relevant to
+    the query. For example, given the query `path(#n, a, Y)` and this program:
+
+        path(#L, X, Y) :- link(#L, X, Y).
+        path(#L, X, Y) :- path(#L, X, Z), link(#L, Z, Y).
+
+    `rewrite` returns the following program and the predicate `_path_bbf`:
+
+        _magic_path_bbf(#n, a) :- .
+        _path_bbf(#L, X, Y) :- _magic_path_bbf(#L, X), link(#L, X, Y).
+        _path_bbf(#L, X, Y) :- _magic_path_bbf(#L, X), _path_bbf(#L, X, Z),
+                               link(#L, Z, Y).
+
+    Bindings are passed sideways from left to right through the positive
+    literals of a rule. Negated deductive predicates are not rewritten;
+    instead, they and all the predicates they depend on are evaluated in full
+    by the original rules, so the rewritten program remains stratified. The
+    same goes for the heads of aggregate rules, since every tuple of their
+    bodies can contribute to their aggregates.
+    Constant time rules are copied into the rewritten program unchanged, and
+    deductive predicates that also receive tuples from the async buffer (e.g.
+    persisted with an inductive rule) are seeded from their base relation.
+    """
+    deductive_rules = [r for r in program.rules if r.is_deductive()]
+    constant_rules = [r for r in program.rules if r.is_constant_time()]
+    idb = {r.head.predicate for r in deductive_rules}
+    buffered = {r.head.predicate for r in program.rules
+                if not r.is_deductive()}
+    rules_by_predicate: Dict[asts.Predicate, List[asts.Rule]] = \
+        defaultdict(list)
+    for rule in deductive_rules:
+        rules_by_predicate[rule.head.predicate].append(rule)
+    aggregated = {r.head.predicate for r in deductive_rules
+                  if r.is_aggregate()}
+    dpdg = program.deductive_pdg()
+
+    rules: List[asts.Rule] = list(constant_rules)
+    if query.predicate not in idb:
+        return (asts.Program(tuple(rules)), query.predicate)
+    if query.predicate in aggregated:
+        relevant = nx.ancestors(dpdg, query.predicate) | {query.predicate}
+        rules += [r for r in deductive_rules if r.head.predicate in relevant]
+        return (asts.Program(tuple(rules)), query.predicate)
+
+    query_adornment = _adornment(query, set())
+    seed = _magic_atom(query, query_adornment)
+    rules.append(asts.Rule(seed, asts.DeductiveRule(), ()))
+
+    negated: Set[asts.Predicate] = set()
+    worklist: List[Tuple[asts.Predicate, Adornment]] = \
+        [(query.predicate, query_adornment)]
+    visited = set(worklist)
+    while len(worklist) > 0:
+        (p, adornment) = worklist.pop()
+
+        # Base tuples of `p` that come from the async buffer.
+        if p in buffered:
+            arity = len(rules_by_predicate[p][0].head.terms)
+            terms: Tuple[asts.Term, ...] = \
+                tuple(asts.Variable(f'X{i}', i == 0) for i in range(arity))
+            base = asts.Atom(p, terms)
+            rules.append(asts.Rule(
+                asts.Atom(_adorned(p, adornment), terms),
+                asts.DeductiveRule(),
+                (asts.Literal(False, _magic_atom(base, adornment)),
+                 asts.Literal(False, base))))
+
+        for rule in rules_by_predicate[p]:
+            magic_atom = _magic_atom(rule.head, adornment)
+            magic_literal = asts.Literal(False, magic_atom)
+            bound = {t.x for t in _bound_terms(rule.head, adornment)
+                         if isinstance(t, asts.Variable)}
+            prefix: List[asts.Literal] = [magic_literal]
+            body: List[asts.Literal] = [magic_literal]
+
+            for literal in rule.body:
+                atom = literal.atom
+                q = atom.predicate
+                if literal.is_negative() or q not in idb or q in aggregated:
+                    if q in idb:
+                        negated.add(q)
+                    body.append(literal)
+                    if literal.is_positive():
+                        prefix.append(literal)
+                        bound |= {v.x for v in atom.variables()}
+                    continue
+
+                # A magic rule of the form `_magic_p(X) :- _magic_p(X).` is
+                # trivially satisfied, so we don't bother adding it.
+                q_adornment = _adornment(atom, bound)
+                q_magic_atom = _magic_atom(atom, q_adornment)
+                if prefix != [asts.Literal(False, q_magic_atom)]:
+                    rules.append(asts.Rule(q_magic_atom,
+                                           asts.DeductiveRule(),
+                                           tuple(prefix)))
+                if (q, q_adornment) not in visited:
+                    visited.add((q, q_adornment))
+                    worklist.append((q, q_adornment))
+
+                adorned = asts.Literal(False, asts.Atom(
+                    _adorned(q, q_adornment), atom.terms))
+                body.append(adorned)
+                prefix.append(adorned)
+                bound |= {v.x for v in atom.variables()}
+
+            head = asts.Atom(_adorned(p, adornment), rule.head.terms)
+            rules.append(asts.Rule(head, asts.DeductiveRule(), tuple(body),
+                                   rule.builtins))
+
+    full: Set[asts.Predicate] = set()
+    for q in negated:
+        full |= nx.ancestors(dpdg, q) | {q}
+    rules += [r for r in deductive_rules if r.head.predicate in full]
+
+    return (asts.Program(tuple(rules)),
+            _adorned(query.predicate, query_adornment))
+
+def desugar_query(query: asts.Atom) -> asts.Atom:
+    """
+    `desugar_query(query)` desugars a query atom the same way `desugar`
+    desugars the atoms of a rule. For example, `path(a, Y)` is desugared into
+    `path(#_L, a, Y)`.
+    """
+    rule = asts.Rule(query, asts.DeductiveRule(), ())
+    return desugar(asts.Program((rule,))).rules[0].head
+
+def query(process: Process, atom: asts.Atom) -> Relation:
+    """
+    `query(process, atom)` returns the set of tuples that match `atom` at the
+    current timestep of `process`, i.e. the tuples of the atom's predicate
+    that `step(process)` would derive and that unify with `atom`. Only the
+    tuples relevant to the query are computed, and `process` is not modified.
+    """
+    (program, answer) = rewrite(process.program, atom)
+
+    t = process.timestep
+    async_buffer: AsyncBuffer = defaultdict(_empty_default_database)
+    for (p, r) in process.async_buffer.get(t, {}).items():
+        async_buffer[t][p] = set(r)
+    database: Database = \
+        {p: set() for p in program.predicates() | {answer}}
+    subprocess = process._replace(program=program,
+                                  database=database,
+                                  async_buffer=async_buffer)
+
+    _eval_inputs(subprocess)
+    _eval_deductive(subprocess, program)
+    return {t for t in database[answer] if _unify([atom], [t]) is not None}
+
+def carried_program(program: asts.Program) -> asts.Program:
+    """
+    `carried_program(program)` returns the rules of `program` that can affect
+    a later timestep: every inductive, async, and constant time rule, and
+    every deductive rule whose head they (transitively) depend on. Running
+    the carried program fills the async buffer exactly like running `program`
+    does, but never computes the deductive relations that only matter at the
+    current timestep. For example, in the following program:
+
+        link(X, Y)@next :- link(X, Y).
+        path(X, Y) :- link(X, Y).
+        path(X, Y) :- path(X, Z), link(Z, Y).
+
+    only the first rule is carried.
+    """
+    carried = {l.atom.predicate for r in program.rules if not r.is_deductive()
+                                for l in r.body}
+    relevant = relevant_predicates(program, carried)
+    return asts.Program(tuple(r for r in program.rules
+                              if not r.is_deductive() or
+                              r.head.predicate in relevant))
+
+def run_query(program: asts.Program,
+              atom: asts.Atom,
+              timestep: int,
+              randint: Callable[[], int]) \
+              -> Relation:
+    """
+    `run_query(program, atom, timestep, randint)` returns the set of tuples
+    that match `atom` at timestep `timestep` of a run of `program` with async
+    delays drawn from `randint`. The timesteps before `timestep` run only the
+    carried program (see `carried_program`), and the query is then answered
+    with the magic sets rewrite of `program` (see `query`).
+    """
+    process = run(spawn(carried_program(program), randint), timestep)
+    return query(process._replace(program=program), atom)
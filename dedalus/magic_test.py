@@ -0,0 +1,128 @@
+from typing import List, Tuple
+import unittest
+
+from desugar import desugar
+from magic import carried_program, desugar_query, query, rewrite, run_query
+from run import _unify, run, spawn, step
+from typecheck import typecheck
+import asts
+import parser
+
+
+class TestMagic(unittest.TestCase):
+    def program(self, source: str) -> asts.Program:
+        return typecheck(desugar(parser.parse(source)))
+
+    def atom(self, x: str) -> asts.Atom:
+        return parser.parse_atom(x)
+
+    def test_rewrite(self) -> None:
+        program = self.program(r"""
+            path(X, Y) :- link(X, Y).
+            path(X, Y) :- path(X, Z), link(Z, Y).
+            unrelated(X, Y) :- link(X, Y).
+        """)
+        (rewritten, answer) = rewrite(program, self.atom('path(#n, a, Y)'))
+        expected = [
+            '_magic_path_bbf(#n, a) :- .',
+            ('_path_bbf(#_L, X, Y) :- _magic_path_bbf(#_L, X), '
+             'link(#_L, X, Y).'),
+            ('_path_bbf(#_L, X, Y) :- _magic_path_bbf(#_L, X), '
+             '_path_bbf(#_L, X, Z), link(#_L, Z, Y).'),
+        ]
+        self.assertEqual([str(rule) for rule in rewritten.rules], expected)
+        self.assertEqual(answer, asts.Predicate('_path_bbf'))
+
+    def test_desugar_query(self) -> None:
+        self.assertEqual(str(desugar_query(self.atom('path(a, Y)'))),
+                         'path(#_L, a, Y)')
+        self.assertEqual(str(desugar_query(self.atom('path(#n, a, Y)'))),
+                         'path(#n, a, Y)')
+
+    def test_query(self) -> None:
+        TestCase = Tuple[str, List[str]]
+        test_cases: List[TestCase] = [
+            (r"""
+                link(#n, a, b)@0 :- .
+                link(#n, b, c)@0 :- .
+                link(#n, c, d)@0 :- .
+                link(#n, c, b)@0 :- .
+                path(X, Y) :- link(X, Y).
+                path(X, Y) :- path(X, Z), link(Z, Y).
+                path(X, Y)@next :- path(X, Y).
+             """,
+             ['path(#n, a, d)', 'path(#n, d, a)', 'path(#n, a, Y)',
+              'path(#n, X, c)', 'path(#n, X, X)', 'path(#L, X, Y)',
+              'link(#n, X, Y)']),
+            (r"""
+                link(#n, a, b) :- .
+                link(#n, b, c) :- .
+                link(#n, c, a) :- .
+                link(#n, c, d) :- .
+                nodes(X) :- link(X, Y).
+                nodes(Y) :- link(X, Y).
+                path(X, Y) :- link(X, Y).
+                path(X, Y) :- link(X, Z), path(Z, Y).
+                not_path(X, Y) :- nodes(X), nodes(Y), !path(X, Y).
+                both(X, Y) :- path(X, Y), path(Y, X).
+             """,
+             ['not_path(#n, d, Y)', 'not_path(#n, X, a)', 'both(#n, a, Y)',
+              'both(#n, X, d)', 'path(#n, d, Y)']),
+            (r"""
+                kvs_delete(#DST, K, V) :- set_request(#DST, SRC, ID, K, V).
+                kvs(#DST, K, V)@next :- set_request(#DST, SRC, ID, K, V).
+                kvs(K, V)@next :- kvs(K, V), !kvs_delete(K, V).
+                set_request(#s, c, 0, k, v)@0 :- .
+                set_request(#s, c, 1, k, w)@1 :- .
+             """,
+             ['kvs(#s, k, V)', 'kvs_delete(#s, K, V)']),
+            (r"""
+                link(#n, a, b) :- .
+                link(#n, a, c) :- .
+                link(#n, b, c) :- .
+                degree(X, count<Y>) :- link(X, Y).
+                hub(X) :- degree(X, 2).
+             """,
+             ['degree(#n, a, N)', 'degree(#n, X, 1)', 'hub(#n, X)']),
+        ]
+
+        for (source, queries) in test_cases:
+            process = spawn(self.program(source), lambda: 1)
+            for _ in range(4):
+                expected_db = step(process).database
+                for query_string in queries:
+                    atom = self.atom(query_string)
+                    expected = {t for t in expected_db[atom.predicate]
+                                  if _unify([atom], [t]) is not None}
+                    self.assertEqual(query(process, atom), expected,
+                                     (query_string, process.timestep))
+                process = run(process, 1)
+
+    def test_run_query(self) -> None:
+        # Only link is carried from one timestep to the next, so path is
+        # computed at the queried timestep alone.
+        program = self.program(r"""
+            link(#n, a, b)@0 :- .
+            link(#n, b, c)@2 :- .
+            link(X, Y)@next :- link(X, Y).
+            path(X, Y) :- link(X, Y).
+            path(X, Y) :- path(X, Z), link(Z, Y).
+        """)
+        carried = carried_program(program)
+        self.assertEqual([str(rule) for rule in carried.rules],
+                         ['link(#n, a, b)@0 :- .', 'link(#n, b, c)@2 :- .',
+                          'link(#_L, X, Y)@next :- link(#_L, X, Y).'])
+        path = asts.Predicate('path')
+        self.assertNotIn(path, run(spawn(carried, lambda: 1), 5).database)
+
+        full = run(spawn(program, lambda: 1), 5)
+        for query_string in ['path(#n, a, Y)', 'path(#n, X, c)']:
+            atom = self.atom(query_string)
+            self.assertEqual(run_query(program, atom, 5, lambda: 1),
+                             query(full, atom))
+        self.assertEqual(run_query(program, self.atom('path(#n, a, Y)'), 1,
+                                   lambda: 1),
+                         {('n', 'a', 'b')})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,239 @@
+from array import array
+from typing import (Any, BinaryIO, Dict, Iterable, Iterator, List, Optional,
+                    TextIO, Tuple)
+import csv
+import heapq
+import itertools
+import json
+import marshal
+import os
+import struct
+import sys
+
+from tabulate import tabulate
+from termcolor import colored
+
+from relation import Symbols
+from run import Process, Relation
+import asts
+
+
+# The formats in which the state of a process can be written.
+FORMATS = ['text', 'jsonl', 'csv', 'binary']
+
+# A relation of a process: the relation of predicate p at the end of timestep
+# t (t is one less than the timestep of the process), or the tuples of p in
+# the async buffer that will be delivered at timestep t. These are the
+# relations, and the timesteps, printed by `str(process)`.
+Block = Tuple[int, asts.Predicate, Relation]
+
+def blocks(process: Process) -> Iterator[Block]:
+    """
+    `blocks(process)` generates the non-empty relations of the database and
+    async buffer of `process` (see `Block`), ordered by timestep and
+    predicate.
+    """
+    return itertools.chain(_database_blocks(process), _buffer_blocks(process))
+
+def _database_blocks(process: Process) -> Iterator[Block]:
+    t = process.timestep - 1
+    for p in sorted(process.database):
+        if len(process.database[p]) > 0:
+            yield (t, p, process.database[p])
+
+def _buffer_blocks(process: Process) -> Iterator[Block]:
+    for (t, db) in sorted(process.async_buffer.items(), key=lambda x: x[0]):
+        for p in sorted(db):
+            if len(db[p]) > 0:
+                yield (t, p, db[p])
+
+def _tuples(relation: Relation,
+            limit: Optional[int],
+            sort: bool) \
+            -> Iterable[Tuple[Any, ...]]:
+    # The first `limit` tuples of `relation`, either smallest first or in
+    # whatever order the relation stores them. Only the tuples that are
+    # written are sorted.
+    if not sort:
+        return itertools.islice(relation, limit)
+    elif limit is None or limit >= len(relation):
+        return sorted(relation)
+    else:
+        return heapq.nsmallest(limit, relation)
+
+def write_text(process: Process,
+               out: TextIO,
+               limit: int = None,
+               sort: bool = True) \
+               -> None:
+    """
+    `write_text(process, out, limit, sort)` writes `str(process)` to `out`,
+    one relation at a time, with at most `limit` tuples per relation.
+    """
+    def underline(s: str) -> str:
+        return s + '\n' + ('=' * len(s)) + '\n'
+
+    def write_blocks(blocks: Iterator[Block]) -> None:
+        for (t, p, relation) in blocks:
+            out.write(colored(p.x, 'blue', attrs=['bold']) + ' ' +
+                      colored(f'(t = {t})', 'green') + '\n')
+            tuples = list(_tuples(relation, limit, sort))
+            out.write(tabulate(tuples, tablefmt='orgtbl') + '\n')
+            if len(tuples) < len(relation):
+                out.write(f'({len(relation) - len(tuples)} more tuples)\n')
+
+    t = process.timestep - 1
+    out.write(underline(f'Relations at end of timestep {t}.'))
+    write_blocks(_database_blocks(process))
+    out.write(underline('Async buffer.'))
+    write_blocks(_buffer_blocks(process))
+
+def write_jsonl(process: Process,
+                out: TextIO,
+                limit: int = None,
+                sort: bool = False) \
+                -> None:
+    """
+    `write_jsonl(process, out, limit, sort)` writes every tuple of `process`
+    to `out` as a line of JSON, e.g.
+
+        {"timestep": 3, "predicate": "p", "tuple": ["a", "b"]}
+
+    with at most `limit` tuples per relation (see `Block`).
+    """
+    dumps = json.dumps
+    for (t, p, relation) in blocks(process):
+        prefix = f'{{"timestep": {t}, "predicate": {dumps(p.x)}, "tuple": '
+        for tuple_ in _tuples(relation, limit, sort):
+            out.write(prefix + dumps(tuple_) + '}\n')
+
+def write_csv(process: Process,
+              directory: str,
+              limit: int = None,
+              sort: bool = False) \
+              -> None:
+    """
+    `write_csv(process, directory, limit, sort)` writes the tuples of every
+    predicate of `process` to the file `<predicate>.csv` in `directory`. The
+    first column of every row is the timestep of the tuple (see `Block`).
+    """
+    os.makedirs(directory, exist_ok=True)
+    files: Dict[asts.Predicate, TextIO] = {}
+    try:
+        for (t, p, relation) in blocks(process):
+            if p not in files:
+                path = os.path.join(directory, f'{p.x}.csv')
+                files[p] = open(path, 'w', newline='')
+            writer = csv.writer(files[p])
+            writer.writerows((t,) + tuple_
+                             for tuple_ in _tuples(relation, limit, sort))
+    finally:
+        for f in files.values():
+            f.close()
+
+# A binary dump is the magic number, then one header and its columns per
+# relation, then a header with an empty predicate followed by the symbol
+# table. A relation's header contains its timestep, the length of its
+# predicate, its arity, and its number of tuples, and is followed by its
+# predicate and one column of little-endian 32-bit symbol ids per term. The
+# symbol table is the `marshal`ed list of the constants, indexed by id.
+_MAGIC = b'DEDALUS\x01'
+_HEADER = struct.Struct('<qHII')
+_LENGTH = struct.Struct('<I')
+
+def write_binary(process: Process,
+                 out: BinaryIO,
+                 limit: int = None,
+                 sort: bool = False) \
+                 -> None:
+    """
+    `write_binary(process, out, limit, sort)` writes the relations of
+    `process` to `out` in a compact columnar format in which every constant
+    is written once. See `read_binary`.
+    """
+    symbols = Symbols()
+    intern = symbols.intern
+    out.write(_MAGIC)
+    for (t, p, relation) in blocks(process):
+        tuples = list(_tuples(relation, limit, sort))
+        arity = len(next(iter(relation)))
+        columns = [array('I', (intern(tuple_[i]) for tuple_ in tuples))
+                   for i in range(arity)]
+        name = p.x.encode()
+        out.write(_HEADER.pack(t, len(name), arity, len(tuples)) + name)
+        for column in columns:
+            if sys.byteorder == 'big':
+                column.byteswap()
+            out.write(column.tobytes())
+    out.write(_HEADER.pack(0, 0, 0, 0))
+    table: bytes = marshal.dumps(symbols.values) # type: ignore
+    out.write(_LENGTH.pack(len(table)) + table)
+
+def _read_exactly(f: BinaryIO, n: int) -> bytes:
+    data = f.read(n)
+    if len(data) != n:
+        raise ValueError('Truncated binary dump.')
+    return data
+
+def read_binary(f: BinaryIO) \
+                -> List[Tuple[int, asts.Predicate, List[Tuple[Any, ...]]]]:
+    """
+    `read_binary(f)` reads a binary dump written by `write_binary` and returns
+    its relations (see `Block`) in the order they were written.
+    """
+    if f.read(len(_MAGIC)) != _MAGIC:
+        raise ValueError('Not a binary dump of a Dedalus process.')
+    relations: List[Tuple[int, asts.Predicate, List[Tuple[int, ...]]]] = []
+    while True:
+        (t, length, arity, n) = _HEADER.unpack(_read_exactly(f, _HEADER.size))
+        if length == 0:
+            break
+        p = asts.Predicate(_read_exactly(f, length).decode())
+        columns: List[array] = []
+        for _ in range(arity):
+            column = array('I')
+            column.frombytes(_read_exactly(f, 4 * n))
+            if sys.byteorder == 'big':
+                column.byteswap()
+            columns.append(column)
+        relations.append((t, p, list(zip(*columns))))
+    (length,) = _LENGTH.unpack(_read_exactly(f, _LENGTH.size))
+    values = marshal.loads(_read_exactly(f, length)) # type: ignore
+    return [(t, p, [tuple(values[i] for i in ids) for ids in ids_list])
+            for (t, p, ids_list) in relations]
+
+def write(process: Process,
+          format_: str,
+          output: str = '-',
+          limit: int = None,
+          sort: bool = None) \
+          -> None:
+    """
+    `write(process, format_, output, limit, sort)` writes the state of
+    `process` in format `format_` (one of `FORMATS`) to the file `output`, or
+    to stdout if `output` is '-'. The csv format writes a file per predicate,
+    so its output is a directory. At most `limit` tuples of every relation are
+    written. Tuples are only sorted if `sort` is true, or, by default, in the
+    text format.
+    """
+    if format_ not in FORMATS:
+        raise ValueError(f'Unknown output format "{format_}".')
+    sort = format_ == 'text' if sort is None else sort
+    if format_ == 'csv':
+        if output == '-':
+            raise ValueError('The csv format writes a file per predicate. '
+                             'Pass an output directory.')
+        write_csv(process, output, limit, sort)
+    elif format_ == 'binary':
+        if output == '-':
+            write_binary(process, sys.stdout.buffer, limit, sort)
+        else:
+            with open(output, 'wb') as binary:
+                write_binary(process, binary, limit, sort)
+    else:
+        writer = write_text if format_ == 'text' else write_jsonl
+        if output == '-':
+            writer(process, sys.stdout, limit, sort)
+        else:
+            with open(output, 'w') as text:
+                writer(process, text, limit, sort)
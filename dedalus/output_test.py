@@ -0,0 +1,102 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from desugar import desugar
+from output import (blocks, read_binary, write, write_binary, write_csv,
+                    write_jsonl, write_text)
+from run import Process, run, spawn
+from typecheck import typecheck
+import asts
+import parser
+
+
+class TestOutput(unittest.TestCase):
+    def process(self) -> Process:
+        program = typecheck(desugar(parser.parse("""
+            p(#a, b, c) :- .
+            p(#a, c, d) :- .
+            p(#a, d, e) :- .
+            q(#a, X)@async :- p(#a, X, Y).
+            r(#a, X)@next :- p(#a, X, Y).
+        """)))
+        return run(spawn(program, lambda: 2), 3)
+
+    def test_blocks(self) -> None:
+        p = asts.Predicate('p')
+        q = asts.Predicate('q')
+        r = asts.Predicate('r')
+        self.assertEqual([(t, pred, len(rel))
+                          for (t, pred, rel) in blocks(self.process())],
+                         [(2, p, 3), (2, q, 3), (2, r, 3), (3, q, 3),
+                          (3, r, 3), (4, q, 3)])
+
+    def test_write_text(self) -> None:
+        process = self.process()
+        out = io.StringIO()
+        write_text(process, out)
+        self.assertEqual(out.getvalue(), str(process) + '\n')
+
+        out = io.StringIO()
+        write_text(process, out, limit=2)
+        self.assertEqual(out.getvalue().count('(1 more tuples)'), 6)
+        self.assertIn('| a | b | c |\n| a | c | d |\n(1 more', out.getvalue())
+
+    def test_write_jsonl(self) -> None:
+        process = self.process()
+        out = io.StringIO()
+        write_jsonl(process, out, sort=True)
+        lines = [json.loads(l) for l in out.getvalue().splitlines()]
+        self.assertEqual(len(lines), 18)
+        self.assertEqual(lines[0], {'timestep': 2, 'predicate': 'p',
+                                    'tuple': ['a', 'b', 'c']})
+        expected = {(t, p.x, tuple_)
+                    for (t, p, r) in blocks(process) for tuple_ in r}
+        self.assertEqual({(l['timestep'], l['predicate'], tuple(l['tuple']))
+                          for l in lines}, expected)
+
+        out = io.StringIO()
+        write_jsonl(process, out, limit=1)
+        self.assertEqual(len(out.getvalue().splitlines()), 6)
+
+    def test_write_csv(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            write_csv(self.process(), directory, sort=True)
+            self.assertEqual(sorted(os.listdir(directory)),
+                             ['p.csv', 'q.csv', 'r.csv'])
+            with open(os.path.join(directory, 'q.csv')) as f:
+                self.assertEqual(f.read().splitlines(),
+                                 ['2,a,b', '2,a,c', '2,a,d',
+                                  '3,a,b', '3,a,c', '3,a,d',
+                                  '4,a,b', '4,a,c', '4,a,d'])
+
+    def test_write_binary(self) -> None:
+        process = self.process()
+        out = io.BytesIO()
+        write_binary(process, out)
+        out.seek(0)
+        self.assertEqual([(t, p, set(r)) for (t, p, r) in read_binary(out)],
+                         [(t, p, set(r)) for (t, p, r) in blocks(process)])
+
+        # Constants other than strings survive the round trip.
+        s = asts.Predicate('s')
+        process.database[s] = {('a', 1, 2.5), ('a', 1, None)}
+        out = io.BytesIO()
+        write_binary(process, out)
+        out.seek(0)
+        relations = {p: set(r) for (_, p, r) in read_binary(out)}
+        self.assertEqual(relations[s], {('a', 1, 2.5), ('a', 1, None)})
+
+        with self.assertRaises(ValueError):
+            read_binary(io.BytesIO(out.getvalue()[:-1]))
+
+    def test_write(self) -> None:
+        with self.assertRaises(ValueError):
+            write(self.process(), 'xml')
+        with self.assertRaises(ValueError):
+            write(self.process(), 'csv')
+
+if __name__ == '__main__':
+    unittest.main()
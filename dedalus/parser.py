@@ -16,6 +16,8 @@ bang = lexeme(string('!'))
 comma = lexeme(string(','))
 hashtag = lexeme(string('#'))
 lparen = lexeme(string('('))
+langle = lexeme(string('<'))
+rangle = lexeme(string('>'))
 rparen = lexeme(string(')'))
 period = lexeme(string('.'))
 turnstyle = lexeme(string(':-'))
@@ -26,8 +28,15 @@ number = lexeme(regex(r'\d+')).parsecmap(int)
 constant_id = lexeme(regex(r'[a-z0-9]\w*'))
 variable_id = lexeme(regex(r'[A-Z]\w*'))
 predicate_id = lexeme(regex(r'[a-z]\w*'))
-
-# Parsing.
+aggregate_function = lexeme(regex('|'.join(asts.AGGREGATES)))
+# Longer operators come first, so `<=` isn't lexed as `<`.
+comparison = lexeme(regex('|'.join(re.escape(op) for op in
+                                   sorted(asts.COMPARISONS, key=len,
+                                          reverse=True))))
+operator = lexeme(regex('|'.join(re.escape(op) for op in asts.OPERATORS)))
+
+# Parsing. Every AST node is interned (see `asts.intern`), so the many
+# copies of an atom or rule in a large generated program share one object.
 def maybe(p):
     @generate
     def f():
@@ -45,17 +54,28 @@ def is_location():
 def constant():
     is_location_ = yield is_location
     x = yield constant_id
-    return asts.Constant(x, is_location_)
+    return asts.intern(asts.Constant(x, is_location_))
 
 @generate
 def variable():
     is_location_ = yield is_location
     x = yield variable_id
-    return asts.Variable(x, is_location_)
+    return asts.intern(asts.Variable(x, is_location_))
 
 term = constant ^ variable
 
-predicate = predicate_id.parsecmap(asts.Predicate)
+@generate
+def aggregate():
+    function = yield aggregate_function
+    yield langle
+    x = yield variable_id
+    yield rangle
+    return asts.intern(asts.Aggregate(function, x))
+
+# Aggregates, like `count<X>`, can only appear in the head of a rule.
+head_term = aggregate ^ term
+
+predicate = predicate_id.parsecmap(lambda x: asts.intern(asts.Predicate(x)))
 
 @generate
 def atom():
@@ -63,7 +83,15 @@ def atom():
     yield lparen
     terms = yield sepBy(term, comma)
     yield rparen
-    return asts.Atom(predicate_, terms)
+    return asts.intern(asts.Atom(predicate_, tuple(terms)))
+
+@generate
+def head():
+    predicate_ = yield predicate
+    yield lparen
+    terms = yield sepBy(head_term, comma)
+    yield rparen
+    return asts.intern(asts.Atom(predicate_, tuple(terms)))
 
 @generate
 def literal():
@@ -71,7 +99,23 @@ def literal():
     assert len(bangs) in [0, 1]
     negative = True if len(bangs) == 1 else False
     atom_ = yield atom
-    return asts.Literal(negative, atom_)
+    return asts.intern(asts.Literal(negative, atom_))
+
+@generate
+def arithmetic():
+    left = yield term
+    op = yield operator
+    right = yield term
+    return asts.intern(asts.Arithmetic(op, left, right))
+
+expression = arithmetic ^ term
+
+@generate
+def builtin():
+    left = yield expression
+    op = yield comparison
+    right = yield expression
+    return asts.intern(asts.Builtin(op, left, right))
 
 inductive_rule = at >> next_.parsecmap(lambda _: asts.InductiveRule())
 async_rule = at >> async.parsecmap(lambda _: asts.AsyncRule())
@@ -89,16 +133,21 @@ def rule_type():
 
 @generate
 def rule():
-    head = yield atom
+    head_ = yield head
     rule_type_ = yield rule_type
     yield turnstyle
-    body = yield sepBy(literal, comma)
+    body = yield sepBy(literal ^ builtin, comma)
     yield period
-    return asts.Rule(head, rule_type_, body)
+    literals = tuple(x for x in body if isinstance(x, asts.Literal))
+    builtins = tuple(x for x in body if isinstance(x, asts.Builtin))
+    return asts.intern(asts.Rule(head_, rule_type_, literals, builtins))
 
-program = many1(rule).parsecmap(asts.Program)
+program = many1(rule).parsecmap(lambda rules: asts.Program(tuple(rules)))
 
 parser = ignore >> program
 
 def parse(s: str) -> asts.Program:
     return parser.parse_strict(s)
+
+def parse_atom(s: str) -> asts.Atom:
+    return (ignore >> atom).parse_strict(s)
@@ -30,7 +30,13 @@ class TestParser(unittest.TestCase):
             "p()@1933 :- .",
             "p()@next :- .",
             "p()@async :- .",
-            "p(X, #Z)@next :- q(#X, Y), s(Y, #Z)."
+            "p(X, #Z)@next :- q(#X, Y), s(Y, #Z).",
+            "p(count<X>) :- q(X).",
+            "p(#L, K, sum<V>, min <V>, max<V>)@next :- q(#L, K, V).",
+            "p(count, counter) :- .",
+            "p(Z) :- q(X), Z = X + 1, X < 3.",
+            "p(X, Y) :- q(X, Y), X!=Y, X * 2 >= Y % 3, 1 <= X.",
+            "p(X) :- q(X), X = a.",
 
 
             r"""
@@ -89,6 +95,14 @@ class TestParser(unittest.TestCase):
             "#p(X) :- p(X).",
             "p(X) : - p(X).",
             "p(X) :- p(X)..",
+            "p(X) :- q(count<X>).",
+            "p(count<x>) :- q(X).",
+            "p(avg<X>) :- q(X).",
+            "p(X) :- X < 3, q(X)..",
+            "p(X) :- q(X), X + 1.",
+            "p(X) :- q(X), X = Y + 1 + 2.",
+            "p(X) :- q(X), X == 3.",
+            "p(X + 1) :- q(X).",
         ]
 
         for bad_program in bad_programs:
@@ -0,0 +1,486 @@
+from array import array
+from collections import defaultdict
+from typing import (AbstractSet, Any, Callable, DefaultDict, Dict, Iterable,
+                    Iterator, List, Mapping, MutableSet, Optional, Set, Tuple)
+import sys
+
+import asts
+
+
+class Symbols:
+    """
+    A symbol table interns the constants of a Dedalus program. Every distinct
+    constant is assigned a small integer id, so a tuple of constants can be
+    stored as a packed row of integers and every constant is stored once, no
+    matter how many relations and timesteps it appears in.
+
+        symbols = Symbols()
+        symbols.intern('a') == 0
+        symbols.intern('b') == 1
+        symbols.intern('a') == 0
+        symbols.values[1] == 'b'
+    """
+    def __init__(self) -> None:
+        self.ids: Dict[Any, int] = {}
+        self.values: List[Any] = []
+
+    def intern(self, value: Any) -> int:
+        id_ = self.ids.get(value)
+        if id_ is None:
+            id_ = len(self.values)
+            self.ids[value] = id_
+            self.values.append(value)
+        return id_
+
+    def nbytes(self) -> int:
+        return (sys.getsizeof(self.ids) +
+                sys.getsizeof(self.values) +
+                sum(sys.getsizeof(v) for v in self.values))
+
+class Relation(MutableSet[Tuple[Any, ...]]):
+    """
+    `Relation` is the interface of a relation backend: a mutable set of
+    tuples. A backend implements `__contains__`, `__iter__`, `__len__`, `add`
+    and `discard`, and gets the rest of the set operations (`|=`, `-=`, `-`,
+    `|`, ...) from `MutableSet`. Operators that build a new relation, like
+    `-` and `|`, return ordinary sets. A backend can override `insert`, the
+    bulk union used by the evaluator, with something faster than adding
+    tuples one at a time, and `index`, which looks tuples up by some of their
+    columns, with indexes of its own (see `lookup`). Python sets, the default
+    backend, aren't subclasses of `Relation` but support the same operations
+    (see `insert` and `lookup`).
+    """
+    @classmethod
+    def _from_iterable(cls, it: Iterable[Tuple[Any, ...]]) \
+            -> AbstractSet[Tuple[Any, ...]]:
+        return set(it)
+
+    def insert(self, tuples: AbstractSet[Tuple[Any, ...]]) \
+            -> AbstractSet[Tuple[Any, ...]]:
+        """
+        `relation.insert(tuples)` adds `tuples` to the relation and returns the
+        tuples that were not already in it.
+        """
+        new = {t for t in tuples if t not in self}
+        for tuple_ in new:
+            self.add(tuple_)
+        return new
+
+    def index(self, columns: Tuple[int, ...]) \
+            -> Optional[Dict[Tuple[Any, ...], List[Tuple[Any, ...]]]]:
+        """
+        `relation.index(columns)` returns an index on `columns` that the
+        backend maintains itself: a map from every key (t[i], t[j], ...) to
+        the list of tuples t with that key. The index must not be modified by
+        the caller. A backend without one returns None, and the evaluator
+        builds an index of its own from a scan of the relation (see
+        `run._Indexes`).
+        """
+        return None
+
+    def lookup(self,
+               columns: Tuple[int, ...],
+               key: Tuple[Any, ...]) \
+               -> Iterable[Tuple[Any, ...]]:
+        """
+        `relation.lookup(columns, key)` returns the tuples t of the relation
+        whose columns `columns` are equal to `key`. It uses `index` if the
+        backend has one and scans the relation otherwise.
+        """
+        index = self.index(columns)
+        if index is not None:
+            return index.get(key, [])
+        return [t for t in self if tuple(t[c] for c in columns) == key]
+
+def insert(relation: MutableSet[Tuple[Any, ...]],
+           tuples: AbstractSet[Tuple[Any, ...]]) \
+           -> AbstractSet[Tuple[Any, ...]]:
+    """
+    `insert(relation, tuples)` adds `tuples` to `relation`, which is either a
+    `Relation` or a set, and returns the tuples that were not already in it.
+    """
+    if isinstance(relation, Relation):
+        return relation.insert(tuples)
+    new = tuples - relation
+    relation |= new
+    return new
+
+def native_index(relation: AbstractSet[Tuple[Any, ...]],
+                 columns: Tuple[int, ...]) \
+                 -> Optional[Dict[Tuple[Any, ...], List[Tuple[Any, ...]]]]:
+    """
+    `native_index(relation, columns)` returns the index on `columns` that
+    `relation` maintains itself (see `Relation.index`), or None if it has
+    none. Sets have none.
+    """
+    if isinstance(relation, Relation):
+        return relation.index(columns)
+    return None
+
+def lookup(relation: AbstractSet[Tuple[Any, ...]],
+           columns: Tuple[int, ...],
+           key: Tuple[Any, ...]) \
+           -> Iterable[Tuple[Any, ...]]:
+    """
+    `lookup(relation, columns, key)` returns the tuples t of `relation`, which
+    is either a `Relation` or a set, whose columns `columns` are equal to
+    `key`.
+    """
+    if isinstance(relation, Relation):
+        return relation.lookup(columns, key)
+    return [t for t in relation if tuple(t[c] for c in columns) == key]
+
+# The symbol table shared by every `CompactRelation`.
+SYMBOLS = Symbols()
+
+# Slot values of a `CompactRelation`'s hash table.
+_EMPTY = -1
+_DELETED = -2
+
+class CompactRelation(Relation):
+    """
+    A `CompactRelation` is a set of tuples, all of the same arity, that is
+    stored far more compactly than a Python set of tuples. Every constant is
+    interned in `SYMBOLS`, and the relation is stored as a single packed array
+    of 32-bit symbol ids with one row of `arity` ids per tuple. Tuples are
+    deduplicated with an open addressing hash table (with linear probing)
+    that maps the hash of a row to the index of the row. For example, the
+    relation {(a, b), (b, c)} might be stored as follows:
+
+        SYMBOLS: a -> 0, b -> 1, c -> 2
+        rows:    [0, 1, 1, 2]
+        slots:   [-1, 1, -1, 0, -1, -1, -1, -1]
+
+    A tuple of three short strings in a Python set costs over 100 bytes; in a
+    `CompactRelation` it costs 12 bytes for its row plus at most 12 bytes for
+    its share of the hash table. Tuples are decoded back into Python tuples
+    when they are iterated over, so a `CompactRelation` can be used anywhere
+    a set of tuples can. Operators like `-` and `|` return ordinary sets.
+
+    The arity of a relation is fixed by the first tuple added to it.
+    """
+    def __init__(self, tuples: Iterable[Tuple[Any, ...]] = ()) -> None:
+        self.arity: Optional[int] = None
+        self.size = 0
+        self.rows = array('I')
+        self.slots = array('i', [_EMPTY] * 8)
+        self.deleted = 0
+        for tuple_ in tuples:
+            self.add(tuple_)
+
+    def _encode(self, tuple_: Tuple[Any, ...]) -> Optional[Tuple[int, ...]]:
+        # Returns None if `tuple_` contains a constant that has never been
+        # interned, in which case it can't be in any relation.
+        ids = SYMBOLS.ids
+        try:
+            return tuple(ids[v] for v in tuple_)
+        except KeyError:
+            return None
+
+    def _row(self, i: int) -> Tuple[int, ...]:
+        assert self.arity is not None
+        k = self.arity
+        return tuple(self.rows[i * k:(i + 1) * k])
+
+    def _find(self, row: Tuple[int, ...]) -> Tuple[int, int]:
+        # Returns the slot that contains `row` and the index of `row`, or the
+        # slot in which `row` should be inserted and -1.
+        slots = self.slots
+        mask = len(slots) - 1
+        i = hash(row) & mask
+        free = -1
+        while True:
+            r = slots[i]
+            if r == _EMPTY:
+                return (i if free == -1 else free, -1)
+            elif r == _DELETED:
+                if free == -1:
+                    free = i
+            elif self._row(r) == row:
+                return (i, r)
+            i = (i + 1) & mask
+
+    def _resize(self, capacity: int) -> None:
+        self.slots = array('i', [_EMPTY] * capacity)
+        self.deleted = 0
+        mask = capacity - 1
+        for r in range(self.size):
+            i = hash(self._row(r)) & mask
+            while self.slots[i] != _EMPTY:
+                i = (i + 1) & mask
+            self.slots[i] = r
+
+    def __contains__(self, tuple_: object) -> bool:
+        if not isinstance(tuple_, tuple) or len(tuple_) != self.arity:
+            return False
+        row = self._encode(tuple_)
+        return row is not None and self._find(row)[1] != -1
+
+    def __iter__(self) -> Iterator[Tuple[Any, ...]]:
+        if self.size == 0:
+            return
+        elif self.arity == 0:
+            for _ in range(self.size):
+                yield ()
+            return
+
+        values = SYMBOLS.values
+        rows = self.rows
+        k = self.arity or 0
+        for i in range(0, self.size * k, k):
+            yield tuple([values[x] for x in rows[i:i + k]])
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, tuple_: Tuple[Any, ...]) -> None:
+        if self.arity is None:
+            self.arity = len(tuple_)
+        elif len(tuple_) != self.arity:
+            msg = (f'Cannot add the tuple {tuple_} to a relation of arity '
+                   f'{self.arity}.')
+            raise ValueError(msg)
+
+        row = tuple(SYMBOLS.intern(v) for v in tuple_)
+        (slot, r) = self._find(row)
+        if r != -1:
+            return
+        if self.slots[slot] == _DELETED:
+            self.deleted -= 1
+        self.slots[slot] = self.size
+        self.rows.extend(row)
+        self.size += 1
+        if 3 * (self.size + self.deleted) > 2 * len(self.slots):
+            self._resize(4 * len(self.slots) if 3 * self.size > len(self.slots)
+                         else len(self.slots))
+
+    def discard(self, tuple_: Tuple[Any, ...]) -> None:
+        if tuple_ not in self:
+            return
+        row = self._encode(tuple_)
+        assert row is not None
+        (slot, r) = self._find(row)
+
+        # Remove row r by moving the last row into its place.
+        assert self.arity is not None
+        k = self.arity
+        last = self.size - 1
+        if r != last:
+            (last_slot, _) = self._find(self._row(last))
+            self.rows[r * k:(r + 1) * k] = self.rows[last * k:]
+            self.slots[last_slot] = r
+        del self.rows[last * k:]
+        self.slots[slot] = _DELETED
+        self.deleted += 1
+        self.size -= 1
+
+    def clear(self) -> None:
+        self.size = 0
+        self.rows = array('I')
+        self.slots = array('i', [_EMPTY] * 8)
+        self.deleted = 0
+
+    def nbytes(self) -> int:
+        """
+        `relation.nbytes()` returns the number of bytes used by the relation,
+        excluding the constants in `SYMBOLS`.
+        """
+        return (sys.getsizeof(self) +
+                sys.getsizeof(self.rows) +
+                sys.getsizeof(self.slots))
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> 'CompactRelation':
+        copy = CompactRelation()
+        copy.arity = self.arity
+        copy.size = self.size
+        copy.rows = array('I', self.rows)
+        copy.slots = array('i', self.slots)
+        copy.deleted = self.deleted
+        return copy
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # Symbol ids are only meaningful within a single interpreter, so a
+        # relation is pickled as its decoded tuples.
+        return (CompactRelation, (list(self),))
+
+    def __repr__(self) -> str:
+        return f'CompactRelation({set(self)})'
+
+class IndexedRelation(Relation):
+    """
+    An `IndexedRelation` is a set of tuples that maintains its own hash
+    indexes (see `Relation.index`), so the evaluator looks tuples up in them
+    rather than building and rebuilding indexes on top of the relation. An
+    index on columns (i, j, ...) is built the first time the relation is
+    looked up by those columns, so the relation is indexed by the access
+    patterns of the rules that read it, and every index is then kept up to
+    date as tuples are added and discarded.
+    """
+    def __init__(self, tuples: Iterable[Tuple[Any, ...]] = ()) -> None:
+        self.tuples: Set[Tuple[Any, ...]] = set()
+        self.indexes: Dict[Tuple[int, ...],
+                           DefaultDict[Tuple[Any, ...],
+                                       List[Tuple[Any, ...]]]] = {}
+        self.insert(set(tuples))
+
+    def __contains__(self, tuple_: object) -> bool:
+        return tuple_ in self.tuples
+
+    def __iter__(self) -> Iterator[Tuple[Any, ...]]:
+        return iter(self.tuples)
+
+    def __len__(self) -> int:
+        return len(self.tuples)
+
+    def add(self, tuple_: Tuple[Any, ...]) -> None:
+        self.insert({tuple_})
+
+    def discard(self, tuple_: Tuple[Any, ...]) -> None:
+        if tuple_ not in self.tuples:
+            return
+        self.tuples.discard(tuple_)
+        for (columns, index) in self.indexes.items():
+            key = tuple(tuple_[c] for c in columns)
+            bucket = index[key]
+            bucket.remove(tuple_)
+            if len(bucket) == 0:
+                del index[key]
+
+    def insert(self, tuples: AbstractSet[Tuple[Any, ...]]) \
+            -> AbstractSet[Tuple[Any, ...]]:
+        new = set(tuples) - self.tuples
+        self.tuples |= new
+        for (columns, index) in self.indexes.items():
+            for tuple_ in new:
+                index[tuple(tuple_[c] for c in columns)].append(tuple_)
+        return new
+
+    def clear(self) -> None:
+        self.tuples = set()
+        self.indexes = {}
+
+    def index(self, columns: Tuple[int, ...]) \
+            -> Optional[Dict[Tuple[Any, ...], List[Tuple[Any, ...]]]]:
+        index = self.indexes.get(columns)
+        if index is None:
+            index = defaultdict(list)
+            for tuple_ in self.tuples:
+                index[tuple(tuple_[c] for c in columns)].append(tuple_)
+            self.indexes[columns] = index
+        return index
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> 'IndexedRelation':
+        # Tuples are immutable, so copies can share them.
+        copy = IndexedRelation()
+        copy.tuples = set(self.tuples)
+        copy.indexes = {columns: defaultdict(list, {k: list(ts)
+                                                    for (k, ts)
+                                                    in index.items()})
+                        for (columns, index) in self.indexes.items()}
+        return copy
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # Indexes are rebuilt on demand, so only the tuples are pickled.
+        return (IndexedRelation, (list(self),))
+
+    def __repr__(self) -> str:
+        return f'IndexedRelation({self.tuples})'
+
+def nbytes(relation: AbstractSet[Tuple[Any, ...]]) -> int:
+    """
+    `nbytes(relation)` returns the number of bytes used by `relation`. For a
+    `CompactRelation`, this is `relation.nbytes()`. For a set of tuples, it
+    is the size of the set, its tuples, and the distinct values in its
+    tuples.
+    """
+    if isinstance(relation, CompactRelation):
+        return relation.nbytes()
+
+    values: Dict[int, Any] = {}
+    size = sys.getsizeof(relation)
+    for tuple_ in relation:
+        size += sys.getsizeof(tuple_)
+        for v in tuple_:
+            values[id(v)] = v
+    return size + sum(sys.getsizeof(v) for v in values.values())
+
+# The relation backends, by name. A backend is a function that returns an
+# empty relation.
+BACKENDS: Dict[str, Callable[[], MutableSet[Tuple[Any, ...]]]] = {
+    'set': set,
+    'compact': CompactRelation,
+    'indexed': IndexedRelation,
+}
+
+class Storage:
+    """
+    A `Storage` chooses the backend (see `BACKENDS`) of every relation of a
+    process: the relations of the predicates in `backends` use the backend
+    named there, and every other relation uses `default`.
+
+        storage = Storage('set', {'kvs': 'compact'})
+        storage.relation(Predicate('kvs'))  # an empty CompactRelation
+        storage.relation(Predicate('log'))  # an empty set
+    """
+    def __init__(self,
+                 default: str = 'set',
+                 backends: Mapping[str, str] = None) \
+                 -> None:
+        backends = dict(backends or {})
+        for name in [default] + list(backends.values()):
+            if name not in BACKENDS:
+                msg = (f'Unknown relation backend {name}. The backends are '
+                       f'{", ".join(sorted(BACKENDS))}.')
+                raise ValueError(msg)
+        self.default = default
+        self.backends = backends
+
+    @staticmethod
+    def parse(spec: str) -> 'Storage':
+        """
+        `Storage.parse(spec)` parses a comma separated list of a default
+        backend and `predicate=backend` pairs, like `set,kvs=compact`. The
+        default backend can be omitted, in which case it is `set`.
+        """
+        default = 'set'
+        backends: Dict[str, str] = {}
+        for item in spec.split(','):
+            item = item.strip()
+            if '=' in item:
+                (p, name) = item.split('=', 1)
+                backends[p.strip()] = name.strip()
+            elif item != '':
+                default = item
+        return Storage(default, backends)
+
+    def relation(self, p: asts.Predicate) -> MutableSet[Tuple[Any, ...]]:
+        """`storage.relation(p)` returns an empty relation for `p`."""
+        return BACKENDS[self.backends.get(p.x, self.default)]()
+
+    def database(self) -> DefaultDict[asts.Predicate,
+                                      MutableSet[Tuple[Any, ...]]]:
+        """
+        `storage.database()` returns an empty database that creates the
+        relation of a predicate with `storage.relation` when it is first used.
+        """
+        return _Database(self)
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> 'Storage':
+        # A storage is never modified, so copies can share it.
+        return self
+
+    def __repr__(self) -> str:
+        return f'Storage({self.default!r}, {self.backends!r})'
+
+class _Database(DefaultDict[asts.Predicate, MutableSet[Tuple[Any, ...]]]):
+    def __init__(self, storage: Storage) -> None:
+        super().__init__(None)
+        self.storage = storage
+
+    def __missing__(self, p: asts.Predicate) -> MutableSet[Tuple[Any, ...]]:
+        relation = self.storage.relation(p)
+        self[p] = relation
+        return relation
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return (_Database, (self.storage,), None, None, iter(self.items()))
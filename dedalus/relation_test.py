@@ -0,0 +1,179 @@
+from copy import deepcopy
+from typing import List, MutableSet, Set, Tuple
+import pickle
+import unittest
+
+from desugar import desugar
+from relation import (CompactRelation, IndexedRelation, Storage, Symbols,
+                      insert, lookup, nbytes)
+from run import Relation, _Indexes, memory_usage, run, spawn
+from typecheck import typecheck
+import asts
+import parser
+
+
+class TestRelation(unittest.TestCase):
+    def test_symbols(self) -> None:
+        symbols = Symbols()
+        self.assertEqual(symbols.intern('a'), 0)
+        self.assertEqual(symbols.intern('b'), 1)
+        self.assertEqual(symbols.intern('a'), 0)
+        self.assertEqual(symbols.values, ['a', 'b'])
+
+    def test_add_and_discard(self) -> None:
+        r = CompactRelation()
+        expected: Set[Tuple[str, ...]] = set()
+        for i in range(200):
+            r.add((f'a{i % 50}', f'b{i % 7}'))
+            expected.add((f'a{i % 50}', f'b{i % 7}'))
+        self.assertEqual(len(r), len(expected))
+        self.assertEqual(set(r), expected)
+        self.assertEqual(r, expected)
+        self.assertTrue(('a0', 'b0') in r)
+        self.assertFalse(('a0', 'b4') in r)
+        self.assertFalse(('a0', 'never_interned') in r)
+        self.assertFalse(('a0',) in r)
+
+        for i in range(0, 50, 2):
+            for j in range(7):
+                r.discard((f'a{i}', f'b{j}'))
+                expected.discard((f'a{i}', f'b{j}'))
+        self.assertEqual(set(r), expected)
+        for t in expected:
+            self.assertTrue(t in r)
+
+        r.add(('a0', 'b0'))
+        expected.add(('a0', 'b0'))
+        self.assertEqual(set(r), expected)
+
+    def test_arity(self) -> None:
+        r = CompactRelation([()])
+        self.assertEqual(set(r), {()})
+        r.add(())
+        self.assertEqual(len(r), 1)
+        with self.assertRaises(ValueError):
+            r.add(('a',))
+
+    def test_set_operations(self) -> None:
+        r: Relation = CompactRelation([('a', 'b'), ('b', 'c')])
+        s = {('b', 'c'), ('c', 'd')}
+        self.assertEqual(s - r, {('c', 'd')})
+        self.assertEqual(r - s, {('a', 'b')})
+        self.assertEqual(r | s, {('a', 'b'), ('b', 'c'), ('c', 'd')})
+        r |= s
+        self.assertEqual(r, {('a', 'b'), ('b', 'c'), ('c', 'd')})
+        self.assertIsInstance(r, CompactRelation)
+
+    def test_copy(self) -> None:
+        r = CompactRelation([('a', 'b'), ('b', 'c')])
+        copy = deepcopy(r)
+        copy.add(('c', 'd'))
+        self.assertEqual(r, {('a', 'b'), ('b', 'c')})
+        self.assertEqual(copy, {('a', 'b'), ('b', 'c'), ('c', 'd')})
+        self.assertEqual(pickle.loads(pickle.dumps(r)), r)
+
+    def test_nbytes(self) -> None:
+        tuples = {(f'a{i}', f'b{i}', f'c{i}') for i in range(1000)}
+        self.assertLess(nbytes(CompactRelation(tuples)), nbytes(tuples) / 4)
+
+    def test_compact_process(self) -> None:
+        source = """
+            link(#a, b) :- .
+            link(#b, c) :- .
+            path(#X, Y) :- link(#X, Y).
+            path(#X, Z) :- path(#X, Y), link(#X, Z).
+            path(#X, Y)@next :- path(#X, Y).
+            count(#X, Y)@async :- path(#X, Y).
+        """
+        program = typecheck(desugar(parser.parse(source)))
+        expected = run(spawn(program, lambda: 2), 3)
+        actual = run(spawn(program, lambda: 2, compact=True), 3)
+        self.assertEqual(actual.database, expected.database)
+        self.assertEqual(actual.async_buffer, expected.async_buffer)
+        for db in [actual.database] + list(actual.async_buffer.values()):
+            for r in db.values():
+                self.assertIsInstance(r, CompactRelation)
+        self.assertEqual({p: size for (p, (size, _))
+                             in memory_usage(actual).items()},
+                         {p: size for (p, (size, _))
+                             in memory_usage(expected).items()})
+
+    def test_insert(self) -> None:
+        relations: List[MutableSet[Tuple[str, ...]]] = \
+            [set(), CompactRelation()]
+        for r in relations:
+            r.add(('a', 'b'))
+            new = insert(r, {('a', 'b'), ('b', 'c')})
+            self.assertEqual(new, {('b', 'c')})
+            self.assertEqual(r, {('a', 'b'), ('b', 'c')})
+
+    def test_lookup(self) -> None:
+        tuples = {('a', 'b', 'c'), ('a', 'c', 'c'), ('b', 'b', 'c')}
+        relations: List[MutableSet[Tuple[str, ...]]] = \
+            [set(tuples), CompactRelation(tuples), IndexedRelation(tuples)]
+        for r in relations:
+            self.assertEqual(set(lookup(r, (0,), ('a',))),
+                             {('a', 'b', 'c'), ('a', 'c', 'c')})
+            self.assertEqual(set(lookup(r, (1, 2), ('b', 'c'))),
+                             {('a', 'b', 'c'), ('b', 'b', 'c')})
+            self.assertEqual(set(lookup(r, (0,), ('z',))), set())
+
+    def test_indexed(self) -> None:
+        r = IndexedRelation([('a', 'b'), ('a', 'c')])
+        index = r.index((0,))
+        assert index is not None
+        self.assertEqual(sorted(index[('a',)]), [('a', 'b'), ('a', 'c')])
+
+        # Indexes are kept up to date.
+        self.assertEqual(insert(r, {('a', 'b'), ('b', 'c')}), {('b', 'c')})
+        r.discard(('a', 'b'))
+        r.discard(('a', 'c'))
+        self.assertEqual(r, {('b', 'c')})
+        self.assertEqual(dict(index), {('b',): [('b', 'c')]})
+        self.assertEqual(list(r.lookup((1,), ('c',))), [('b', 'c')])
+
+        copy = deepcopy(r)
+        copy.add(('c', 'd'))
+        self.assertEqual(r, {('b', 'c')})
+        self.assertEqual(list(copy.lookup((0,), ('c',))), [('c', 'd')])
+        self.assertEqual(pickle.loads(pickle.dumps(copy)), copy)
+
+        # The evaluator looks tuples up in the relation's own indexes.
+        p = asts.Predicate('p')
+        self.assertIs(_Indexes({p: r}).table(p, (0,)), index)
+
+    def test_storage(self) -> None:
+        storage = Storage.parse('compact,log=set')
+        (kvs, log) = (asts.Predicate('kvs'), asts.Predicate('log'))
+        self.assertIsInstance(storage.relation(kvs), CompactRelation)
+        self.assertIsInstance(storage.relation(log), set)
+        db = deepcopy(storage.database())
+        self.assertIsInstance(db[kvs], CompactRelation)
+        self.assertIsInstance(pickle.loads(pickle.dumps(db))[log], set)
+        with self.assertRaises(ValueError):
+            Storage.parse('set,kvs=trie')
+
+        source = """
+            link(#a, b) :- .
+            link(#b, c) :- .
+            path(#X, Y) :- link(#X, Y).
+            path(#X, Z) :- path(#X, Y), link(#X, Z).
+            count(#X, Y)@async :- path(#X, Y).
+        """
+        program = typecheck(desugar(parser.parse(source)))
+        expected = run(spawn(program, lambda: 2), 3)
+        storage = Storage('set', {'path': 'compact'})
+        actual = run(spawn(program, lambda: 2, storage=storage), 3)
+        self.assertEqual(actual.database, expected.database)
+        self.assertIsInstance(actual.database[asts.Predicate('path')],
+                              CompactRelation)
+        self.assertIsInstance(actual.database[asts.Predicate('link')], set)
+
+        storage = Storage('indexed')
+        actual = run(spawn(program, lambda: 2, storage=storage), 3)
+        self.assertEqual(actual.database, expected.database)
+        self.assertIsInstance(actual.database[asts.Predicate('link')],
+                              IndexedRelation)
+
+if __name__ == '__main__':
+    unittest.main()
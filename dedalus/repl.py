@@ -1,24 +1,56 @@
 from parsec import generate, many, regex, string, times
-from typing import NamedTuple, Optional, Union
+from typing import Any, Iterator, List, NamedTuple, Optional, Tuple, Union
+import itertools
 import re
 import traceback
 
+from tabulate import tabulate
+
 from desugar import desugar
-from parser import parse
-from typecheck import typecheck, typechecks
+from magic import desugar_query
+from parser import parse, parse_atom
+from typecheck import Typechecker
 import asts
 import run
 
 
 class ReplState(NamedTuple):
     program: Optional[asts.Program]
-    process: Optional[run.Process]
+    # Rules are typechecked and processes are stepped incrementally, so that
+    # neither gets slower as the program grows (see `typecheck.Typechecker`
+    # and `run.Engine`).
+    typechecker: Optional[Typechecker]
+    engine: Optional[run.Engine]
+    # The rest of the answer to the last query, printed a page at a time.
+    results: Optional[Iterator[Tuple[Any, ...]]] = None
+
+# The number of tuples printed at a time.
+PAGE_SIZE = 20
+
+def _print_page(state: ReplState,
+                tuples: Iterator[Tuple[Any, ...]],
+                limit: int = PAGE_SIZE) \
+                -> ReplState:
+    # Tuples are pulled from `tuples` lazily, so printing a page of a large
+    # answer only computes the tuples on the page (and one more, to tell
+    # whether there are more).
+    page = list(itertools.islice(tuples, limit))
+    rest = list(itertools.islice(tuples, 1))
+    if len(page) == 0:
+        print("No tuples.")
+    else:
+        print(tabulate(page, tablefmt='orgtbl'))
+    if len(rest) == 0:
+        return state._replace(results=None)
+    print("More tuples: #more.")
+    return state._replace(results=itertools.chain(rest, tuples))
 
 class Help(NamedTuple):
     pass
 
     def run(self, state: ReplState) -> ReplState:
-        print("#load <filename> | #show | #step <n> | <rule>")
+        print("#load <filename> | #show | #show <predicate> limit <n> | "
+              "#step <n> | #query <atom> | #count <atom> | #more | <rule>")
         return state
 
 class Load(NamedTuple):
@@ -26,8 +58,8 @@ class Load(NamedTuple):
 
     def run(self, state: ReplState) -> ReplState:
         with open(self.filename) as f:
-            program = typecheck(desugar(parse(f.read())))
-            return state._replace(program=program)
+            program = desugar(parse(f.read()))
+            return ReplState(program, Typechecker(program), None)
 
 class Show(NamedTuple):
     pass
@@ -47,29 +79,75 @@ class Step(NamedTuple):
             print("No program.")
             return state
 
-        process = state.process or run.spawn(state.program)
+        engine = state.engine or run.Engine(run.spawn(state.program))
         timesteps = self.timesteps or 1
-        process = run.run(process, timesteps)
+        process = engine.run(timesteps)
         print(str(process))
-        return state._replace(process=process)
+        return state._replace(engine=engine, results=None)
+
+class ShowRelation(NamedTuple):
+    predicate: str
+    limit: Optional[int]
+
+    def run(self, state: ReplState) -> ReplState:
+        if state.engine is None:
+            print("No process. Use #step first.")
+            return state
+        p = asts.Predicate(self.predicate)
+        relation = state.engine.process.database.get(p, set())
+        limit = PAGE_SIZE if self.limit is None else self.limit
+        print(f'{len(relation)} tuples.')
+        return _print_page(state, iter(relation), limit)
+
+class Query(NamedTuple):
+    atom: str
+
+    def run(self, state: ReplState) -> ReplState:
+        if state.engine is None:
+            print("No process. Use #step first.")
+            return state
+        atom = desugar_query(parse_atom(self.atom))
+        return _print_page(state, state.engine.match(atom))
+
+class Count(NamedTuple):
+    atom: str
+
+    def run(self, state: ReplState) -> ReplState:
+        if state.engine is None:
+            print("No process. Use #step first.")
+            return state
+        atom = desugar_query(parse_atom(self.atom))
+        print(state.engine.count(atom))
+        return state
+
+class More(NamedTuple):
+    pass
+
+    def run(self, state: ReplState) -> ReplState:
+        if state.results is None:
+            print("No more tuples.")
+            return state
+        return _print_page(state, state.results)
 
 class Line(NamedTuple):
     line: str
 
     def run(self, state: ReplState) -> ReplState:
-        program = typecheck(desugar(parse(self.line)))
-        if state.program is None:
-            return state._replace(program=program)
+        program = desugar(parse(self.line))
+        if state.program is None or state.typechecker is None:
+            return ReplState(program, Typechecker(program), None)
 
         assert len(program.rules) == 1
-        state.program.rules.append(program.rules[0])
         try:
-            typecheck(state.program)
-            return state
+            state.typechecker.add(program.rules[0])
         except ValueError as e:
             traceback.print_exc()
-            del state.program.rules[len(state.program.rules) - 1]
             return state
+        rules = state.program.rules + program.rules
+        if state.engine is not None:
+            state.engine.add(program.rules)
+        return state._replace(program=state.program._replace(rules=rules),
+                              results=None)
 
 
 # Whitespace and comments.
@@ -87,6 +165,11 @@ help_cmd = lexeme(regex(r'#help', re.IGNORECASE))
 load_cmd = lexeme(regex(r'#load', re.IGNORECASE))
 show_cmd = lexeme(regex(r'#show', re.IGNORECASE))
 step_cmd = lexeme(regex(r'#step', re.IGNORECASE))
+query_cmd = lexeme(regex(r'#query', re.IGNORECASE))
+count_cmd = lexeme(regex(r'#count', re.IGNORECASE))
+more_cmd = lexeme(regex(r'#more', re.IGNORECASE))
+limit_kw = lexeme(regex(r'limit', re.IGNORECASE))
+predicate = lexeme(regex(r'[a-z]\w*'))
 
 # Parsing.
 def maybe(p):
@@ -99,13 +182,23 @@ def maybe(p):
 
 help_ = help_cmd.parsecmap(lambda _: Help())
 load = load_cmd >> filename.parsecmap(Load)
-show = show_cmd.parsecmap(lambda _: Show())
+@generate
+def show_relation():
+    yield show_cmd
+    predicate_ = yield predicate
+    limit = yield maybe(limit_kw >> number)
+    return ShowRelation(predicate_, limit)
+
+show = show_relation ^ show_cmd.parsecmap(lambda _: Show())
 line = anything.parsecmap(Line)
 step = step_cmd >> maybe(number).parsecmap(Step)
-command = ignore >> (help_ ^ load ^ show ^ step ^ line)
+query = query_cmd >> anything.parsecmap(Query)
+count = count_cmd >> anything.parsecmap(Count)
+more = more_cmd.parsecmap(lambda _: More())
+command = ignore >> (help_ ^ load ^ show ^ step ^ query ^ count ^ more ^ line)
 
 def repl(filename: Optional[str]) -> None:
-    state = ReplState(None, None)
+    state = ReplState(None, None, None)
     if filename is not None:
         # Pylint is confused: https://github.com/PyCQA/pylint/issues/1628
         state = Load(filename).run(state) # pylint: disable=no-member
@@ -1,18 +1,24 @@
 from collections import defaultdict
 from copy import deepcopy
-from itertools import product
-from typing import (Any, Callable, DefaultDict, Dict, FrozenSet, Generator,
-                    List, NamedTuple, Optional, Set, Tuple)
+from operator import itemgetter
+from typing import (AbstractSet, Any, Callable, DefaultDict, Dict, FrozenSet,
+                    Generator, Iterable, List, MutableSet, NamedTuple,
+                    Optional, Sequence, Set, Tuple)
 import random
+import threading
 
 from tabulate import tabulate
 from termcolor import colored
 import networkx as nx
 
+from relation import Storage, insert, native_index, nbytes
+from spill import SpillingAsyncBuffer
 import asts
+import builtin
+import codegen
 
 
-Relation = Set[Tuple[Any, ...]]
+Relation = MutableSet[Tuple[Any, ...]]
 Database = Dict[asts.Predicate, Relation]
 DefaultDatabase = DefaultDict[asts.Predicate, Relation]
 AsyncBuffer = DefaultDict[int, DefaultDatabase]
@@ -26,6 +32,21 @@ class Process(NamedTuple):
     database: Database
     async_buffer: AsyncBuffer
     randint: RandInt
+    # The inputs of the previous timestep, if the process's deductive
+    # relations are maintained incrementally (see `_maintain`).
+    inputs: Optional[Database] = None
+    # Whether the process's rules are compiled to Python (see `codegen.py`).
+    compiled: bool = False
+    # The aggregations of the process's deductive aggregate rules, keyed by
+    # the index of the rule in the program, if they are maintained
+    # incrementally along with its deductive relations.
+    aggregates: Optional[Dict[int, '_Aggregation']] = None
+    # The versions of the process's relations, if the strata and rules whose
+    # inputs didn't change are skipped (see `_Versions`).
+    versions: Optional['_Versions'] = None
+    # The backends of the process's relations (see `relation.Storage`), or
+    # None for the default backends.
+    storage: Optional[Storage] = None
 
     def __str__(self) -> str:
         def underline(s: str) -> str:
@@ -51,17 +72,18 @@ class Process(NamedTuple):
 
         ss.append(underline(f'Async buffer.'))
 
-        for t in sorted(self.async_buffer):
-            for p in sorted(self.async_buffer[t]):
-                if len(self.async_buffer[t][p]) > 0:
+        for (t, db) in sorted(self.async_buffer.items(), key=itemgetter(0)):
+            for p in sorted(db):
+                if len(db[p]) > 0:
                     ss.append(colored_relation(p.x, t))
-                    async_relation = self.async_buffer[t][p]
-                    ss.append(formatted_table(async_relation))
+                    ss.append(formatted_table(db[p]))
 
         return '\n'.join(ss)
 
-def _empty_database(program: asts.Program) -> Database:
-    return {p: set() for p in program.predicates()}
+def _empty_database(program: asts.Program, storage: Storage = None) \
+        -> Database:
+    storage = storage or Storage()
+    return {p: storage.relation(p) for p in program.predicates()}
 
 def _empty_default_database() -> DefaultDatabase:
     return defaultdict(set)
@@ -89,7 +111,8 @@ def _subst(atom: asts.Atom, bindings: Bindings) -> Tuple[Any, ...]:
     return tuple(values)
 
 def _unify(atoms: List[asts.Atom],
-           tuples: List[Tuple[Any, ...]]) \
+           tuples: List[Tuple[Any, ...]],
+           initial: Bindings = None) \
            -> Optional[Bindings]:
     """
     Consider the following rule which finds all the trianges in a graph `g`:
@@ -106,9 +129,11 @@ def _unify(atoms: List[asts.Atom],
 
     `_unify` attempts to instantiate a set of atoms with the provided set of
     tuples. If the instantiation suceeds, the bindings produced are returned.
-    If the instantiation fails, None is returned.
+    If the instantiation fails, None is returned. If `initial` is provided, the
+    instantiation must also agree with the bindings in `initial`, and the
+    returned bindings extend them.
     """
-    bindings: Bindings = {}
+    bindings: Bindings = dict(initial) if initial is not None else {}
     assert len(atoms) == len(tuples), (atoms, tuples)
     for (atom, tuple_) in zip(atoms, tuples):
         assert len(atom.terms) == len(tuple_), (atom, tuple_)
@@ -123,8 +148,449 @@ def _unify(atoms: List[asts.Atom],
                 bindings[term.x] = value
     return bindings
 
+class _Index:
+    def __init__(self, relation: Relation) -> None:
+        self.relation = relation
+        self.size = 0
+        self.table: DefaultDict[Tuple[Any, ...], List[Tuple[Any, ...]]] = \
+            defaultdict(list)
+
+class _Indexes:
+    """
+    `_Indexes` maintains secondary indexes on the relations of a database. An
+    index on columns (i, j, ...) of predicate p maps every key (t[i], t[j],
+    ...) to the list of tuples t in p with that key. For example, the atom
+    `g(a, Y)` is answered by looking up the key (a,) in the index on column 0
+    of `g` rather than by scanning all of `g`.
+
+    Which indexes exist is driven by the access patterns of the rules being
+    evaluated: an index on columns (i, j, ...) of p is built the first time an
+    atom of p with constants or bound variables in exactly those columns is
+    joined (see `_Access`). Tuples inserted with `insert` are added to every
+    existing index of their relation, and tuples deleted with `delete` are
+    removed from them. An index remembers which relation it was built from
+    and how big the relation was, and it is rebuilt if the relation is
+    replaced or modified without using `insert` or `delete`. A relation
+    backend that maintains indexes of its own (see `relation.Relation.index`)
+    is looked up in them instead.
+    """
+    def __init__(self, db: Database) -> None:
+        self.db = db
+        self.indexes: DefaultDict[asts.Predicate,
+                                  Dict[Tuple[int, ...], _Index]] = \
+            defaultdict(dict)
+
+    def lookup(self,
+               p: asts.Predicate,
+               columns: Tuple[int, ...],
+               key: Tuple[Any, ...]) \
+               -> List[Tuple[Any, ...]]:
+        return self.table(p, columns).get(key, [])
+
+    def table(self,
+              p: asts.Predicate,
+              columns: Tuple[int, ...]) \
+              -> Dict[Tuple[Any, ...], List[Tuple[Any, ...]]]:
+        """
+        `indexes.table(p, columns)` returns the index on `columns` of the
+        relation of `p`, building it if needed. The index maps keys to lists of
+        tuples and is only valid until the relation is next modified.
+        """
+        relation = self.db[p]
+        native = native_index(relation, columns)
+        if native is not None:
+            return native
+        index = self.indexes[p].get(columns)
+        if (index is None or
+            index.relation is not relation or
+            index.size != len(relation)):
+            index = _Index(relation)
+            self._add(index, columns, relation)
+            self.indexes[p][columns] = index
+        return index.table
+
+    def insert(self,
+               p: asts.Predicate,
+               tuples: AbstractSet[Tuple[Any, ...]]) \
+               -> AbstractSet[Tuple[Any, ...]]:
+        """
+        `indexes.insert(p, tuples)` inserts `tuples` into the relation of `p`,
+        updating its indexes, and returns the tuples that were not already in
+        the relation.
+        """
+        relation = self.db[p]
+        valid = [(columns, index)
+                 for (columns, index) in self.indexes[p].items()
+                 if index.relation is relation and index.size == len(relation)]
+        new = insert(relation, tuples)
+        for (columns, index) in valid:
+            self._add(index, columns, new)
+        return new
+
+    def delete(self,
+               p: asts.Predicate,
+               tuples: AbstractSet[Tuple[Any, ...]]) \
+               -> None:
+        """
+        `indexes.delete(p, tuples)` deletes `tuples` from the relation of `p`,
+        updating its indexes.
+        """
+        relation = self.db[p]
+        old = {t for t in tuples if t in relation}
+        if len(old) == 0:
+            return
+
+        for (columns, index) in self.indexes[p].items():
+            if (index.relation is relation and
+                index.size == len(relation)):
+                for tuple_ in old:
+                    key = tuple(tuple_[c] for c in columns)
+                    index.table[key].remove(tuple_)
+                index.size -= len(old)
+        relation -= old
+
+    @staticmethod
+    def _add(index: _Index,
+             columns: Tuple[int, ...],
+             tuples: AbstractSet[Tuple[Any, ...]]) \
+             -> None:
+        table = index.table
+        for tuple_ in tuples:
+            table[tuple(tuple_[c] for c in columns)].append(tuple_)
+        index.size += len(tuples)
+
+class _Access(NamedTuple):
+    """
+    An `_Access` describes how to join an atom given the set of variables
+    that are already bound. `columns` are the columns of the atom that are
+    constants or bound variables, and `key` computes the index key for these
+    columns from the bindings. `assign` lists the columns that bind new
+    variables, and `checks` lists the pairs of columns that contain the same
+    new variable and must therefore be equal. For example, the atom `p(X, a,
+    Y, Y)` with X bound has columns (0, 1), assigns column 2 to Y, and checks
+    that columns 2 and 3 are equal.
+    """
+    predicate: asts.Predicate
+    columns: Tuple[int, ...]
+    key: Callable[[Bindings], Tuple[Any, ...]]
+    assign: List[Tuple[int, str]]
+    checks: List[Tuple[int, int]]
+
+def _access(atom: asts.Atom, bound: Set[str]) -> _Access:
+    columns: List[int] = []
+    bound_terms: List[asts.Term] = []
+    assign: List[Tuple[int, str]] = []
+    checks: List[Tuple[int, int]] = []
+    first: Dict[str, int] = {}
+    for (i, term) in enumerate(atom.terms):
+        if isinstance(term, asts.Constant) or term.x in bound:
+            columns.append(i)
+            bound_terms.append(term)
+        elif term.x in first:
+            checks.append((first[term.x], i))
+        else:
+            first[term.x] = i
+            assign.append((i, term.x))
+    key = _substituter(asts.Atom(atom.predicate, tuple(bound_terms)))
+    return _Access(atom.predicate, tuple(columns), key, assign, checks)
+
+def _extend(indexes: _Indexes,
+            access: _Access,
+            bindings: Bindings) \
+            -> Generator[Bindings, None, None]:
+    """
+    `_extend(indexes, access, bindings)` generates every extension of
+    `bindings` that instantiates the atom described by `access`.
+    """
+    if len(access.columns) == 0:
+        candidates: Iterable[Tuple[Any, ...]] = indexes.db[access.predicate]
+    else:
+        key = access.key(bindings)
+        candidates = indexes.lookup(access.predicate, access.columns, key)
+
+    for tuple_ in candidates:
+        if any(tuple_[i] != tuple_[j] for (i, j) in access.checks):
+            continue
+        extended = dict(bindings)
+        for (i, x) in access.assign:
+            extended[x] = tuple_[i]
+        yield extended
+
+def _applier(b: asts.Builtin,
+             assignment: Optional[Tuple[str, asts.Expression]]) \
+             -> Callable[[Bindings], bool]:
+    """
+    `_applier(b, assignment)` returns a function that applies the built-in
+    predicate `b` (see `builtin.ready`) to some bindings. A filter returns
+    whether the bindings satisfy it. An assignment binds its variable and
+    returns whether its expression is defined.
+    """
+    if assignment is None:
+        op = b.op
+        left = builtin.evaluator(b.left)
+        right = builtin.evaluator(b.right)
+        return lambda bindings: builtin.compare(op, left(bindings),
+                                                right(bindings))
+
+    (x, expression) = assignment
+    evaluate = builtin.evaluator(expression)
+    def assign(bindings: Bindings) -> bool:
+        value = evaluate(bindings)
+        if value is None:
+            return False
+        bindings[x] = value
+        return True
+    return assign
+
+def _join_order(atoms: List[asts.Atom],
+                bound: Set[str],
+                builtins: Sequence[asts.Builtin] = ()) \
+                -> List[asts.Atom]:
+    """
+    `_join_order(atoms, bound, builtins)` orders `atoms` for joining, given
+    the variables in `bound`. At every step, the atom with the most constants
+    and bound variables is joined next, so that as many atoms as possible are
+    answered with index lookups rather than scans. Ties are broken by the
+    original order of the atoms. Variables bound by the built-in predicates in
+    `builtins` (e.g. Z in `Z = X + 1`) count as bound as soon as the variables
+    they're computed from are.
+    """
+    bound = set(bound)
+    pending = list(builtins)
+    builtin.ready(pending, bound)
+    remaining = list(atoms)
+    ordered: List[asts.Atom] = []
+    while len(remaining) > 0:
+        def num_bound(atom: asts.Atom) -> int:
+            return sum(1 for t in atom.terms
+                         if isinstance(t, asts.Constant) or t.x in bound)
+        atom = max(remaining, key=num_bound)
+        remaining.remove(atom)
+        ordered.append(atom)
+        bound |= {v.x for v in atom.variables()}
+        builtin.ready(pending, bound)
+    return ordered
+
+class _Prefixes:
+    """
+    Many rules share identical subsets of their bodies. For example, these
+    rules from `examples/binary_counter.dedalus` all contain `b1(1), b0(1)`:
+
+        b2(0)@next :- b2(1), b1(1), b0(1).
+        b2(1)@next :- b2(0), b1(1), b0(1).
+        b3(0)@next :- b3(1), b2(1), b1(1), b0(1).
+        b3(1)@next :- b3(0), b2(1), b1(1), b0(1).
+
+    `_Prefixes` evaluates these common conjunctions once and shares the result
+    between all the rules that contain them. First, the positive atoms of
+    every rule are sorted so that atoms that appear in many rules come first.
+    For example, the rules above become:
+
+        b2(0)@next :- b0(1), b1(1), b2(1).
+        b2(1)@next :- b0(1), b1(1), b2(0).
+        b3(0)@next :- b0(1), b1(1), b2(1), b3(1).
+        b3(1)@next :- b0(1), b1(1), b2(1), b3(0).
+
+    Then, the variables of every prefix of every sorted body are renamed in
+    order of appearance (e.g. `p(X, Y), q(Y, Z)` becomes `p(V0, V1), q(V1,
+    V2)`) so that equivalent prefixes are identical. Every rule is evaluated
+    starting from the bindings of the longest prefix it shares with another
+    rule. Here, the bindings of `b0(1), b1(1)` are computed once and shared by
+    all four rules, and the bindings of `b0(1), b1(1), b2(1)` are computed once
+    (from the bindings of `b0(1), b1(1)`) and shared by the last three rules.
+
+    The bindings of a prefix are cached along with the sizes of the relations
+    they were computed from. Within a timestep, relations only grow, so a
+    cached prefix is up to date so long as the sizes of its relations haven't
+    changed. A `_Prefixes` should not be used across timesteps without
+    calling `clear` in between.
+    """
+    def __init__(self, rules: Sequence[asts.Rule]) -> None:
+        # For every rule, the canonicalized shared prefix of the rule, the
+        # variables of the prefix (in canonical order), and the rest of the
+        # rule's positive atoms.
+        self.plans: Dict[int, Tuple[List[asts.Atom],
+                                    List[str],
+                                    List[asts.Atom]]] = {}
+        self.cache: Dict[str, Tuple[Tuple[int, ...], List[Tuple[Any, ...]]]] \
+            = {}
+
+        signatures = {id(a): _canonical_keys([a])[0]
+                      for rule in rules for a in _positive_atoms(rule)}
+
+        frequency: DefaultDict[str, int] = defaultdict(int)
+        for signature in signatures.values():
+            frequency[signature] += 1
+
+        def key(atom: asts.Atom) -> Tuple[int, str]:
+            signature = signatures[id(atom)]
+            return (-frequency[signature], signature)
+
+        sorted_atoms = [sorted(_positive_atoms(rule), key=key)
+                        for rule in rules]
+        keys = [_canonical_keys(atoms) for atoms in sorted_atoms]
+
+        prefix_counts: DefaultDict[str, int] = defaultdict(int)
+        for rule_keys in keys:
+            for k in rule_keys:
+                prefix_counts[k] += 1
+
+        for (rule, atoms, rule_keys) in zip(rules, sorted_atoms, keys):
+            # A prefix consisting of a single atom of distinct variables is
+            # a scan of a relation, so there's nothing to gain by sharing it.
+            shared = 0
+            for (i, k) in enumerate(rule_keys):
+                if prefix_counts[k] > 1 and (i > 0 or not _is_scan(atoms[0])):
+                    shared = i + 1
+            prefix = atoms[:shared]
+            self.plans[id(rule)] = (_canonicalize(prefix),
+                                    _variables(prefix),
+                                    atoms[shared:])
+
+    def clear(self) -> None:
+        """`prefixes.clear()` forgets the cached bindings of every prefix."""
+        self.cache.clear()
+
+    def bindings(self,
+                 indexes: _Indexes,
+                 rule: asts.Rule) \
+                 -> Tuple[List[Bindings], List[asts.Atom]]:
+        """
+        `prefixes.bindings(indexes, rule)` returns the bindings of the shared
+        prefix of `rule` and the positive atoms of `rule` that are not in the
+        prefix.
+        """
+        if id(rule) not in self.plans:
+            return ([{}], _positive_atoms(rule))
+
+        (canonical, variables, rest) = self.plans[id(rule)]
+        bindings = [dict(zip(variables, values))
+                    for values in self._materialize(indexes, canonical)]
+        return (bindings, rest)
+
+    def _materialize(self,
+                     indexes: _Indexes,
+                     atoms: List[asts.Atom]) \
+                     -> List[Tuple[Any, ...]]:
+        """
+        `prefixes._materialize(indexes, atoms)` returns the values of the
+        variables of the canonicalized conjunction `atoms` (in order of
+        appearance) for every instantiation of `atoms`.
+        """
+        if len(atoms) == 0:
+            return [()]
+
+        db = indexes.db
+        key = _canonical_keys(atoms)[-1]
+        versions = tuple(len(db[a.predicate]) for a in atoms)
+        if key in self.cache and self.cache[key][0] == versions:
+            return self.cache[key][1]
+
+        # The variables of a canonicalized conjunction are named V0, V1, ... in
+        # order of appearance, so the variables of `atoms[:-1]` are a prefix of
+        # the variables of `atoms`.
+        parent = self._materialize(indexes, atoms[:-1])
+        variables = _variables(atoms)
+        n = len(_variables(atoms[:-1]))
+        access = _access(atoms[-1], set(variables[:n]))
+
+        values: List[Tuple[Any, ...]] = []
+        for parent_values in parent:
+            initial = dict(zip(variables, parent_values))
+            for bindings in _extend(indexes, access, initial):
+                new_values = tuple(bindings[v] for v in variables[n:])
+                values.append(parent_values + new_values)
+
+        self.cache[key] = (versions, values)
+        return values
+
+def _variables(atoms: List[asts.Atom]) -> List[str]:
+    """
+    `_variables(atoms)` returns the names of the variables in `atoms` in order
+    of appearance, without duplicates.
+    """
+    variables: List[str] = []
+    for atom in atoms:
+        for v in atom.variables():
+            if v.x not in variables:
+                variables.append(v.x)
+    return variables
+
+def _canonicalize(atoms: List[asts.Atom]) -> List[asts.Atom]:
+    """
+    `_canonicalize(atoms)` renames the variables of `atoms` to V0, V1, V2, ...
+    in order of appearance. For example, `p(X, Y), q(Y, Z, a)` becomes `p(V0,
+    V1), q(V1, V2, a)`.
+    """
+    names = {x: f'V{i}' for (i, x) in enumerate(_variables(atoms))}
+    def rename(term: asts.Term) -> asts.Term:
+        if isinstance(term, asts.Variable):
+            return asts.Variable(names[term.x], term.is_location)
+        return term
+    return [asts.Atom(a.predicate, tuple(rename(t) for t in a.terms))
+            for a in atoms]
+
+def _canonical_keys(atoms: List[asts.Atom]) -> List[str]:
+    """
+    `_canonical_keys(atoms)` returns a string representation of the
+    canonicalization (see `_canonicalize`) of every non-empty prefix of
+    `atoms`. For example, `p(X, Y), q(Y, Z, a)` has keys `p(V0, V1)` and
+    `p(V0, V1), q(V1, V2, a)`.
+    """
+    names: Dict[str, str] = {}
+    def rename(term: asts.Term) -> str:
+        if isinstance(term, asts.Variable):
+            if term.x not in names:
+                names[term.x] = f'V{len(names)}'
+            return names[term.x]
+        return str(term)
+
+    keys: List[str] = []
+    key = ''
+    for atom in atoms:
+        terms = ', '.join(rename(t) for t in atom.terms)
+        key += ('' if key == '' else ', ') + f'{atom.predicate}({terms})'
+        keys.append(key)
+    return keys
+
+def _positive_atoms(rule: asts.Rule) -> List[asts.Atom]:
+    return [l.atom for l in rule.body if l.is_positive()]
+
+def _substituter(atom: asts.Atom) -> Callable[[Bindings], Tuple[Any, ...]]:
+    """
+    `_substituter(atom)` returns a function `f` such that `f(bindings) ==
+    _subst(atom, bindings)`. Unlike `_subst`, `f` does not inspect the terms of
+    `atom` every time it is called.
+    """
+    terms = [(isinstance(t, asts.Constant), t.x) for t in atom.terms]
+    names = [x for (is_constant, x) in terms if not is_constant]
+    if len(names) != len(terms):
+        return lambda b: tuple(x if c else b[x] for (c, x) in terms)
+    elif len(names) == 0:
+        return lambda b: ()
+    elif len(names) == 1:
+        name = names[0]
+        return lambda b: (b[name],)
+    else:
+        return itemgetter(*names)
+
+def _is_scan(atom: asts.Atom) -> bool:
+    """
+    `_is_scan(atom)` returns whether every term of `atom` is a distinct
+    variable, in which case every tuple of the atom's relation matches it.
+    """
+    variables = {t.x for t in atom.terms if isinstance(t, asts.Variable)}
+    return len(variables) == len(atom.terms)
+
+# A negative literal's relation and the function that substitutes bindings
+# into its atom.
+_Filter = Tuple[Relation, Callable[[Bindings], Tuple[Any, ...]]]
+
 def _eval_rule(process: Process,
-               rule: asts.Rule) \
+               rule: asts.Rule,
+               prefixes: _Prefixes = None,
+               indexes: _Indexes = None,
+               initials: List[Bindings] = None) \
                -> Generator[Tuple[Any, ...], None, None]:
     """
     `_eval_rule(process, rule)` generates all the tuples produced by evaluating
@@ -134,24 +600,254 @@ def _eval_rule(process: Process,
 
     and a fully connected graph `g` on vertices a, b, and c, `_eval_rule` would
     return the tuples (a, b, c), (b, c, a), (c, a, b), (a, c, b), (c, b, a),
-    and (b, a, c).
+    and (b, a, c). If `prefixes` is provided, evaluation starts from the
+    shared bindings of the rule's prefix (see `_Prefixes`). If `initials` is
+    provided, evaluation starts from each of the bindings in `initials`
+    instead; every one of them must bind the same variables.
+
+    The positive atoms of the rule are joined in the order chosen by
+    `_join_order`, and every atom with a constant or bound variable is
+    answered with a lookup in one of the secondary indexes in `indexes` (see
+    `_Indexes`). Every negative atom is an anti-join that is applied as soon
+    as all of its variables are bound, so bindings that fail a negative
+    literal are pruned before they are joined with the rest of the body.
+    Range restriction guarantees that every term of a negative atom is bound
+    when it is applied, so an anti-join is a single hash lookup in the negated
+    relation. Likewise, every built-in predicate is applied as soon as its
+    variables are bound, either as a filter (e.g. `X < Y`) or, if it binds a
+    variable (e.g. `Z = X + 1`), as a computed binding that later atoms can
+    be looked up by. A rule of the form
+
+        kvs(K, V)@next :- kvs(K, V), !kvs_delete(K, V).
+
+    is evaluated as the set difference `kvs - kvs_delete`.
     """
-    positive_atoms = [l.atom for l in rule.body if l.is_positive()]
     negative_atoms = [l.atom for l in rule.body if l.is_negative()]
-    positive_predicates = [atom.predicate for atom in positive_atoms]
-    negative_predicates = [atom.predicate for atom in negative_atoms]
 
     db = process.database
-    positive_relations = [db[p] for p in positive_predicates]
-    for tuples in product(*positive_relations):
-        bindings = _unify(positive_atoms, tuples)
-        if bindings is None:
-            continue
+    indexes = indexes or _Indexes(db)
+    assert indexes.db is db
+    if initials is not None:
+        positive_atoms = _positive_atoms(rule)
+    elif prefixes is None:
+        initials = [{}]
+        positive_atoms = _positive_atoms(rule)
+    else:
+        (initials, positive_atoms) = prefixes.bindings(indexes, rule)
+    if len(initials) == 0:
+        return
 
-        if any(_subst(a, bindings) in db[a.predicate] for a in negative_atoms):
-            continue
+    # Rules with a single positive atom whose negative atoms and head all have
+    # the same terms (e.g. persistence rules) are a set difference.
+    if (initials == [{}] and
+        len(rule.builtins) == 0 and
+        len(positive_atoms) == 1 and
+        _is_scan(positive_atoms[0]) and
+        rule.head.terms == positive_atoms[0].terms and
+        all(a.terms == positive_atoms[0].terms for a in negative_atoms)):
+        relation: AbstractSet[Tuple[Any, ...]] = \
+            db[positive_atoms[0].predicate]
+        for atom in negative_atoms:
+            relation = relation - db[atom.predicate]
+        yield from relation
+        return
+
+    # `applied[i]` contains the built-in predicates that are applied, and
+    # `filters[i]` contains the negative atoms (and the substituters that
+    # compute their tuples) whose variables are all bound, after joining the
+    # first i positive atoms.
+    bound = set(initials[0])
+    positive_atoms = _join_order(positive_atoms, bound, rule.builtins)
+    pending = list(rule.builtins)
+    applied = [[_applier(*b) for b in builtin.ready(pending, bound)]]
+    accesses: List[_Access] = []
+    bound_after = [set(bound)]
+    for atom in positive_atoms:
+        accesses.append(_access(atom, bound))
+        bound |= {v.x for v in atom.variables()}
+        applied.append([_applier(*b) for b in builtin.ready(pending, bound)])
+        bound_after.append(set(bound))
+    filters: List[List[_Filter]] = [[] for _ in bound_after]
+    for atom in negative_atoms:
+        variables = {v.x for v in atom.variables()}
+        i = min(i for (i, b) in enumerate(bound_after) if variables <= b)
+        filters[i].append((db[atom.predicate], _substituter(atom)))
 
-        yield _subst(rule.head, bindings)
+    head = _substituter(rule.head)
+    n = len(positive_atoms)
+
+    def join(i: int, bindings: Bindings) \
+            -> Generator[Tuple[Any, ...], None, None]:
+        if len(applied[i]) > 0:
+            bindings = dict(bindings)
+            for apply in applied[i]:
+                if not apply(bindings):
+                    return
+        for (relation, subst) in filters[i]:
+            if subst(bindings) in relation:
+                return
+
+        if i == n:
+            yield head(bindings)
+            return
+
+        for extended in _extend(indexes, accesses[i], bindings):
+            yield from join(i + 1, extended)
+
+    for initial in initials:
+        yield from join(0, initial)
+
+class _Accumulator:
+    """
+    An `_Accumulator` computes an aggregate (see `asts.AGGREGATES`) of the
+    distinct values in a multiset. Values are distinct if they are distinct
+    constants, so every aggregate of `01` and `1` sees two values, and sum,
+    min, and max only then take the numbers they denote. `counts` counts the
+    occurrences of every value, so a value can be added and removed in
+    constant time. Sums are kept up to date as values come and go, and the
+    minimum or maximum is recomputed only if it is removed.
+    """
+    def __init__(self, function: str) -> None:
+        self.function = function
+        self.counts: Dict[Any, int] = {}
+        self.sum = 0
+        self.extreme: Optional[int] = None
+
+    def add(self, value: Any) -> None:
+        n = self.counts.get(value, 0)
+        self.counts[value] = n + 1
+        if n > 0 or self.function == 'count':
+            return
+        if self.function == 'sum':
+            self.sum += builtin.number(value)
+        elif self.extreme is not None:
+            choose = min if self.function == 'min' else max
+            self.extreme = choose(self.extreme, builtin.number(value))
+
+    def remove(self, value: Any) -> None:
+        n = self.counts[value]
+        if n > 1:
+            self.counts[value] = n - 1
+            return
+        del self.counts[value]
+        if self.function == 'sum':
+            self.sum -= builtin.number(value)
+        elif (self.function != 'count' and
+              builtin.number(value) == self.extreme):
+            self.extreme = None
+
+    def value(self) -> str:
+        if self.function == 'count':
+            return str(len(self.counts))
+        if self.function == 'sum':
+            return str(self.sum)
+        if self.extreme is None:
+            choose = min if self.function == 'min' else max
+            self.extreme = choose(builtin.number(v) for v in self.counts)
+        return str(self.extreme)
+
+class _Aggregation:
+    """
+    An `_Aggregation` computes the head tuples of an aggregate rule from the
+    tuples derived by its projection (see `_projection`). Projected tuples are
+    hashed into groups by the values of the head's non-aggregate terms, and
+    every group has an `_Accumulator` for every aggregate of the head. For
+    example, given `p(#L, K, count<X>, max<Y>) :- q(#L, K, X, Y).`, the
+    projected tuples (l, a, x1, 1), (l, a, x2, 3), and (l, b, x1, 2) form the
+    groups (l, a) and (l, b) and produce the head tuples (l, a, 2, 3) and (l,
+    b, 1, 2).
+
+    Projected tuples can be added and removed (see `update`) at a cost
+    proportional to the number of tuples changed, so the aggregates of a rule
+    can be maintained from one timestep to the next (see `_maintain`).
+    """
+    def __init__(self, head: asts.Atom) -> None:
+        self.arity = len(head.terms)
+        self.keys = [i for (i, t) in enumerate(head.terms)
+                       if not isinstance(t, asts.Aggregate)]
+        self.aggregates = [(i, t.function) for (i, t) in enumerate(head.terms)
+                           if isinstance(t, asts.Aggregate)]
+        self.projected: Set[Tuple[Any, ...]] = set()
+        self.groups: Dict[Tuple[Any, ...], List[_Accumulator]] = {}
+
+    def _head(self, key: Tuple[Any, ...]) -> Tuple[Any, ...]:
+        values: List[Any] = [None] * self.arity
+        for (i, value) in zip(self.keys, key):
+            values[i] = value
+        for ((i, _), accumulator) in zip(self.aggregates, self.groups[key]):
+            values[i] = accumulator.value()
+        return tuple(values)
+
+    def __contains__(self, tuple_: Any) -> bool:
+        key = tuple(tuple_[i] for i in self.keys)
+        return key in self.groups and self._head(key) == tuple_
+
+    def tuples(self) -> Set[Tuple[Any, ...]]:
+        """`aggregation.tuples()` returns the head tuple of every group."""
+        return {self._head(key) for key in self.groups}
+
+    def update(self,
+               added: Iterable[Tuple[Any, ...]],
+               deleted: Iterable[Tuple[Any, ...]]) \
+               -> Tuple[Set[Tuple[Any, ...]], Set[Tuple[Any, ...]]]:
+        """
+        `aggregation.update(added, deleted)` adds the projected tuples `added`
+        and removes the projected tuples `deleted`, and returns the head
+        tuples that are added and deleted as a result.
+        """
+        before: Dict[Tuple[Any, ...], Optional[Tuple[Any, ...]]] = {}
+        for tuple_ in deleted:
+            if tuple_ not in self.projected:
+                continue
+            key = tuple(tuple_[i] for i in self.keys)
+            if key not in before:
+                before[key] = self._head(key)
+            accumulators = self.groups[key]
+            for ((i, _), accumulator) in zip(self.aggregates, accumulators):
+                accumulator.remove(tuple_[i])
+            if len(accumulators[0].counts) == 0:
+                del self.groups[key]
+            self.projected.discard(tuple_)
+
+        for tuple_ in added:
+            if tuple_ in self.projected:
+                continue
+            key = tuple(tuple_[i] for i in self.keys)
+            if key not in before:
+                before[key] = self._head(key) if key in self.groups else None
+            if key not in self.groups:
+                self.groups[key] = [_Accumulator(f)
+                                    for (_, f) in self.aggregates]
+            for ((i, _), accumulator) in zip(self.aggregates,
+                                             self.groups[key]):
+                accumulator.add(tuple_[i])
+            self.projected.add(tuple_)
+
+        old = {h for h in before.values() if h is not None}
+        new = {self._head(key) for key in before if key in self.groups}
+        return (new - old, old - new)
+
+def _projection(rule: asts.Rule) -> asts.Rule:
+    """
+    `_projection(rule)` returns `rule` with every aggregate `f<X>` in its head
+    replaced by the variable X. For example, the projection of `p(#L, K,
+    count<X>) :- q(#L, K, X, Y).` is `p(#L, K, X) :- q(#L, K, X, Y).`.
+    """
+    terms = tuple(asts.Variable(t.x, False) if isinstance(t, asts.Aggregate)
+                  else t
+                  for t in rule.head.terms)
+    return asts.intern(rule._replace(head=rule.head._replace(terms=terms)))
+
+def _aggregate(head: asts.Atom, projected: Iterable[Tuple[Any, ...]]) \
+        -> Set[Tuple[Any, ...]]:
+    """
+    `_aggregate(head, projected)` returns the tuples of the aggregate atom
+    `head` computed from the projected tuples `projected` (see
+    `_Aggregation`).
+    """
+    aggregation = _Aggregation(head)
+    aggregation.update(projected, ())
+    return aggregation.tuples()
 
 def _stratify(pdg: nx.DiGraph) -> List[nx.DiGraph]:
     """
@@ -203,22 +899,84 @@ def _stratify(pdg: nx.DiGraph) -> List[nx.DiGraph]:
 
     stratification: List[nx.DiGraph] = []
     for nodes in nx.topological_sort(collapsed_pdg):
-        g = pdg.copy()
-        g.remove_nodes_from(set(pdg.nodes) - nodes)
+        g = nx.DiGraph()
+        g.add_nodes_from((n, pdg.nodes[n]) for n in nodes)
+        g.add_edges_from((src, dst, data)
+                         for src in nodes
+                         for (dst, data) in pdg[src].items()
+                         if dst in nodes)
         stratification.append(g)
     return stratification
 
-def spawn(program: asts.Program, randint: RandInt = None) -> Process:
-    """Spawn a program into a process."""
-    database = _empty_database(program)
-    async_buffer: AsyncBuffer = defaultdict(_empty_default_database)
-    randint = randint or (lambda: random.randint(1, 10))
-    return Process(program, 0, database, async_buffer, randint)
+Strata = List[FrozenSet[asts.Predicate]]
 
-def step(process: Process) -> Process:
-    """Perform a single step of a Dedalus program."""
-    process = deepcopy(process)
+def _strata(program: asts.Program) -> Strata:
+    """
+    `_strata(program)` returns the predicates of every stratum of the
+    deductive PDG of `program` (see `_stratify`), in order.
+    """
+    return [frozenset(g.nodes) for g in _stratify(program.deductive_pdg())]
+
+def _strata_rules(rules: List[asts.Rule], strata: Strata) \
+        -> List[List[asts.Rule]]:
+    """
+    `_strata_rules(rules, strata)` returns, for every stratum of `strata`, the
+    rules of `rules` whose heads are in the stratum, in program order.
+    """
+    by_head: DefaultDict[asts.Predicate, List[Tuple[int, asts.Rule]]] = \
+        defaultdict(list)
+    for (i, rule) in enumerate(rules):
+        by_head[rule.head.predicate].append((i, rule))
+    return [[r for (_, r) in sorted(ir for p in stratum for ir in by_head[p])]
+            for stratum in strata]
 
+def spawn(program: asts.Program,
+          randint: RandInt = None,
+          compact: bool = False,
+          memory_budget: int = None,
+          spill_directory: str = None,
+          incremental: bool = False,
+          compiled: bool = False,
+          storage: Storage = None,
+          skip_unchanged: bool = False) \
+          -> Process:
+    """
+    Spawn a program into a process. `storage` chooses the backend of every
+    relation of the process (see `relation.Storage`); by default, relations are
+    sets or, if `compact` is true, `CompactRelation`s. If `memory_budget` is
+    provided, the async buffer spills buckets of future timesteps to
+    `spill_directory` (or a temporary directory) once it uses more than
+    `memory_budget` bytes (see `SpillingAsyncBuffer`). If `incremental` is
+    true, the deductive relations of the process are maintained incrementally
+    from one timestep to the next (see `_maintain`). If `compiled` is true, the
+    rules of the program are compiled to Python functions rather than
+    interpreted (see `codegen.py`). If `skip_unchanged` is true, the deductive
+    strata and the inductive and async rules whose inputs didn't change since
+    the previous timestep aren't evaluated again (see `_Versions`).
+    """
+    storage = storage or Storage('compact' if compact else 'set')
+    database = _empty_database(program, storage)
+    factory = storage.database
+    async_buffer: AsyncBuffer
+    if memory_budget is None:
+        async_buffer = defaultdict(factory)
+    else:
+        async_buffer = SpillingAsyncBuffer(factory, memory_budget,
+                                           spill_directory)
+    randint = randint or (lambda: random.randint(1, 10))
+    inputs: Optional[Database] = {} if incremental else None
+    aggregates: Optional[Dict[int, _Aggregation]] = \
+        {} if incremental else None
+    versions = _Versions() if skip_unchanged else None
+    return Process(program, 0, database, async_buffer, randint, inputs,
+                   compiled, aggregates, versions, storage)
+
+def _eval_inputs(process: Process) -> None:
+    """
+    `_eval_inputs(process)` resets the database of `process` to the tuples in
+    the async buffer for the current timestep and then adds the tuples produced
+    by the constant time rules for the current timestep.
+    """
     def is_constant_rule(rule):
         rule_type = rule.rule_type
         if isinstance(rule.rule_type, asts.ConstantTimeRule):
@@ -227,9 +985,6 @@ def step(process: Process) -> Process:
             return False
 
     constant_rules = [r for r in process.program.rules if is_constant_rule(r)]
-    deductive_rules = [r for r in process.program.rules if r.is_deductive()]
-    inductive_rules = [r for r in process.program.rules if r.is_inductive()]
-    async_rules = [r for r in process.program.rules if r.is_async()]
 
     db = process.database
 
@@ -242,39 +997,654 @@ def step(process: Process) -> Process:
         for tuple_ in _eval_rule(process, rule):
             db[rule.head.predicate].add(tuple_)
 
-    # Deductive rules.
-    for strata in _stratify(process.program.deductive_pdg()):
-        strata_rules = [r for r in deductive_rules
-                          if r.head.predicate in strata.nodes]
+class _Plan:
+    """
+    A `_Plan` holds everything about stepping a process that depends only on
+    its program: the inductive and async rules, the deductive strata and
+    their rules, the shared prefixes of the rules (see `_Prefixes`), and the
+    projections of the aggregate rules (see `_projection`). If `compiled` is
+    true, every rule except the constant time and aggregate rules is also
+    compiled to a Python function (see `codegen.py`) that `eval_rule` calls
+    instead of interpreting the rule.
+    """
+    def __init__(self, program: asts.Program, compiled: bool = False) -> None:
+        self.inductive_rules = [r for r in program.rules if r.is_inductive()]
+        self.async_rules = [r for r in program.rules if r.is_async()]
+        self.strata = _strata(program)
+        self.strata_rules = _strata_rules(
+            [r for r in program.rules if r.is_deductive()], self.strata)
+        self.positions = {id(r): i for (i, r) in enumerate(program.rules)}
+        self.projections = {id(r): _projection(r)
+                            for r in program.rules if r.is_aggregate()}
+        self.prefixes = _Prefixes([self.projections.get(id(r), r)
+                                   for r in program.rules])
+        self.compiled: Dict[int, codegen.CompiledRule] = {}
+        if compiled:
+            rules = [r for r in program.rules
+                       if not isinstance(r.rule_type, asts.ConstantTimeRule)
+                       and not r.is_aggregate()]
+            orders = [_join_order(_positive_atoms(r), set(), r.builtins)
+                      for r in rules]
+            functions = codegen.compile_rules(list(zip(rules, orders)))
+            self.compiled = {id(r): f for (r, f) in zip(rules, functions)}
+
+    def eval_rule(self,
+                  process: Process,
+                  rule: asts.Rule,
+                  indexes: _Indexes) \
+                  -> Iterable[Tuple[Any, ...]]:
+        """
+        `plan.eval_rule(process, rule, indexes)` returns the tuples produced
+        by evaluating `rule`, like `_eval_rule`. The tuples of an aggregate
+        rule are aggregated from the tuples of its projection.
+        """
+        if id(rule) in self.compiled:
+            return self.compiled[id(rule)](process.database, indexes.table)
+        if id(rule) in self.projections:
+            projection = self.projections[id(rule)]
+            return _aggregate(rule.head, _eval_rule(process, projection,
+                                                    self.prefixes, indexes))
+        return _eval_rule(process, rule, self.prefixes, indexes)
+
+def _eval_deductive(process: Process,
+                    program: asts.Program,
+                    indexes: _Indexes = None,
+                    plan: _Plan = None) \
+                    -> None:
+    """
+    `_eval_deductive(process, program)` evaluates the deductive rules of
+    `program`, stratum by stratum, against the database of `process` until a
+    fixpoint is reached. `plan`, if provided, is the plan of `program`.
+    """
+    plan = plan or _Plan(program)
+    indexes = indexes or _Indexes(process.database)
+    for strata_rules in plan.strata_rules:
+        _eval_stratum(process, strata_rules, indexes, plan)
+
+def _eval_stratum(process: Process,
+                  rules: List[asts.Rule],
+                  indexes: _Indexes,
+                  plan: _Plan) \
+                  -> None:
+    # The body of an aggregate rule is in a lower stratum (see
+    # `asts.Program.pdg`), so it's evaluated once rather than until a fixpoint
+    # is reached.
+    for rule in rules:
+        if rule.is_aggregate():
+            tuples = set(plan.eval_rule(process, rule, indexes))
+            indexes.insert(rule.head.predicate, tuples)
+    rules = [r for r in rules if not r.is_aggregate()]
+
+    data_changed = True
+    while data_changed:
+        data_changed = False
+        for rule in rules:
+            tuples = set(plan.eval_rule(process, rule, indexes))
+            new = indexes.insert(rule.head.predicate, tuples)
+            if len(new) != 0:
+                data_changed = True
+
+class _Versions:
+    """
+    `_Versions` lets a process skip the work of a timestep that can't change
+    anything. The version of a relation is the last timestep at which it
+    changed. At every timestep,
+
+      1. the inputs of every predicate (see `_inputs`) are compared to its
+         inputs at the previous timestep;
+      2. a deductive stratum is evaluated only if the version of one of its
+         predicates, or of a predicate its rules read, is the current
+         timestep, and otherwise keeps its relations from the previous
+         timestep; the versions of the heads of an evaluated stratum are
+         updated by comparing their relations to the previous ones, so an
+         unchanged result doesn't make the strata above it dirty; and
+      3. an inductive or async rule is evaluated only if the version of a
+         predicate in its body is the current timestep, and otherwise
+         produces the tuples it produced at the previous timestep.
+
+    When only a few relations change (e.g. only a clock ticks), most of a
+    timestep is then spent comparing and copying relations rather than
+    evaluating rules. The versions of a process are only valid for the
+    process's program and the timestep after the last one it was stepped
+    through, so they're reset when the program changes (see `Engine.add`).
+    """
+    def __init__(self) -> None:
+        self.versions: Dict[asts.Predicate, int] = {}
+        # The inputs of the heads of the deductive rules at the previous
+        # timestep. The inputs of the other predicates are their relations.
+        self.inputs: Database = {}
+        # The tuples produced by every inductive and async rule, keyed by the
+        # index of the rule in the program, at the last timestep it was
+        # evaluated.
+        self.outputs: Dict[int, List[Tuple[Any, ...]]] = {}
+
+    def update(self, p: asts.Predicate, timestep: int, changed: bool) -> None:
+        """
+        `versions.update(p, timestep, changed)` records that the relation of
+        `p` changed at `timestep` if `changed` is true or if `p` has no
+        version yet.
+        """
+        if changed or p not in self.versions:
+            self.versions[p] = timestep
+
+    def changed(self, predicates: Iterable[asts.Predicate], timestep: int) \
+            -> bool:
+        """
+        `versions.changed(predicates, timestep)` returns whether any of the
+        relations of `predicates` changed at `timestep`.
+        """
+        return any(self.versions.get(p, timestep) == timestep
+                   for p in predicates)
+
+def _reads(rules: Iterable[asts.Rule]) -> Set[asts.Predicate]:
+    return {l.atom.predicate for r in rules for l in r.body}
+
+def _eval_changed(process: Process, indexes: _Indexes, plan: _Plan) -> None:
+    """
+    `_eval_changed(process, indexes, plan)` is `_eval_inputs(process)`
+    followed by `_eval_deductive(process, process.program, indexes, plan)`,
+    except that it skips the deductive strata whose inputs didn't change
+    since the previous timestep and updates the versions of the relations of
+    `process` (see `_Versions`).
+    """
+    versions = process.versions
+    assert versions is not None
+    t = process.timestep
+    db = process.database
+    previous = dict(db)
+    heads = {r.head.predicate for rules in plan.strata_rules for r in rules}
+
+    for (p, relation) in _inputs(process).items():
+        if p in heads:
+            old = versions.inputs.get(p)
+            versions.inputs[p] = set(relation)
+        else:
+            old = previous[p]
+        versions.update(p, t, old is None or relation != old)
+        db[p] = relation
+
+    for (predicates, rules) in zip(plan.strata, plan.strata_rules):
+        stratum = predicates & heads
+        if len(stratum) == 0:
+            continue
+        if not versions.changed(stratum | _reads(rules), t):
+            for p in stratum:
+                db[p] = previous[p]
+            continue
+        _eval_stratum(process, rules, indexes, plan)
+        for p in stratum:
+            versions.update(p, t, db[p] != previous[p])
+
+def _eval_unchanged_rule(process: Process,
+                         rule: asts.Rule,
+                         indexes: _Indexes,
+                         plan: _Plan) \
+                         -> Iterable[Tuple[Any, ...]]:
+    """
+    `_eval_unchanged_rule(process, rule, indexes, plan)` is
+    `plan.eval_rule(process, rule, indexes)`, except that if the relations in
+    the body of `rule` didn't change since the previous timestep, it returns
+    the tuples that `rule` produced then (see `_Versions`).
+    """
+    versions = process.versions
+    if versions is None:
+        return plan.eval_rule(process, rule, indexes)
+    i = plan.positions[id(rule)]
+    t = process.timestep
+    if i in versions.outputs and not versions.changed(_reads([rule]), t):
+        return versions.outputs[i]
+    tuples = list(plan.eval_rule(process, rule, indexes))
+    versions.outputs[i] = tuples
+    return tuples
+
+def _inputs(process: Process) -> Database:
+    """
+    `_inputs(process)` returns the tuples in the async buffer for the current
+    timestep together with the tuples produced by the constant time rules for
+    the current timestep, without modifying the database of `process`.
+    """
+    t = process.timestep
+    inputs: Database = {p: process.async_buffer[t][p]
+                        for p in process.database}
+    for rule in process.program.rules:
+        rule_type = rule.rule_type
+        if (isinstance(rule_type, asts.ConstantTimeRule) and
+            rule_type.time == t):
+            inputs[rule.head.predicate] |= set(_eval_rule(process, rule))
+    return inputs
+
+def _bindings(atom: asts.Atom, tuples: Iterable[Tuple[Any, ...]]) \
+        -> List[Bindings]:
+    bindings = [_unify([atom], [t]) for t in tuples]
+    return [b for b in bindings if b is not None]
+
+def _eval_delta(process: Process,
+                indexes: _Indexes,
+                rule: asts.Rule,
+                i: int,
+                delta: Iterable[Tuple[Any, ...]],
+                negation: bool = True) \
+                -> Generator[Tuple[Any, ...], None, None]:
+    """
+    `_eval_delta(process, indexes, rule, i, delta)` evaluates `rule` with its
+    i-th literal (positive or negative) replaced by the positive literal
+    `delta`. That is, it generates the tuples derived by the instantiations
+    of the rest of the rule that agree with a tuple in `delta`. For example,
+    given `p(X, Z) :- q(X, Y), r(Y, Z), !s(Z).` and i = 1, `_eval_delta`
+    generates the tuples of `p(X, Z) :- delta(Y, Z), q(X, Y), !s(Z)`. If
+    `negation` is false, the negative literals of the rule are ignored.
+    """
+    atom = rule.body[i].atom
+    body = tuple(l for (j, l) in enumerate(rule.body)
+                 if j != i and (negation or l.is_positive()))
+    initials = _bindings(atom, delta)
+    if len(initials) > 0:
+        yield from _eval_rule(process, rule._replace(body=body),
+                              indexes=indexes, initials=initials)
+
+_Delta = Dict[asts.Predicate, AbstractSet[Tuple[Any, ...]]]
+
+def _maintain_aggregate(process: Process,
+                        indexes: _Indexes,
+                        projection: asts.Rule,
+                        aggregation: _Aggregation,
+                        added: _Delta,
+                        deleted: _Delta) \
+                        -> Tuple[Set[Tuple[Any, ...]], Set[Tuple[Any, ...]]]:
+    """
+    `_maintain_aggregate(process, indexes, projection, aggregation, added,
+    deleted)` updates `aggregation` (see `_Aggregation`) with the changes to
+    the tuples of `projection`, the projection of an aggregate rule, given the
+    tuples `added` to and `deleted` from the predicates of its body, and
+    returns the head tuples added and deleted. The body of an aggregate rule
+    is in lower strata than its head, so its changes are all known.
+
+    A projected tuple that is no longer derived lost a derivation that used a
+    deleted tuple of a positive literal or an added tuple of a negative
+    literal. These candidates are found with the deleted tuples temporarily
+    restored, and the ones that can't be rederived are deleted. A projected
+    tuple that is newly derived has a derivation that uses an added tuple of
+    a positive literal or a deleted tuple of a negative literal.
+    """
+    body = {l.atom.predicate for l in projection.body}
+    for p in body:
+        indexes.insert(p, deleted.get(p, set()))
+    candidates: Set[Tuple[Any, ...]] = set()
+    for (i, literal) in enumerate(projection.body):
+        source = added if literal.is_negative() else deleted
+        delta = source.get(literal.atom.predicate, set())
+        candidates |= set(_eval_delta(process, indexes, projection, i, delta,
+                                      negation=False))
+    for p in body:
+        indexes.delete(p, deleted.get(p, set()))
+
+    removed = candidates & aggregation.projected
+    initials = _bindings(projection.head, removed)
+    if len(initials) > 0:
+        removed -= set(_eval_rule(process, projection, indexes=indexes,
+                                  initials=initials))
+
+    inserted: Set[Tuple[Any, ...]] = set()
+    for (i, literal) in enumerate(projection.body):
+        source = deleted if literal.is_negative() else added
+        inserted |= set(_eval_delta(process, indexes, projection, i,
+                                    source.get(literal.atom.predicate, set())))
+    return aggregation.update(inserted - aggregation.projected, removed)
+
+def _maintain(process: Process,
+              inputs: Database,
+              indexes: _Indexes,
+              plan: _Plan = None,
+              aggregates: Dict[int, _Aggregation] = None) \
+              -> Set[asts.Predicate]:
+    """
+    `_maintain(process, inputs, indexes)` updates the database of `process`
+    from the inputs and deductive relations of the previous timestep to the
+    inputs `inputs` and the deductive relations they imply, and returns the
+    predicates whose relations changed. Rather than
+    recomputing every deductive relation from scratch, `_maintain` computes
+    the tuples added to and deleted from the inputs and propagates only these
+    changes through the deductive rules, stratum by stratum, using the DRed
+    (delete and rederive) algorithm. Let Δ+(p) and Δ-(p) be the tuples added
+    to and deleted from p. For every stratum,
+
+      1. Overdelete. Every tuple of the stratum that has a derivation using a
+         tuple of Δ-(q) for a positive literal q(...), or a tuple of Δ+(r)
+         for a negative literal !r(...), is deleted, and so is every tuple that
+         has a derivation using one of these deleted tuples, and so on. Some
+         of these tuples may have alternative derivations. For example, with
+         the rules `path(X, Y) :- link(X, Y).` and `path(X, Z) :- path(X, Y),
+         link(Y, Z).`, deleting link(a, b) overdeletes every path through
+         link(a, b), even if there is another path from a to b.
+      2. Rederive. Every overdeleted tuple that still has a derivation in
+         the remaining database is rederived.
+      3. Insert. The rederived tuples, the tuples derived using a tuple of
+         Δ+(q) for a positive literal q(...) or Δ-(r) for a negative literal
+         !r(...), and every tuple derived from them, and so on, are inserted
+         semi-naively.
+
+    Overdeletion ignores negative literals, so it may delete (and then
+    rederive) more tuples than necessary, but it never misses a tuple whose
+    derivations have all been invalidated. Negated predicates are always in a
+    lower stratum, so their changes are known by the time a stratum is
+    maintained.
+
+    The bodies of aggregate rules are in lower strata too, so the changes to
+    their heads are computed first, from the changes to their bodies and the
+    aggregations in `aggregates` (see `_maintain_aggregate`), and are then
+    treated like changes to the inputs.
+    """
+    db = process.database
+    assert process.inputs is not None
+    old_inputs = process.inputs
+    deductive_rules = [r for r in process.program.rules if r.is_deductive()]
+    heads = {r.head.predicate for r in deductive_rules}
+    plan = plan or _Plan(process.program)
+    aggregates = {} if aggregates is None else aggregates
+    positions = {id(r): i for (i, r) in enumerate(process.program.rules)}
+
+    def added_inputs(p: asts.Predicate) -> AbstractSet[Tuple[Any, ...]]:
+        return inputs[p] - old_inputs.get(p, set())
+
+    def deleted_inputs(p: asts.Predicate) -> AbstractSet[Tuple[Any, ...]]:
+        return old_inputs.get(p, set()) - inputs[p]
+
+    # The tuples added to and deleted from every maintained predicate.
+    added: _Delta = {}
+    deleted: _Delta = {}
+    for p in db:
+        if p not in heads:
+            added[p] = added_inputs(p)
+            deleted[p] = deleted_inputs(p)
+            indexes.delete(p, deleted[p])
+            indexes.insert(p, added[p])
+
+    for (predicates, rules) in zip(plan.strata, plan.strata_rules):
+        stratum = {p for p in predicates if p in heads}
+        if len(stratum) == 0:
+            continue
+
+        # Aggregate rules.
+        added_heads: Dict[asts.Predicate, Set[Tuple[Any, ...]]] = \
+            {p: set() for p in stratum}
+        deleted_heads: Dict[asts.Predicate, Set[Tuple[Any, ...]]] = \
+            {p: set() for p in stratum}
+        aggregations: List[Tuple[asts.Predicate, _Aggregation]] = []
+        for rule in rules:
+            if not rule.is_aggregate():
+                continue
+            h = rule.head.predicate
+            i = positions[id(rule)]
+            if i not in aggregates:
+                aggregates[i] = _Aggregation(rule.head)
+            (plus, minus) = _maintain_aggregate(
+                process, indexes, plan.projections[id(rule)], aggregates[i],
+                added, deleted)
+            added_heads[h] |= plus
+            deleted_heads[h] |= minus
+            aggregations.append((h, aggregates[i]))
+        rules = [r for r in rules if not r.is_aggregate()]
+
+        # Overdelete, with the tuples deleted from lower strata temporarily
+        # restored.
+        for (p, tuples) in deleted.items():
+            indexes.insert(p, tuples)
+        over = {p: set((deleted_inputs(p) | deleted_heads[p]) & db[p])
+                for p in stratum}
+        delta: _Delta = {p: set(tuples) for (p, tuples) in over.items()}
+        lower = True
+        while lower or any(len(tuples) > 0 for tuples in delta.values()):
+            found: Dict[asts.Predicate, Set[Tuple[Any, ...]]] = \
+                {p: set() for p in stratum}
+            for rule in rules:
+                h = rule.head.predicate
+                for (i, literal) in enumerate(rule.body):
+                    q = literal.atom.predicate
+                    changed: AbstractSet[Tuple[Any, ...]]
+                    if literal.is_negative():
+                        changed = added.get(q, set()) if lower else set()
+                    elif q in stratum:
+                        changed = delta[q]
+                    else:
+                        changed = deleted.get(q, set()) if lower else set()
+                    for t in _eval_delta(process, indexes, rule, i, changed,
+                                         negation=False):
+                        if t in db[h] and t not in over[h]:
+                            found[h].add(t)
+            for p in stratum:
+                over[p] |= found[p]
+            delta = {p: found[p] for p in stratum}
+            lower = False
+        for (p, tuples) in deleted.items():
+            indexes.delete(p, tuples)
+        for p in stratum:
+            indexes.delete(p, over[p])
+
+        # Rederive.
+        inserted = {p: set(inputs[p] - db[p]) | added_heads[p]
+                    for p in stratum}
+        for (h, aggregation) in aggregations:
+            inserted[h] |= {t for t in over[h] if t in aggregation}
+        for rule in rules:
+            h = rule.head.predicate
+            initials = _bindings(rule.head, over[h])
+            if len(initials) > 0:
+                inserted[h] |= set(_eval_rule(process, rule, indexes=indexes,
+                                              initials=initials))
+
+        # Insert. Rules without positive literals (e.g. `p(a) :- .`) don't
+        # depend on any changes, so they're evaluated in full.
+        for rule in rules:
+            h = rule.head.predicate
+            if len(_positive_atoms(rule)) == 0:
+                inserted[h] |= set(_eval_rule(process, rule, indexes=indexes))
+            for (i, literal) in enumerate(rule.body):
+                q = literal.atom.predicate
+                if q in stratum:
+                    continue
+                source = deleted if literal.is_negative() else added
+                inserted[h] |= set(_eval_delta(process, indexes, rule, i,
+                                               source.get(q, set())))
+        delta = {p: indexes.insert(p, tuples)
+                 for (p, tuples) in inserted.items()}
+        all_inserted = {p: set(tuples) for (p, tuples) in delta.items()}
+        while any(len(tuples) > 0 for tuples in delta.values()):
+            found = {p: set() for p in stratum}
+            for rule in rules:
+                h = rule.head.predicate
+                for (i, literal) in enumerate(rule.body):
+                    q = literal.atom.predicate
+                    if literal.is_positive() and q in stratum:
+                        found[h] |= set(_eval_delta(process, indexes, rule, i,
+                                                    delta[q]))
+            delta = {p: indexes.insert(p, tuples)
+                     for (p, tuples) in found.items()}
+            for p in stratum:
+                all_inserted[p] |= delta[p]
 
-        data_changed = True
-        while data_changed:
-            data_changed = False
-            for rule in strata_rules:
-                tuples = set(_eval_rule(process, rule))
-                if len(tuples - db[rule.head.predicate]) != 0:
-                    data_changed = True
-                db[rule.head.predicate] |= tuples
+        for p in stratum:
+            added[p] = all_inserted[p] - over[p]
+            deleted[p] = over[p] - all_inserted[p]
+
+    return {p for p in added if len(added[p]) > 0 or len(deleted[p]) > 0}
+
+Send = Callable[[asts.Predicate, Tuple[Any, ...]], None]
+
+def _step(process: Process, plan: _Plan, send: Send = None) -> Process:
+    """
+    `_step(process, plan, send)` is `step(process, send)`, except that it
+    modifies the database and async buffer of `process` in place.
+    """
+    plan.prefixes.clear()
+    indexes = _Indexes(process.database)
+    versions = process.versions
+    if process.inputs is None and versions is not None:
+        # Async buffer, constant rules, and the deductive strata whose inputs
+        # changed.
+        _eval_changed(process, indexes, plan)
+    elif process.inputs is None:
+        # Async buffer and constant rules.
+        _eval_inputs(process)
+
+        # Deductive rules.
+        _eval_deductive(process, process.program, indexes, plan)
+    else:
+        inputs = _inputs(process)
+        aggregates = process.aggregates
+        if aggregates is None:
+            aggregates = {}
+        changed = _maintain(process, inputs, indexes, plan, aggregates)
+        process = process._replace(inputs=inputs, aggregates=aggregates)
+        if versions is not None:
+            for p in process.database:
+                versions.update(p, process.timestep, p in changed)
 
     # Inductive rules.
     next_timestep = process.timestep + 1
-    for rule in inductive_rules:
+    for rule in plan.inductive_rules:
         p = rule.head.predicate
-        tuples = set(_eval_rule(process, rule))
+        tuples = set(_eval_unchanged_rule(process, rule, indexes, plan))
         process.async_buffer[next_timestep][p] |= tuples
 
     # Async rules.
-    for rule in async_rules:
-        for tuple_ in _eval_rule(process, rule):
+    for rule in plan.async_rules:
+        for tuple_ in _eval_unchanged_rule(process, rule, indexes, plan):
             p = rule.head.predicate
+            if send is not None:
+                send(p, tuple_)
+                continue
             async_timestep = process.timestep + process.randint()
             process.async_buffer[async_timestep][p].add(tuple_)
 
     timestep = process.timestep
     process = process._replace(timestep=next_timestep)
-    del process.async_buffer[timestep]
+    # A program without predicates never creates the bucket of its timestep.
+    # Buckets are deleted rather than popped, since deleting a bucket also
+    # advances a `SpillingAsyncBuffer`.
+    if timestep in process.async_buffer:
+        del process.async_buffer[timestep]
     return process
 
+def step(process: Process, send: Send = None) -> Process:
+    """
+    Perform a single step of a Dedalus program. If `send` is provided, the
+    tuples produced by async rules are passed to `send` rather than buffered
+    in the async buffer of the process (see `actors.py`).
+    """
+    # Programs are never modified, so there's no need to copy them.
+    memo: Dict[int, Any] = {id(process.program): process.program}
+    process = deepcopy(process, memo)
+    return _step(process, _plan(process.program, process.compiled), send)
+
+# The last program stepped by `step` in every thread, and its plan.
+_last_plan = threading.local()
+
+def _plan(program: asts.Program, compiled: bool) -> _Plan:
+    # Programs are immutable and usually stepped over and over (e.g. by `run`
+    # or `check.check`), so the plan of the last program is reused.
+    if (getattr(_last_plan, 'program', None) is not program or
+        _last_plan.compiled != compiled):
+        _last_plan.program = program
+        _last_plan.compiled = compiled
+        _last_plan.plan = _Plan(program, compiled)
+    return _last_plan.plan
+
+class Engine:
+    """
+    An `Engine` steps a process in place. `step` copies the process it is
+    given every timestep, which is what you want for a pure function but is
+    wasteful when the same process is stepped over and over, as in the REPL.
+    An engine modifies the database and async buffer of its process directly.
+
+    The program of an engine's process may grow (see `add`), in which case
+    it is planned again before the next step.
+    """
+    def __init__(self, process: Process) -> None:
+        self.process = process
+        self.plan: Optional[_Plan] = None
+        # Indexes on the database, for `match`, valid until the next step.
+        self.indexes: Optional[_Indexes] = None
+
+    def add(self, rules: Sequence[asts.Rule]) -> None:
+        """
+        `engine.add(rules)` appends `rules` to the program of the engine's
+        process. The rules take effect at the next step.
+        """
+        program = self.process.program
+        program = program._replace(rules=program.rules + tuple(rules))
+        process = self.process._replace(program=program)
+        if process.versions is not None:
+            process = process._replace(versions=_Versions())
+        if process.inputs is not None:
+            # The new rules may derive tuples from tuples that won't change,
+            # so the deductive relations are derived from scratch.
+            database = _empty_database(program, process.storage)
+            process = process._replace(database=database, inputs={},
+                                       aggregates={})
+        else:
+            for p in asts.Program(tuple(rules)).predicates():
+                if p not in process.database:
+                    storage = process.storage or Storage()
+                    process.database[p] = storage.relation(p)
+        self.process = process
+        self.plan = None
+        self.indexes = None
+
+    def step(self, send: Send = None) -> Process:
+        if self.plan is None:
+            self.plan = _Plan(self.process.program, self.process.compiled)
+        self.indexes = None
+        self.process = _step(self.process, self.plan, send)
+        return self.process
+
+    def match(self, atom: asts.Atom) -> Generator[Tuple[Any, ...], None, None]:
+        """
+        `engine.match(atom)` generates the tuples of the database of the
+        engine's process that unify with `atom`, without sorting them. If
+        `atom` has constants (e.g. `path(#a, b, Y)`), the tuples are looked up
+        in an index on the constant columns, which is kept until the next
+        step, so the cost of a match is proportional to the number of tuples
+        that match.
+        """
+        db = self.process.database
+        if atom.predicate not in db:
+            return
+        if self.indexes is None:
+            self.indexes = _Indexes(db)
+        access = _access(atom, set())
+        subst = _substituter(atom)
+        for bindings in _extend(self.indexes, access, {}):
+            yield subst(bindings)
+
+    def count(self, atom: asts.Atom) -> int:
+        """
+        `engine.count(atom)` returns the number of tuples that `engine.match`
+        generates.
+        """
+        relation = self.process.database.get(atom.predicate, set())
+        if _is_scan(atom):
+            return len(relation)
+        return sum(1 for _ in self.match(atom))
+
+    def run(self, timesteps: int) -> Process:
+        for _ in range(timesteps):
+            self.step()
+        return self.process
+
+def memory_usage(process: Process) -> Dict[asts.Predicate, Tuple[int, int]]:
+    """
+    `memory_usage(process)` returns the number of tuples and the number of
+    bytes used by every predicate in the database and the in-memory part of
+    the async buffer of `process`. See `relation.nbytes`.
+    """
+    usage: DefaultDict[asts.Predicate, Tuple[int, int]] = \
+        defaultdict(lambda: (0, 0))
+    for db in [process.database] + list(process.async_buffer.values()):
+        for (p, r) in db.items():
+            (size, bytes_) = usage[p]
+            usage[p] = (size + len(r), bytes_ + nbytes(r))
+    return dict(usage)
+
 def run(process: Process, timesteps: int) -> Process:
     """Perform multiple steps of a Dedalus program."""
     for _ in range(timesteps):
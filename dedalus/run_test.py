@@ -1,9 +1,12 @@
 import unittest
-from typing import Any, Dict, List, Optional, Tuple
+from typing import AbstractSet, Any, Dict, List, Optional, Tuple
 
 from desugar import desugar
-from run import (Bindings, _eval_rule, _stratify, _subst, _unify, run, spawn,
-                 step)
+from magic import desugar_query
+from run import (Bindings, Database, Engine, _Indexes, _Plan, _Prefixes,
+                 _access, _canonicalize, _eval_rule, _join_order, _stratify,
+                 _subst, _unify, run, spawn, step)
+from relation import CompactRelation, Storage
 from typecheck import typecheck
 import parser
 import asts
@@ -168,6 +171,116 @@ class TestRun(unittest.TestCase):
         actual = set(_eval_rule(process, program.rules[0]))
         self.assertEqual(actual, expected)
 
+    def test_eval_rule_negation(self) -> None:
+        source = r"""
+            p(X, Y) :- q(X, Y), !r(X, Y).
+            p(X, Y) :- q(X, Y), !r(X, Y), !s(X, Y).
+            p(Y, X) :- q(X, Y), !r(X, Y).
+            p(X, Y) :- q(X, Y), !r(a, Y).
+            p(X, Y) :- q(X, Y), !t().
+            p(X, Y) :- q(X, Z), !r(X, Z), q(Z, Y), !s(Z, Y).
+        """
+        program = typecheck(desugar(parser.parse(source)))
+
+        q = self.predicate('q')
+        r = self.predicate('r')
+        s = self.predicate('s')
+        t = self.predicate('t')
+        l, a, b, c = 'labc'
+
+        process = spawn(program)
+        process.database[q] = {(l, a, b), (l, b, c), (l, c, a), (l, a, a)}
+        process.database[r] = {(l, a, b), (l, a, a)}
+        process.database[s] = {(l, b, c)}
+        process.database[t] = set()
+
+        expected = [
+            {(l, b, c), (l, c, a)},
+            {(l, c, a)},
+            {(l, c, b), (l, a, c)},
+            {(l, b, c)},
+            {(l, a, b), (l, b, c), (l, c, a), (l, a, a)},
+            {(l, b, a), (l, c, b), (l, c, a)},
+        ]
+        for (rule, tuples) in zip(program.rules, expected):
+            self.assertEqual(set(_eval_rule(process, rule)), tuples, str(rule))
+
+        process.database[t] = {(l,)}
+        self.assertEqual(set(_eval_rule(process, program.rules[4])), set())
+
+    def test_indexes(self) -> None:
+        p = self.predicate('p')
+        db: Database = {p: {('a', 'b'), ('a', 'c'), ('b', 'c')}}
+        indexes = _Indexes(db)
+        self.assertEqual(set(indexes.lookup(p, (0,), ('a',))),
+                         {('a', 'b'), ('a', 'c')})
+        self.assertEqual(set(indexes.lookup(p, (1,), ('c',))),
+                         {('a', 'c'), ('b', 'c')})
+        self.assertEqual(set(indexes.lookup(p, (0, 1), ('b', 'c'))),
+                         {('b', 'c')})
+        self.assertEqual(indexes.lookup(p, (0,), ('z',)), [])
+
+        # Inserted tuples are added to the existing indexes.
+        new = indexes.insert(p, {('a', 'b'), ('a', 'd')})
+        self.assertEqual(new, {('a', 'd')})
+        self.assertEqual(len(db[p]), 4)
+        self.assertEqual(set(indexes.lookup(p, (0,), ('a',))),
+                         {('a', 'b'), ('a', 'c'), ('a', 'd')})
+
+        # Indexes are rebuilt if the relation is modified directly.
+        db[p].add(('c', 'a'))
+        self.assertEqual(set(indexes.lookup(p, (0,), ('c',))), {('c', 'a')})
+        db[p] = {('d', 'd')}
+        self.assertEqual(set(indexes.lookup(p, (0,), ('d',))), {('d', 'd')})
+
+    def test_access(self) -> None:
+        access = _access(self.atom('p(X, a, Y, Y, Z)'), {'X', 'Z'})
+        self.assertEqual(access.columns, (0, 1, 4))
+        self.assertEqual(access.key({'X': 'x', 'Z': 'z'}), ('x', 'a', 'z'))
+        self.assertEqual(access.assign, [(2, 'Y')])
+        self.assertEqual(access.checks, [(2, 3)])
+
+    def test_join_order(self) -> None:
+        atoms = [self.atom('p(X, Y)'), self.atom('q(Y, Z)'),
+                 self.atom('r(a, W)'), self.atom('s(W, X)')]
+        self.assertEqual(_join_order(atoms, set()),
+                         [atoms[2], atoms[3], atoms[0], atoms[1]])
+        self.assertEqual(_join_order(atoms, {'Z'}),
+                         [atoms[1], atoms[0], atoms[2], atoms[3]])
+
+    def test_canonicalize(self) -> None:
+        atoms = [self.atom('p(X, Y)'), self.atom('q(Y, a, Z, X)')]
+        expected = [self.atom('p(V0, V1)'), self.atom('q(V1, a, V2, V0)')]
+        self.assertEqual(_canonicalize(atoms), expected)
+
+    def test_prefixes(self) -> None:
+        source = r"""
+            b(#l, 0) :- .
+            b(#l, 1) :- .
+            c(#l, 1) :- .
+            d(#l, 0) :- .
+            d(#l, 1) :- .
+            r1(X) :- d(X), c(1), b(1).
+            r2(Y) :- b(1), c(1), d(Y).
+            r3(Y)@next :- b(1), c(1), b(Y).
+            r4(Y) :- d(Y), b(0).
+            r5(X, Y)@async :- d(X), d(Y), !b(X).
+        """
+        program = typecheck(desugar(parser.parse(source)))
+        process = run(spawn(program), 1)
+        prefixes = _Prefixes(program.rules)
+        for rule in program.rules:
+            expected = set(_eval_rule(process, rule))
+            actual = set(_eval_rule(process, rule, prefixes))
+            self.assertEqual(actual, expected, str(rule))
+
+        # d is the most frequent atom, so the bodies of r1 and r2 are both
+        # sorted into `d(_L, Y), b(_L, 1), c(_L, 1)` and share all three atoms.
+        key = 'd(V0, V1), b(V0, 1), c(V0, 1)'
+        self.assertIn(key, prefixes.cache)
+        (_, values) = prefixes.cache[key]
+        self.assertEqual(set(values), {('l', '0'), ('l', '1')})
+
     def test_stratify(self) -> None:
         source = """
           b(X) :- a(X).
@@ -210,5 +323,304 @@ class TestRun(unittest.TestCase):
         # TODO(mwhittaker): Test step.
         pass
 
+    # Every timestep, one link is added and one link is deleted, which adds
+    # and deletes paths, which in turn adds and deletes cycles.
+    links = """
+            link(#n, a, b) :- .
+            link(#n, b, c) :- .
+            link(#n, c, d) :- .
+            link(#n, d, a)@2 :- .
+            link(#n, e, a)@3 :- .
+            unlink(#n, b, c)@3 :- .
+            link(#n, b, c)@5 :- .
+            unlink(#n, d, a)@6 :- .
+            link(X, Y)@next :- link(X, Y), !unlink(X, Y).
+            path(X, Y) :- link(X, Y).
+            path(X, Z) :- path(X, Y), link(Y, Z).
+            node(X) :- link(X, Y).
+            node(Y) :- link(X, Y).
+            cycle(X) :- path(X, X).
+            acyclic(X) :- node(X), !cycle(X).
+            origin(#n) :- .
+    """
+
+    def test_incremental(self) -> None:
+        program = typecheck(desugar(parser.parse(self.links)))
+        full = spawn(program)
+        incremental = spawn(program, incremental=True)
+        for _ in range(8):
+            full = step(full)
+            incremental = step(incremental)
+            self.assertEqual(incremental.database, full.database)
+
+    def test_skip_unchanged(self) -> None:
+        program = typecheck(desugar(parser.parse(self.links)))
+        full = spawn(program)
+        skipping = [spawn(program, skip_unchanged=True),
+                    spawn(program, incremental=True, skip_unchanged=True)]
+        for _ in range(9):
+            full = step(full)
+            skipping = [step(process) for process in skipping]
+            for process in skipping:
+                self.assertEqual(process.database, full.database)
+                self.assertEqual(process.async_buffer, full.async_buffer)
+
+        # The links last changed at timestep 7, the timestep after
+        # unlink(#n, d, a). The nodes last changed at timestep 3, when e was
+        # linked, and origin never changed.
+        for process in skipping:
+            assert process.versions is not None
+            versions = process.versions.versions
+            for p in ['link', 'unlink', 'path', 'cycle', 'acyclic']:
+                self.assertEqual(versions[self.predicate(p)], 7, p)
+            self.assertEqual(versions[self.predicate('node')], 3)
+            self.assertEqual(versions[self.predicate('origin')], 0)
+
+    def test_aggregates(self) -> None:
+        source = r"""
+            item(#s, a)@0 :- .
+            item(#s, b)@0 :- .
+            item(#s, c)@1 :- .
+            item(#s, d)@2 :- .
+            item(X)@next :- item(X), !sold(X).
+            sold(#s, b)@2 :- .
+            price(#s, a, 3) :- .
+            price(#s, b, 12) :- .
+            price(#s, c, 3) :- .
+            price(#s, d, 7) :- .
+            stock(count<X>) :- item(X).
+            prices(count<X>, sum<P>, min<P>, max<P>) :- item(X), price(X, P).
+            by_price(P, count<X>) :- item(X), price(X, P).
+            cheap(X) :- by_price(X, 2).
+            report(N, count<X>)@next :- stock(N), cheap(X).
+        """
+        program = typecheck(desugar(parser.parse(source)))
+        expected = [
+            {'stock': {('s', '2')},
+             'prices': {('s', '2', '15', '3', '12')},
+             'by_price': {('s', '3', '1'), ('s', '12', '1')},
+             'cheap': set()},
+            {'stock': {('s', '3')},
+             'prices': {('s', '3', '15', '3', '12')},
+             'by_price': {('s', '3', '2'), ('s', '12', '1')},
+             'cheap': {('s', '3')}},
+            {'stock': {('s', '4')},
+             'prices': {('s', '4', '22', '3', '12')},
+             'by_price': {('s', '3', '2'), ('s', '12', '1'), ('s', '7', '1')},
+             'cheap': {('s', '3')}},
+            {'stock': {('s', '3')},
+             'prices': {('s', '3', '10', '3', '7')},
+             'by_price': {('s', '3', '2'), ('s', '7', '1')},
+             'cheap': {('s', '3')}},
+        ]
+        full = spawn(program)
+        incremental = spawn(program, incremental=True)
+        for relations in expected:
+            full = step(full)
+            incremental = step(incremental)
+            self.assertEqual(incremental.database, full.database)
+            for (p, tuples) in relations.items():
+                self.assertEqual(full.database[self.predicate(p)], tuples)
+        self.assertEqual(full.async_buffer[4][self.predicate('report')],
+                         {('s', '3', '1')})
+
+        with self.assertRaises(ValueError):
+            program = typecheck(desugar(parser.parse("""
+                p(a) :- .
+                q(sum<X>) :- p(X).
+            """)))
+            step(spawn(program))
+
+    def test_aggregates_distinct_constants(self) -> None:
+        # Every aggregate counts 01 and 1 as two values.
+        source = r"""
+            v(#s, 01)@0 :- .
+            v(#s, 1)@0 :- .
+            v(#s, 1)@1 :- .
+            v(#s, 5)@0 :- .
+            v(#s, 5)@1 :- .
+            agg(count<X>, sum<X>, min<X>, max<X>) :- v(X).
+        """
+        program = typecheck(desugar(parser.parse(source)))
+        agg = self.predicate('agg')
+        full = spawn(program)
+        incremental = spawn(program, incremental=True)
+        for expected in [{('s', '3', '7', '1', '5')},
+                         {('s', '2', '6', '1', '5')}]:
+            full = step(full)
+            incremental = step(incremental)
+            self.assertEqual(full.database[agg], expected)
+            self.assertEqual(incremental.database[agg], expected)
+
+    def test_builtins(self) -> None:
+        source = r"""
+            n(#s, 0)@0 :- .
+            n(N)@next :- n(M), N = M + 1, N < 4.
+            num(#s, 3) :- .
+            num(#s, 4) :- .
+            num(#s, 7) :- .
+            succ(X, Y) :- num(X), Y = X + 1, num(Y).
+            halves(X, H) :- num(X), H = X / 2, X % 2 = 0.
+            quotient(X, Q) :- n(X), Q = 7 / X.
+            pairs(X, Y) :- num(X), num(Y), X != Y, X * Y <= 21.
+            lonely(X) :- num(X), !num(Y), Y = X - 1.
+        """
+        program = typecheck(desugar(parser.parse(source)))
+        expected: List[Dict[str, AbstractSet[Tuple[str, ...]]]] = [
+            {'n': {('s', '0')},
+             'quotient': set()},
+            {'n': {('s', '1')},
+             'quotient': {('s', '1', '7')}},
+            {'n': {('s', '2')},
+             'quotient': {('s', '2', '3')}},
+            {'n': {('s', '3')},
+             'quotient': {('s', '3', '2')}},
+            {'n': set(),
+             'quotient': set()},
+        ]
+        processes = [spawn(program),
+                     spawn(program, incremental=True),
+                     spawn(program, compiled=True)]
+        for relations in expected:
+            processes = [step(process) for process in processes]
+            (full, *others) = processes
+            for process in others:
+                self.assertEqual(process.database, full.database)
+            for (p, tuples) in relations.items():
+                self.assertEqual(full.database[self.predicate(p)], tuples)
+            self.assertEqual(full.database[self.predicate('succ')],
+                             {('s', '3', '4')})
+            self.assertEqual(full.database[self.predicate('halves')],
+                             {('s', '4', '2')})
+            self.assertEqual(full.database[self.predicate('pairs')],
+                             {('s', '3', '4'), ('s', '4', '3'),
+                              ('s', '3', '7'), ('s', '7', '3')})
+            self.assertEqual(full.database[self.predicate('lonely')],
+                             {('s', '3'), ('s', '7')})
+
+        with self.assertRaises(ValueError):
+            program = typecheck(desugar(parser.parse("""
+                p(a) :- .
+                q(X) :- p(X), X < 3.
+            """)))
+            step(spawn(program))
+
+    def test_codegen(self) -> None:
+        source = r"""
+            p(X, Y) :- q(X, Y), !r(X, Y).
+            p(X, Y) :- q(X, Z), !r(X, Z), q(Z, Y), !s(Z, Y).
+            p(X, X) :- q(X, X), !t().
+            p(X, a) :- q(a, X), q(X, X).
+            u() :- q(a, a).
+            t() :- u().
+            r(X, Y)@next :- r(X, Y), !s(X, Y).
+            s(X, b)@async :- q(X, Y), r(Y, X).
+        """
+        program = typecheck(desugar(parser.parse(source)))
+        l, a, b, c = 'labc'
+        process = spawn(program)
+        db = process.database
+        db[self.predicate('q')] = {(l, a, b), (l, b, c), (l, c, a), (l, a, a),
+                                   (l, c, c)}
+        db[self.predicate('r')] = {(l, a, b), (l, a, a), (l, b, a)}
+        db[self.predicate('s')] = {(l, b, c)}
+
+        # Every compiled rule agrees with the interpreter.
+        compiled = _Plan(program, compiled=True)
+        self.assertEqual(len(compiled.compiled), len(program.rules))
+        indexes = _Indexes(db)
+        for rule in program.rules:
+            self.assertEqual(set(compiled.eval_rule(process, rule, indexes)),
+                             set(_eval_rule(process, rule)), str(rule))
+
+        # A program is only compiled once.
+        self.assertEqual(list(_Plan(program, True).compiled.values()),
+                         list(compiled.compiled.values()))
+
+        # Running a program with compiled rules is the same as interpreting it.
+        program = typecheck(desugar(parser.parse(self.links)))
+        expected = spawn(program, lambda: 1)
+        actual = spawn(program, lambda: 1, compiled=True)
+        for _ in range(8):
+            expected = step(expected)
+            actual = step(actual)
+            self.assertEqual(actual.database, expected.database)
+
+    def test_engine(self) -> None:
+        program = typecheck(desugar(parser.parse(self.links)))
+        expected = spawn(program)
+        engines = [Engine(spawn(program)),
+                   Engine(spawn(program, incremental=True)),
+                   Engine(spawn(program, skip_unchanged=True))]
+        for _ in range(8):
+            expected = step(expected)
+            for engine in engines:
+                process = engine.step()
+                self.assertEqual(process.database, expected.database)
+                self.assertEqual(process.timestep, expected.timestep)
+
+        # Rules can be added between steps.
+        rule = 'reach(X, Y) :- path(X, Y), link(Y, Z), !cycle(Z).'
+        program = typecheck(desugar(parser.parse(self.links + rule)))
+        expected = run(spawn(program), 9)
+        reach = self.predicate('reach')
+        for engine in engines:
+            engine.add(desugar(parser.parse(rule)).rules)
+            process = engine.step()
+            self.assertEqual(process.database, expected.database)
+            self.assertGreater(len(process.database[reach]), 0)
+
+    def test_engine_storage(self) -> None:
+        # Relations created by `Engine.add` use the process's storage.
+        program = typecheck(desugar(parser.parse(self.links)))
+        storage = Storage('set', {'path': 'compact', 'reach': 'compact'})
+        engines = [Engine(spawn(program, storage=storage)),
+                   Engine(spawn(program, incremental=True, storage=storage))]
+        rule = 'reach(X, Y) :- path(X, Y), link(Y, Z), !cycle(Z).'
+        expected = run(spawn(typecheck(desugar(parser.parse(
+            self.links + rule)))), 4)
+        (path, reach) = (self.predicate('path'), self.predicate('reach'))
+        for engine in engines:
+            engine.run(3)
+            engine.add(desugar(parser.parse(rule)).rules)
+            for p in [path, reach]:
+                self.assertIsInstance(engine.process.database[p],
+                                      CompactRelation)
+            process = engine.step()
+            self.assertEqual(process.database, expected.database)
+            for p in [path, reach]:
+                self.assertIsInstance(process.database[p], CompactRelation)
+            self.assertIsInstance(process.database[self.predicate('link')],
+                                  set)
+
+    def test_engine_match(self) -> None:
+        program = typecheck(desugar(parser.parse(self.links)))
+        engine = Engine(spawn(program))
+        engine.run(3)
+        path = engine.process.database[self.predicate('path')]
+
+        def query(s: str) -> asts.Atom:
+            return desugar_query(parser.parse_atom(s))
+
+        cases: List[Tuple[str, AbstractSet[Tuple[Any, ...]]]] = [
+            ('path(#n, a, Y)', {t for t in path if t[1] == 'a'}),
+            ('path(#n, X, a)', {t for t in path if t[2] == 'a'}),
+            ('path(#n, a, a)', {t for t in path if t[1:] == ('a', 'a')}),
+            ('path(#n, X, X)', {t for t in path if t[1] == t[2]}),
+            ('path(#n, X, Y)', path),
+            ('path(#m, X, Y)', set()),
+            ('unknown(#n, X)', set()),
+        ]
+        for (s, expected) in cases:
+            atom = query(s)
+            self.assertEqual(set(engine.match(atom)), expected, s)
+            self.assertEqual(engine.count(atom), len(expected), s)
+
+        # Indexes are rebuilt after a step.
+        engine.step()
+        path = engine.process.database[self.predicate('path')]
+        self.assertEqual(set(engine.match(query('path(#n, a, Y)'))),
+                         {t for t in path if t[1] == 'a'})
+
 if __name__ == '__main__':
     unittest.main()
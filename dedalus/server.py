@@ -0,0 +1,329 @@
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+import hashlib
+import json
+import mimetypes
+import os
+import random
+import threading
+
+import networkx as nx
+
+from desugar import desugar
+from layout import Layout
+from parser import parse
+from run import Database, Engine, spawn
+from typecheck import typecheck
+import asts
+
+
+# The directory of the static files of the web interface.
+STATIC_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'server')
+
+# The number of programs and simulations kept in memory.
+CACHE_SIZE = 32
+
+class _LRU:
+    """
+    A thread-safe dictionary of at most `capacity` entries that evicts the
+    least recently used entry when it's full.
+    """
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.entries: 'OrderedDict[Any, Any]' = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Any) -> Any:
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key: Any, value: Any) -> Any:
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+            return value
+
+def _tuples(tuples: Any) -> List[List[Any]]:
+    return [list(t) for t in sorted(tuples)]
+
+def delta(before: Database, after: Database) -> Dict[str, Any]:
+    """
+    `delta(before, after)` returns the tuples added to and removed from every
+    relation going from `before` to `after`, as JSON, e.g.
+
+        {"added": {"p": [["a", "b"]]}, "removed": {"q": [["a"]]}}
+
+    Relations that didn't change are left out.
+    """
+    added: Dict[str, List[List[Any]]] = {}
+    removed: Dict[str, List[List[Any]]] = {}
+    for p in sorted(set(before) | set(after)):
+        old = before.get(p, set())
+        new = after.get(p, set())
+        if new != old:
+            if len(new - old) > 0:
+                added[p.x] = _tuples(new - old)
+            if len(old - new) > 0:
+                removed[p.x] = _tuples(old - new)
+    return {'added': added, 'removed': removed}
+
+class CachedProgram:
+    """
+    A typechecked program, parsed once and shared by every request for it.
+    Programs are identified by a hash of their source.
+    """
+    def __init__(self, source: str) -> None:
+        self.source = source
+        self.id = hashlib.sha1(source.encode()).hexdigest()
+        with asts.interning():
+            self.program = typecheck(desugar(parse(source)))
+        self.graph = self.program.pdg()
+        self.pdg = json.dumps(nx.node_link_data(self.graph))
+        self._layout: Optional[Layout] = None
+        self._collapsed: Optional[str] = None
+        self.lock = threading.Lock()
+
+    def layout(self, expanded: List[int]) -> str:
+        """
+        `program.layout(expanded)` returns the JSON encoded view of the
+        program's PDG with the components in `expanded` expanded (see
+        `Layout.view`). The layout, and the view with no components expanded,
+        are only computed once.
+        """
+        with self.lock:
+            if self._layout is None or self._collapsed is None:
+                self._layout = Layout(self.graph)
+                self._collapsed = json.dumps(self._layout.view())
+            (layout, collapsed) = (self._layout, self._collapsed)
+        if len(expanded) == 0:
+            return collapsed
+        return json.dumps(layout.view(expanded))
+
+class Simulation:
+    """
+    A `Simulation` runs a program with async delays drawn from a random number
+    generator seeded with `seed`, so every client watching the same program
+    and seed sees the same run. The run advances only when some client asks
+    for a timestep that hasn't been computed yet, and the delta of every
+    timestep (see `delta`) is encoded once and sent to every client as is.
+    """
+    def __init__(self, program: asts.Program, seed: int, low: int, high: int) \
+            -> None:
+        rng = random.Random(seed)
+        self.engine = Engine(spawn(program, lambda: rng.randint(low, high)))
+        self.database: Database = {}
+        self.deltas: List[str] = []
+        self.lock = threading.Lock()
+
+    def delta(self, timestep: int) -> str:
+        """
+        `simulation.delta(t)` returns the JSON encoded delta of timestep `t`.
+        """
+        with self.lock:
+            while len(self.deltas) <= timestep:
+                t = self.engine.process.timestep
+                database = self.engine.step().database
+                after: Database = {p: set(r) for (p, r) in database.items()}
+                event = delta(self.database, after)
+                event['timestep'] = t
+                self.deltas.append(json.dumps(event))
+                self.database = after
+            return self.deltas[timestep]
+
+class App:
+    """
+    The state of a server: the program being served, if any, and the cached
+    programs and simulations.
+
+      - `GET /program` returns the id, source, and PDG of the served program.
+        The file is parsed again only when it changes.
+      - `POST /program` parses the program in the request body and returns
+        its id and PDG.
+      - `GET /pdg?program=<id>` returns the PDG of a program, in the same
+        format as `dedalus.py pdg`.
+      - `GET /layout?program=<id>&expand=<c>,<c>,...` returns the PDG of a
+        program with its strongly connected components collapsed, except for
+        the listed ones, and every node positioned (see `layout.Layout`).
+      - `GET /run?program=<id>&timesteps=<n>&seed=<s>` streams the delta of
+        every timestep of a run of a program as Server-Sent Events whose ids
+        are timesteps. A client that reconnects with a `Last-Event-ID` header
+        resumes after the last timestep it saw.
+      - Any other `GET` serves a file from `STATIC_DIRECTORY`.
+    """
+    def __init__(self,
+                 filename: Optional[str],
+                 max_timesteps: int,
+                 low: int = 1,
+                 high: int = 10) \
+                 -> None:
+        if not 1 <= low <= high:
+            raise ValueError(f'Invalid async delay range [{low}, {high}].')
+        self.filename = filename
+        self.max_timesteps = max_timesteps
+        self.low = low
+        self.high = high
+        self.programs = _LRU(CACHE_SIZE)
+        self.simulations = _LRU(CACHE_SIZE)
+
+    def program(self, source: str) -> CachedProgram:
+        id_ = hashlib.sha1(source.encode()).hexdigest()
+        return self.programs.get(id_) or self.programs.put(
+            id_, CachedProgram(source))
+
+    def served(self) -> CachedProgram:
+        if self.filename is None:
+            raise KeyError('No program is being served.')
+        with open(self.filename) as f:
+            return self.program(f.read())
+
+    def lookup(self, id_: str) -> CachedProgram:
+        program = self.programs.get(id_)
+        if program is None:
+            raise KeyError(f'Unknown program "{id_}".')
+        return program
+
+    def simulation(self, program: CachedProgram, seed: int) -> Simulation:
+        key = (program.id, seed)
+        return (self.simulations.get(key) or
+                self.simulations.put(key, Simulation(program.program, seed,
+                                                     self.low, self.high)))
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def app(self) -> App:
+        return self.server.app # type: ignore
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, body: str, status: int = 200) -> None:
+        self._send(status, body.encode(), 'application/json')
+
+    def _error(self, status: int, message: str) -> None:
+        self._json(json.dumps({'error': message}), status)
+
+    def _program_json(self, program: CachedProgram) -> str:
+        return (f'{{"id": {json.dumps(program.id)}, '
+                f'"source": {json.dumps(program.source)}, '
+                f'"pdg": {program.pdg}}}')
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = {k: v[-1] for (k, v) in parse_qs(url.query).items()}
+        try:
+            if url.path == '/program':
+                self._json(self._program_json(self.app.served()))
+            elif url.path == '/pdg':
+                self._json(self.app.lookup(query.get('program', '')).pdg)
+            elif url.path == '/layout':
+                program = self.app.lookup(query.get('program', ''))
+                expand = query.get('expand', '')
+                expanded = [int(c) for c in expand.split(',') if c != '']
+                self._json(program.layout(expanded))
+            elif url.path == '/run':
+                self._run(query)
+            else:
+                self._static(url.path)
+        except KeyError as e:
+            self._error(404, e.args[0])
+        except ValueError as e:
+            self._error(400, str(e))
+
+    def do_POST(self) -> None:
+        if urlparse(self.path).path != '/program':
+            self._error(404, f'Unknown path "{self.path}".')
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        source = self.rfile.read(length).decode()
+        try:
+            self._json(self._program_json(self.app.program(source)))
+        except Exception as e:
+            self._error(400, str(e))
+
+    def _static(self, path: str) -> None:
+        name = os.path.basename(path) or 'index.html'
+        filename = os.path.join(STATIC_DIRECTORY, name)
+        if not os.path.isfile(filename):
+            raise KeyError(f'Unknown path "{path}".')
+        with open(filename, 'rb') as f:
+            body = f.read()
+        content_type = mimetypes.guess_type(name)[0]
+        self._send(200, body, content_type or 'application/octet-stream')
+
+    def _run(self, query: Dict[str, str]) -> None:
+        program = self.app.lookup(query.get('program', ''))
+        timesteps = int(query.get('timesteps', self.app.max_timesteps))
+        if not 0 <= timesteps <= self.app.max_timesteps:
+            raise ValueError(f'At most {self.app.max_timesteps} timesteps '
+                             f'can be run.')
+        simulation = self.app.simulation(program, int(query.get('seed', 0)))
+        start = int(self.headers.get('Last-Event-ID', -1)) + 1
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for t in range(start, timesteps):
+                event = f'id: {t}\ndata: {simulation.delta(t)}\n\n'
+                self.wfile.write(event.encode())
+                self.wfile.flush()
+            self.wfile.write(b'event: end\ndata: {}\n\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], app: App) -> None:
+        super().__init__(address, _Handler)
+        self.app = app
+
+def make_server(app: App, host: str = 'localhost', port: int = 8000) \
+        -> HTTPServer:
+    """
+    `make_server(app, host, port)` returns an HTTP server for `app` (see
+    `App`) bound to `host` and `port`. Every request is handled in its own
+    thread.
+    """
+    return _Server((host, port), app)
+
+def serve(filename: Optional[str],
+          host: str = 'localhost',
+          port: int = 8000,
+          max_timesteps: int = 1000,
+          low: int = 1,
+          high: int = 10) \
+          -> None:
+    """
+    `serve(filename, host, port, max_timesteps, low, high)` serves the web
+    interface for the program in `filename` (see `App`) until interrupted.
+    """
+    server = make_server(App(filename, max_timesteps, low, high), host, port)
+    print(f'Serving on http://{host}:{server.server_address[1]}/.')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,151 @@
+from typing import Any, Dict, List, Set, Tuple
+import json
+import random
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+from desugar import desugar
+from run import Database, run, spawn
+from server import App, delta, make_server
+from typecheck import typecheck
+import asts
+import parser
+
+
+class TestServer(unittest.TestCase):
+    program = """
+        link(#n, a, b) :- .
+        link(#n, b, c) :- .
+        unlink(#n, a, b)@3 :- .
+        link(X, Y)@next :- link(X, Y), !unlink(X, Y).
+        path(X, Y) :- link(X, Y).
+        path(X, Z) :- path(X, Y), link(Y, Z).
+        ping(#n, X)@async :- link(#n, X, Y).
+    """
+
+    def setUp(self) -> None:
+        self.server = make_server(App(None, 10), port=0)
+        self.url = f'http://localhost:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def request(self,
+                path: str,
+                data: bytes = None,
+                headers: Dict[str, str] = {}) \
+                -> Tuple[int, bytes]:
+        request = urllib.request.Request(self.url + path, data, headers)
+        try:
+            with urllib.request.urlopen(request) as response:
+                return (response.status, response.read()) # type: ignore
+        except urllib.error.HTTPError as e:
+            return (e.code, e.read())
+
+    def events(self, path: str, last: int = None) -> List[Tuple[str, str]]:
+        headers = {} if last is None else {'Last-Event-ID': str(last)}
+        (status, body) = self.request(path, headers=headers)
+        self.assertEqual(status, 200)
+        events: List[Tuple[str, str]] = []
+        for chunk in body.decode().split('\n\n'):
+            if chunk != '':
+                fields: Dict[str, str] = {}
+                for line in chunk.split('\n'):
+                    (field, value) = line.split(': ', 1)
+                    fields[field] = value
+                events.append((fields.get('id', fields.get('event', '')),
+                               fields['data']))
+        return events
+
+    def test_delta(self) -> None:
+        p = asts.Predicate('p')
+        q = asts.Predicate('q')
+        before: Database = {p: {('a',), ('b',)}, q: {('a',)}}
+        after: Database = {p: {('b',), ('c',)}, q: {('a',)}}
+        self.assertEqual(delta(before, after),
+                         {'added': {'p': [['c']]}, 'removed': {'p': [['a']]}})
+        self.assertEqual(delta(after, after), {'added': {}, 'removed': {}})
+
+    def test_program(self) -> None:
+        (status, body) = self.request('/program', self.program.encode())
+        self.assertEqual(status, 200)
+        response = json.loads(body.decode())
+        (status, body) = self.request(f'/pdg?program={response["id"]}')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body.decode()), response['pdg'])
+        nodes = {node['id'][0] for node in response['pdg']['nodes']}
+        self.assertEqual(nodes, {'link', 'unlink', 'path', 'ping'})
+
+        # Programs are cached by source.
+        (_, again) = self.request('/program', self.program.encode())
+        self.assertEqual(json.loads(again.decode())['id'], response['id'])
+
+        status = self.request('/program', b'p(X) :- q(Y).')[0]
+        self.assertEqual(status, 400)
+        status = self.request('/pdg?program=unknown')[0]
+        self.assertEqual(status, 404)
+        status = self.request('/program')[0]
+        self.assertEqual(status, 404)
+        status = self.request('/index.html')[0]
+        self.assertEqual(status, 200)
+
+    def test_program_interning(self) -> None:
+        # A program's nodes are interned in a scope of their own, so they're
+        # freed along with the program rather than kept by the server.
+        size = len(asts._TABLES.interned)
+        program = App(None, 10).program(self.program).program
+        self.assertEqual(len(asts._TABLES.interned), size)
+        self.assertIs(program.rules[4].head.predicate,
+                      program.rules[5].head.predicate)
+
+    def test_layout(self) -> None:
+        body = self.request('/program', self.program.encode())[1]
+        id_ = json.loads(body.decode())['id']
+        (status, body) = self.request(f'/layout?program={id_}')
+        self.assertEqual(status, 200)
+        view = json.loads(body.decode())
+        self.assertEqual({n['id'] for n in view['nodes']},
+                         {'link', 'unlink', 'path', 'ping'})
+
+        status = self.request(f'/layout?program={id_}&expand=0,x')[0]
+        self.assertEqual(status, 400)
+        status = self.request('/layout?program=unknown')[0]
+        self.assertEqual(status, 404)
+
+    def test_run(self) -> None:
+        body = self.request('/program', self.program.encode())[1]
+        id_ = json.loads(body.decode())['id']
+        events = self.events(f'/run?program={id_}&timesteps=6')
+        self.assertEqual([i for (i, _) in events],
+                         ['0', '1', '2', '3', '4', '5', 'end'])
+
+        # Applying the deltas gives the database of a run of the program.
+        relations: Dict[str, Set[Tuple[Any, ...]]] = {}
+        for (_, data) in events[:-1]:
+            event = json.loads(data)
+            for (p, tuples) in event['removed'].items():
+                relations[p] -= {tuple(t) for t in tuples}
+            for (p, tuples) in event['added'].items():
+                relations.setdefault(p, set()).update(tuple(t) for t in tuples)
+        program = typecheck(desugar(parser.parse(self.program)))
+        rng = random.Random(0)
+        expected = run(spawn(program, lambda: rng.randint(1, 10)), 6).database
+        self.assertEqual({p: r for (p, r) in relations.items() if len(r) > 0},
+                         {p.x: r for (p, r) in expected.items() if len(r) > 0})
+
+        # Runs are shared, and can be resumed.
+        self.assertEqual(self.events(f'/run?program={id_}&timesteps=6'),
+                         events)
+        self.assertEqual(self.events(f'/run?program={id_}&timesteps=6', 3),
+                         events[4:])
+        status = self.request(f'/run?program={id_}&timesteps=11')[0]
+        self.assertEqual(status, 400)
+
+if __name__ == '__main__':
+    unittest.main()
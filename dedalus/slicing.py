@@ -0,0 +1,56 @@
+from typing import Set
+
+import networkx as nx
+
+import asts
+
+
+def relevant_predicates(program: asts.Program,
+                        observed: Set[asts.Predicate]) \
+                        -> Set[asts.Predicate]:
+    """
+    `relevant_predicates(program, observed)` returns the set of predicates
+    that can influence the contents of the predicates in `observed`: the
+    observed predicates themselves and every predicate from which one of them
+    is reachable in the PDG of `program`. Deductive, inductive, and async
+    edges, both positive and negative, are all followed. For example, in the
+    following program:
+
+        b(X) :- a(X).
+        c(X)@next :- b(X), !d(X).
+        e(X)@async :- c(X).
+        f(X) :- a(X).
+
+    the predicates relevant to `e` are `a`, `b`, `c`, `d`, and `e`.
+    """
+    pdg = program.pdg()
+    unknown = observed - set(pdg.nodes)
+    if len(unknown) != 0:
+        msg = f'The predicates {unknown} do not appear in the program.'
+        raise ValueError(msg)
+
+    relevant: Set[asts.Predicate] = set(observed)
+    for p in observed:
+        relevant |= nx.ancestors(pdg, p)
+    return relevant
+
+def slice_program(program: asts.Program,
+                  observed: Set[asts.Predicate]) \
+                  -> asts.Program:
+    """
+    `slice_program(program, observed)` returns the subset of the rules of
+    `program` that can influence the predicates in `observed`. That is, it
+    drops every rule whose head is not a relevant predicate (see
+    `relevant_predicates`). The sliced program never computes or stores the
+    relations of the irrelevant predicates.
+
+    With a deterministic `randint` (e.g. `lambda: 1`), running the sliced
+    program produces exactly the same tuples for the observed predicates as
+    running `program` does. With a random `randint`, it doesn't draw a delay
+    for the async tuples of the dropped rules, so the same seed leads to a
+    different schedule: the observed tuples are those of some possible run of
+    `program`, but not necessarily of the run with the same seed.
+    """
+    relevant = relevant_predicates(program, observed)
+    return asts.Program(tuple(r for r in program.rules
+                              if r.head.predicate in relevant))
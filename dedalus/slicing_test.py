@@ -0,0 +1,83 @@
+from typing import List, Set, Tuple
+import unittest
+
+from desugar import desugar
+from run import run, spawn
+from slicing import relevant_predicates, slice_program
+from typecheck import typecheck
+import asts
+import parser
+
+
+class TestSlicing(unittest.TestCase):
+    def predicates(self, xs: Set[str]) -> Set[asts.Predicate]:
+        return {parser.predicate.parse_strict(x) for x in xs}
+
+    def program(self, source: str) -> asts.Program:
+        return typecheck(desugar(parser.parse(source)))
+
+    def test_relevant_predicates(self) -> None:
+        source = r"""
+            a(#l, x) :- .
+            b(X) :- a(X).
+            c(X)@next :- b(X), !d(X).
+            e(X)@async :- c(X).
+            f(X) :- a(X).
+            g(X) :- f(X), e(X).
+        """
+        test_cases: List[Tuple[Set[str], Set[str]]] = [
+            ({'a'}, {'a'}),
+            ({'d'}, {'d'}),
+            ({'b'}, {'a', 'b'}),
+            ({'e'}, {'a', 'b', 'c', 'd', 'e'}),
+            ({'f'}, {'a', 'f'}),
+            ({'b', 'f'}, {'a', 'b', 'f'}),
+            ({'g'}, {'a', 'b', 'c', 'd', 'e', 'f', 'g'}),
+        ]
+        program = self.program(source)
+        for observed, expected in test_cases:
+            actual = relevant_predicates(program, self.predicates(observed))
+            self.assertEqual(actual, self.predicates(expected), observed)
+
+        with self.assertRaises(ValueError):
+            relevant_predicates(program, self.predicates({'z'}))
+
+    def test_slice_program(self) -> None:
+        source = r"""
+            link(#n, a, b)@0 :- .
+            link(#n, b, c)@0 :- .
+            link(#n, c, a)@0 :- .
+            link(X, Y)@next :- link(X, Y).
+            nodes(X) :- link(X, Y).
+            nodes(Y) :- link(X, Y).
+            path(X, Y) :- link(X, Y).
+            path(X, Y) :- path(X, Z), link(Z, Y).
+            not_path(X, Y) :- nodes(X), nodes(Y), !path(X, Y).
+            cycle(X) :- path(X, X).
+        """
+        program = self.program(source)
+        observed = self.predicates({'cycle'})
+        sliced = slice_program(program, observed)
+        self.assertEqual(sliced.predicates(),
+                         self.predicates({'link', 'path', 'cycle'}))
+
+        full = run(spawn(program, lambda: 1), 3)
+        partial = run(spawn(sliced, lambda: 1), 3)
+        for p in observed:
+            self.assertEqual(full.database[p], partial.database[p])
+
+    def test_slice_body_only_predicate(self) -> None:
+        # No rule can derive r, so the sliced program has no rules at all, and
+        # running it must not fail.
+        program = self.program('p(X) :- q(X), !r(X).')
+        sliced = slice_program(program, self.predicates({'r'}))
+        self.assertEqual(sliced.rules, ())
+        process = run(spawn(sliced, lambda: 1), 3)
+        self.assertEqual(process.timestep, 3)
+        self.assertEqual(process.database, {})
+
+        empty = run(spawn(asts.Program(()), lambda: 1), 2)
+        self.assertEqual(empty.timestep, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+from copy import deepcopy
+from typing import (Any, Callable, DefaultDict, Dict, Iterable, List,
+                    MutableSet, Optional, Tuple)
+import marshal
+import os
+import shutil
+import sys
+import tempfile
+
+from relation import CompactRelation
+import asts
+
+
+Bucket = DefaultDict[asts.Predicate, MutableSet[Tuple[Any, ...]]]
+
+
+class _Segment:
+    """
+    A segment is an immutable file that holds part of a spilled bucket. A
+    segment is shared by every copy of the async buffer that spilled it (e.g.
+    the processes returned by successive calls to `run.step`), and the file is
+    deleted once none of them refer to it.
+    """
+    def __init__(self, directory: str, bucket: Bucket) -> None:
+        (fd, self.path) = tempfile.mkstemp(dir=directory, suffix='.segment')
+        data = {p.x: list(r) for (p, r) in bucket.items() if len(r) > 0}
+        with os.fdopen(fd, 'wb') as f:
+            marshal.dump(data, f)
+        self.nbytes = os.path.getsize(self.path)
+
+    def load(self) -> Dict[asts.Predicate, List[Tuple[Any, ...]]]:
+        with open(self.path, 'rb') as f:
+            data = marshal.load(f)
+        return {asts.Predicate(p): tuples for (p, tuples) in data.items()}
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> '_Segment':
+        return self
+
+    def __del__(self) -> None:
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+def _estimate(relation: MutableSet[Tuple[Any, ...]]) -> int:
+    # Measuring every tuple of a set is too slow to do every timestep, so we
+    # assume that every tuple is about as big as an arbitrary one of them.
+    # The constants in the tuples are assumed to be shared.
+    if isinstance(relation, CompactRelation):
+        return relation.nbytes()
+    size = sys.getsizeof(relation)
+    for tuple_ in relation:
+        return size + len(relation) * sys.getsizeof(tuple_)
+    return size
+
+class SpillingAsyncBuffer(DefaultDict[int, Bucket]):
+    """
+    A `SpillingAsyncBuffer` is an async buffer that keeps the buckets of the
+    near future in memory and spills the buckets of the far future to disk
+    when the buffer exceeds a memory budget. Programs with long async delays
+    (e.g. `run --low 1 --high 1000`) buffer tuples for many future timesteps,
+    and most of these buckets aren't needed for a long time.
+
+    A `SpillingAsyncBuffer` is used exactly like the `defaultdict` that
+    `run.spawn` normally creates. Writing tuples to `buffer[t]` writes them to
+    an in-memory bucket; if some of timestep t's tuples have already been
+    spilled, the new ones are spilled along with them later. Deleting
+    `buffer[t]`, which `run.step` does at the end of timestep t, advances the
+    buffer's clock to t + 1. When the clock advances, the buffer
+
+      1. prefetches every spilled bucket within `prefetch` timesteps of the
+         clock, so that the next few timesteps are entirely in memory, and
+      2. if its in-memory buckets use more than `budget` bytes, spills the
+         buckets farthest in the future (but not within `prefetch` timesteps
+         of the clock) to segment files in `directory` until they don't.
+
+    Spilled buckets are encoded with `marshal`. `buffer[t]` always returns all
+    of the tuples of timesteps within `prefetch` timesteps of the clock.
+    `buffer.items()` returns every bucket, loading spilled buckets from disk,
+    whereas `buffer.values()` returns only the buckets in memory.
+    """
+    def __init__(self,
+                 default_factory: Callable[[], Bucket],
+                 budget: int,
+                 directory: str = None,
+                 prefetch: int = 2) \
+                 -> None:
+        super().__init__(default_factory)
+        self.factory = default_factory
+        self.budget = budget
+        self.prefetch = prefetch
+        self.now = 0
+        self.spilled: Dict[int, List[_Segment]] = {}
+        if directory is None:
+            self.directory = tempfile.mkdtemp(prefix='dedalus-')
+            self._owned: Optional[_Directory] = _Directory(self.directory)
+        else:
+            self.directory = directory
+            self._owned = None
+
+    def __getitem__(self, t: int) -> Bucket:
+        if t in self.spilled and t < self.now + self.prefetch:
+            self._load(t)
+        return super().__getitem__(t)
+
+    def __delitem__(self, t: int) -> None:
+        if super().__contains__(t):
+            super().__delitem__(t)
+        self.spilled.pop(t, None)
+        self.advance(t + 1)
+
+    def _bucket(self, t: int) -> Bucket:
+        if not super().__contains__(t):
+            super().__setitem__(t, self.factory())
+        return super().__getitem__(t)
+
+    def _load(self, t: int) -> None:
+        bucket = self._bucket(t)
+        for segment in self.spilled.pop(t):
+            for (p, tuples) in segment.load().items():
+                bucket[p] |= set(tuples)
+
+    def advance(self, now: int) -> None:
+        """
+        `buffer.advance(now)` sets the buffer's clock to `now`, prefetching
+        and spilling buckets as described above.
+        """
+        self.now = now
+        for t in [t for t in self.spilled if t < now + self.prefetch]:
+            self._load(t)
+
+        sizes = {t: sum(_estimate(r) for r in bucket.values())
+                 for (t, bucket) in super().items()}
+        total = sum(sizes.values())
+        for t in sorted(sizes, reverse=True):
+            if total <= self.budget or t < now + self.prefetch:
+                break
+            bucket = super().pop(t)
+            if any(len(r) > 0 for r in bucket.values()):
+                segment = _Segment(self.directory, bucket)
+                self.spilled.setdefault(t, []).append(segment)
+            total -= sizes[t]
+
+    def spilled_bytes(self) -> int:
+        return sum(s.nbytes for ss in self.spilled.values() for s in ss)
+
+    def items(self) -> Iterable[Tuple[int, Bucket]]: # type: ignore
+        buckets: Dict[int, Bucket] = dict(super().items())
+        for (t, segments) in self.spilled.items():
+            bucket = self.factory()
+            for (p, r) in buckets.get(t, {}).items():
+                bucket[p] |= r
+            for segment in segments:
+                for (p, tuples) in segment.load().items():
+                    bucket[p] |= set(tuples)
+            buckets[t] = bucket
+        return buckets.items()
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> 'SpillingAsyncBuffer':
+        copy = SpillingAsyncBuffer(self.factory, self.budget,
+                                   self.directory, self.prefetch)
+        copy._owned = self._owned
+        copy.now = self.now
+        copy.spilled = {t: list(ss) for (t, ss) in self.spilled.items()}
+        for (t, bucket) in super().items():
+            dict.__setitem__(copy, t, deepcopy(bucket, memo))
+        return copy
+
+class _Directory:
+    """
+    A temporary directory that is deleted once every async buffer that uses
+    it (and every segment in it) has been garbage collected.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def __del__(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
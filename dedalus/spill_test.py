@@ -0,0 +1,63 @@
+from typing import Callable
+import itertools
+import os
+import tempfile
+import unittest
+
+from desugar import desugar
+from run import run, spawn, step
+from spill import SpillingAsyncBuffer
+from typecheck import typecheck
+import parser
+
+
+class TestSpill(unittest.TestCase):
+    source = """
+        p(#a, 0) :- .
+        p(#L, X)@next :- p(#L, X).
+        q(#L, X)@async :- p(#L, X).
+        r(#L, X) :- q(#L, X).
+        s(#L, X) :- q(#L, X).
+    """
+
+    def randint(self) -> Callable[[], int]:
+        delays = itertools.cycle([1, 7, 3, 20, 5])
+        return lambda: next(delays)
+
+    def test_spill(self) -> None:
+        program = typecheck(desugar(parser.parse(self.source)))
+        expected = spawn(program, self.randint())
+
+        with tempfile.TemporaryDirectory() as directory:
+            actual = spawn(program, self.randint(), memory_budget=0,
+                           spill_directory=directory)
+            assert isinstance(actual.async_buffer, SpillingAsyncBuffer)
+            for _ in range(30):
+                expected = step(expected)
+                actual = step(actual)
+                self.assertEqual(actual.database, expected.database)
+                self.assertEqual(dict(actual.async_buffer.items()),
+                                 dict(expected.async_buffer.items()))
+
+            buffer = actual.async_buffer
+            assert isinstance(buffer, SpillingAsyncBuffer)
+            self.assertGreater(len(buffer.spilled), 0)
+            self.assertGreater(buffer.spilled_bytes(), 0)
+            self.assertTrue(all(t >= buffer.now + buffer.prefetch
+                                for t in buffer.spilled))
+            self.assertLess(len(os.listdir(directory)), 30)
+
+            del actual, buffer
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_compact_spill(self) -> None:
+        program = typecheck(desugar(parser.parse(self.source)))
+        expected = run(spawn(program, self.randint()), 20)
+        actual = run(spawn(program, self.randint(), compact=True,
+                           memory_budget=0), 20)
+        self.assertEqual(actual.database, expected.database)
+        self.assertEqual(dict(actual.async_buffer.items()),
+                         dict(expected.async_buffer.items()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,335 @@
+from collections import defaultdict
+from typing import AbstractSet, Any, Dict, Iterator, List, Set, Tuple
+import random
+import sqlite3
+
+from ingest import _arities
+from run import AsyncBuffer, Database, Process, RandInt, _strata, _strata_rules
+import asts
+import builtin
+
+
+def _literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+def _columns(arity: int) -> List[str]:
+    # Every predicate of a desugared program has a location, so no table is
+    # without columns.
+    return [f'c{i}' for i in range(arity)]
+
+def _aggregate(function: str, column: str) -> str:
+    # Constants are strings, so sums, minimums, and maximums are computed over
+    # their integer values, and every aggregate is converted back to a string.
+    # Like the interpreter, sums are over distinct constants rather than
+    # distinct numbers: SUM(DISTINCT) compares the strings and adds the
+    # integers they denote.
+    if function == 'count':
+        return f'CAST(COUNT(DISTINCT {column}) AS TEXT)'
+    if function == 'sum':
+        return f'CAST(SUM(DISTINCT {column}) AS TEXT)'
+    number = f'CAST({column} AS INTEGER)'
+    return f'CAST({function.upper()}({number}) AS TEXT)'
+
+def _number(value: str) -> str:
+    return f'CAST({value} AS INTEGER)'
+
+def _arithmetic(op: str, x: str, y: str) -> str:
+    # SQLite's integer division also truncates toward zero, and dividing by
+    # zero is NULL.
+    return f'CAST({_number(x)} {op} {_number(y)} AS TEXT)'
+
+class _Table(AbstractSet[Tuple[Any, ...]]):
+    """
+    A read-only view of the tuples of a table, or of one timestep of a
+    buffer table, that queries SQLite whenever it is used. See
+    `Engine.process`.
+    """
+    def __init__(self,
+                 connection: sqlite3.Connection,
+                 table: str,
+                 arity: int,
+                 timestep: int = None) \
+                 -> None:
+        self.connection = connection
+        self.table = table
+        self.arity = arity
+        self.conditions = [] if timestep is None else [f't = {timestep}']
+
+    def _query(self, select: str, conditions: List[str]) -> str:
+        conditions = self.conditions + conditions
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+        return f'SELECT {select} FROM {self.table}{where}'
+
+    def __len__(self) -> int:
+        query = self._query('COUNT(*)', [])
+        return self.connection.execute(query).fetchone()[0]
+
+    def __iter__(self) -> Iterator[Tuple[Any, ...]]:
+        query = self._query(', '.join(_columns(self.arity)), [])
+        yield from self.connection.execute(query)
+
+    def __contains__(self, tuple_: Any) -> bool:
+        if not isinstance(tuple_, tuple) or len(tuple_) != self.arity:
+            return False
+        query = self._query('1', [f'{c} = ?' for c in _columns(self.arity)])
+        return self.connection.execute(query, tuple_).fetchone() is not None
+
+class Engine:
+    """
+    An `Engine` runs a program with its relations stored in SQLite, either in
+    memory or, if `filename` is given, in a file, so the relations of a
+    simulation can outgrow RAM. Every predicate p has three tables:
+
+      - `r<i>_0` and `r<i>_1`, which take turns holding the relation of p at
+        the current timestep and collecting the tuples derived by inductive
+        rules for the next one (see `_table`); and
+      - `b<i>`, the tuples of p in the async buffer, with their timesteps.
+
+    Every rule is translated into an `INSERT OR IGNORE INTO ... SELECT`
+    statement that joins the tables of its positive atoms, with a `NOT EXISTS`
+    subquery for every negative atom, a condition or a computed column for
+    every built-in predicate and, for an aggregate rule, a `GROUP BY` clause
+    on the variables of its head. For example, at even timesteps, `p(X,
+    Z) :- q(X, Y), r(Y, Z), !s(Z).` becomes
+
+        INSERT OR IGNORE INTO r0_0 (c0, c1)
+        SELECT DISTINCT a0.c0, a1.c1 FROM r1_0 AS a0, r2_0 AS a1
+        WHERE a1.c0 = a0.c1
+          AND NOT EXISTS (SELECT 1 FROM r3_0 WHERE c0 = a1.c1)
+
+    A stratum's deductive rules are run until none of them inserts a tuple.
+    Tables are indexed on the columns of every atom that are compared to a
+    constant or joined with another atom, and SQLite's query planner picks
+    the join order. Advancing to the next timestep swaps the roles of the two
+    relation tables of every predicate, so relations are never copied, and
+    moves the async tuples of the next timestep out of the `b` tables.
+    """
+    def __init__(self,
+                 program: asts.Program,
+                 randint: RandInt = None,
+                 filename: str = ':memory:') \
+                 -> None:
+        self.program = program
+        self.randint = randint or (lambda: random.randint(1, 10))
+        self.timestep = 0
+        self.connection = sqlite3.connect(filename, isolation_level=None,
+                                          check_same_thread=False)
+        self.arities = _arities(program)
+        self.names = {p: i for (i, p) in enumerate(sorted(self.arities))}
+        self.strata = _strata(program)
+
+        execute = self.connection.execute
+        execute('BEGIN')
+        for (p, i) in self.names.items():
+            columns = ', '.join(_columns(self.arities[p]))
+            for table in [f'r{i}_0', f'r{i}_1']:
+                execute(f'DROP TABLE IF EXISTS {table}')
+                execute(f'CREATE TABLE {table} '
+                        f'({columns}, UNIQUE ({columns}))')
+            execute(f'DROP TABLE IF EXISTS b{i}')
+            execute(f'CREATE TABLE b{i} (t INTEGER, {columns}, '
+                    f'UNIQUE (t, {columns}))')
+        for (p, key) in sorted(self._keys()):
+            indexed = ', '.join(f'c{c}' for c in key)
+            name = '_'.join(str(c) for c in key)
+            for parity in [0, 1]:
+                table = self._table(p, parity)
+                execute(f'CREATE INDEX {table}_{name} ON {table} ({indexed})')
+        execute('COMMIT')
+
+        # The statement of every rule, and the query of every async rule, at
+        # even and odd timesteps.
+        self.statements = [{id(rule): self._insert(rule, parity)
+                            for rule in program.rules if not rule.is_async()}
+                           for parity in [0, 1]]
+        self.queries = [{id(rule): self.select(rule, parity)
+                         for rule in program.rules if rule.is_async()}
+                        for parity in [0, 1]]
+
+    def _table(self, p: asts.Predicate, parity: int) -> str:
+        # The relation of p at timestep t is the table of parity t % 2.
+        return f'r{self.names[p]}_{parity}'
+
+    def _keys(self) -> Set[Tuple[asts.Predicate, Tuple[int, ...]]]:
+        # The columns of every positive atom that are compared to a constant
+        # or to a variable that appears elsewhere in the rule, unless they're
+        # all of its columns, which the table's UNIQUE constraint indexes.
+        keys: Set[Tuple[asts.Predicate, Tuple[int, ...]]] = set()
+        for rule in self.program.rules:
+            atoms = [l.atom for l in rule.body if l.is_positive()]
+            for (k, atom) in enumerate(atoms):
+                others = {v.x for (j, a) in enumerate(atoms) if j != k
+                              for v in a.variables()}
+                others |= {v.x for l in rule.body if l.is_negative()
+                               for v in l.atom.variables()}
+                others |= {v.x for b in rule.builtins for v in b.variables()}
+                columns = tuple(i for (i, t) in enumerate(atom.terms)
+                                  if isinstance(t, asts.Constant) or
+                                     t.x in others)
+                if 0 < len(columns) < len(atom.terms):
+                    keys.add((atom.predicate, columns))
+        return keys
+
+    def select(self, rule: asts.Rule, parity: int = 0) -> str:
+        """
+        `engine.select(rule, parity)` returns a `SELECT` statement that returns
+        the tuples produced by evaluating `rule` at a timestep of parity
+        `parity`.
+        """
+        tables: List[str] = []
+        conditions: List[str] = []
+        variables: Dict[str, str] = {}
+        positives = [l.atom for l in rule.body if l.is_positive()]
+        for (k, atom) in enumerate(positives):
+            tables.append(f'{self._table(atom.predicate, parity)} AS a{k}')
+            for (i, t) in enumerate(atom.terms):
+                column = f'a{k}.c{i}'
+                if isinstance(t, asts.Constant):
+                    conditions.append(f'{column} = {_literal(t.x)}')
+                elif t.x in variables:
+                    conditions.append(f'{column} = {variables[t.x]}')
+                else:
+                    variables[t.x] = column
+
+        def value(t: asts.Term) -> str:
+            if isinstance(t, asts.Constant):
+                return _literal(t.x)
+            if isinstance(t, asts.Aggregate):
+                return _aggregate(t.function, variables[t.x])
+            return variables[t.x]
+
+        def expression(e: asts.Expression) -> str:
+            if isinstance(e, asts.Arithmetic):
+                return _arithmetic(e.op, value(e.left), value(e.right))
+            return value(e)
+
+        for (b, assignment) in builtin.ready(list(rule.builtins),
+                                             set(variables)):
+            if assignment is not None:
+                (x, e) = assignment
+                variables[x] = expression(e)
+                if isinstance(e, asts.Arithmetic) and e.op in ['/', '%']:
+                    conditions.append(f'{variables[x]} IS NOT NULL')
+            elif b.op in ['=', '!=']:
+                op = '<>' if b.op == '!=' else '='
+                conditions.append(
+                    f'{expression(b.left)} {op} {expression(b.right)}')
+            else:
+                conditions.append(f'{_number(expression(b.left))} {b.op} '
+                                  f'{_number(expression(b.right))}')
+
+        for l in rule.body:
+            if l.is_negative():
+                atom = l.atom
+                table = self._table(atom.predicate, parity)
+                matches = [f'c{i} = {value(t)}'
+                           for (i, t) in enumerate(atom.terms)]
+                where = f' WHERE {" AND ".join(matches)}' if matches else ''
+                conditions.append(
+                    f'NOT EXISTS (SELECT 1 FROM {table}{where})')
+
+        head = [value(t) for t in rule.head.terms]
+        query = f'SELECT DISTINCT {", ".join(head)}'
+        if len(tables) > 0:
+            query += f' FROM {", ".join(tables)}'
+        if len(conditions) > 0:
+            query += f' WHERE {" AND ".join(conditions)}'
+        if rule.is_aggregate():
+            # Without a GROUP BY clause, an aggregate of no rows is a row.
+            groups = [variables[t.x] for t in rule.head.terms
+                      if isinstance(t, asts.Variable)]
+            if len(groups) > 0:
+                query += f' GROUP BY {", ".join(groups)}'
+            else:
+                query += ' HAVING COUNT(*) > 0'
+        return query
+
+    def _insert(self, rule: asts.Rule, parity: int) -> str:
+        p = rule.head.predicate
+        columns = ', '.join(_columns(self.arities[p]))
+        table = self._table(p, 1 - parity if rule.is_inductive() else parity)
+        return (f'INSERT OR IGNORE INTO {table} ({columns}) '
+                f'{self.select(rule, parity)}')
+
+    def step(self) -> None:
+        """`engine.step()` runs the program for one timestep."""
+        execute = self.connection.execute
+        t = self.timestep
+        parity = t % 2
+        statements = self.statements[parity]
+        execute('BEGIN')
+
+        # The tables of the next timestep still hold the relations of the
+        # previous one. The tables of this timestep already hold the tuples of
+        # the async buffer and of the previous timestep's inductive rules.
+        for p in self.names:
+            execute(f'DELETE FROM {self._table(p, 1 - parity)}')
+
+        # Constant rules.
+        for rule in self.program.rules:
+            rule_type = rule.rule_type
+            if (isinstance(rule_type, asts.ConstantTimeRule) and
+                rule_type.time == t):
+                execute(statements[id(rule)])
+
+        # Deductive rules.
+        deductive_rules = [r for r in self.program.rules if r.is_deductive()]
+        for rules in _strata_rules(deductive_rules, self.strata):
+            changed = True
+            while changed:
+                before = self.connection.total_changes
+                for rule in rules:
+                    execute(statements[id(rule)])
+                changed = self.connection.total_changes != before
+
+        # Inductive and async rules.
+        for rule in self.program.rules:
+            if rule.is_inductive():
+                execute(statements[id(rule)])
+            elif rule.is_async():
+                i = self.names[rule.head.predicate]
+                columns = _columns(self.arities[rule.head.predicate])
+                rows = [(t + self.randint(),) + row
+                        for row in execute(self.queries[parity][id(rule)])]
+                self.connection.executemany(
+                    f'INSERT OR IGNORE INTO b{i} (t, {", ".join(columns)}) '
+                    f'VALUES (?, {", ".join("?" for _ in columns)})', rows)
+
+        # Move the async tuples of the next timestep into its tables.
+        for (p, i) in self.names.items():
+            values = ', '.join(_columns(self.arities[p]))
+            execute(f'INSERT OR IGNORE INTO {self._table(p, 1 - parity)} '
+                    f'SELECT {values} FROM b{i} WHERE t = ?', (t + 1,))
+            execute(f'DELETE FROM b{i} WHERE t = ?', (t + 1,))
+        execute('COMMIT')
+        self.timestep += 1
+
+    def run(self, timesteps: int) -> None:
+        for _ in range(timesteps):
+            self.step()
+
+    def process(self) -> Process:
+        """
+        `engine.process()` returns a process with the state of the engine: its
+        timestep, the relations at the end of its previous timestep, and its
+        async buffer, which includes the tuples derived by inductive rules for
+        the current timestep (as in `run.step`). The relations of the process
+        query SQLite whenever they're used and are only valid until the next
+        step.
+        """
+        c = self.connection
+        parity = self.timestep % 2
+        database: Database = {}
+        async_buffer: AsyncBuffer = defaultdict(dict) # type: ignore
+        for (p, i) in self.names.items():
+            arity = self.arities[p]
+            table = _Table(c, self._table(p, 1 - parity), arity)
+            database[p] = table # type: ignore
+            next_ = _Table(c, self._table(p, parity), arity)
+            if len(next_) > 0:
+                async_buffer[self.timestep][p] = next_ # type: ignore
+            for (t,) in c.execute(f'SELECT DISTINCT t FROM b{i}').fetchall():
+                bucket = _Table(c, f'b{i}', arity, t)
+                async_buffer[t][p] = bucket # type: ignore
+        return Process(self.program, self.timestep, database, async_buffer,
+                       self.randint)
@@ -0,0 +1,128 @@
+import glob
+import os
+import tempfile
+import unittest
+
+from desugar import desugar
+from run import run, spawn
+from typecheck import typecheck
+import asts
+import parser
+import sql
+
+
+class TestSql(unittest.TestCase):
+    def test_select(self) -> None:
+        program = typecheck(desugar(parser.parse("""
+            p(X, Z) :- q(X, Y), q(Y, Z), !r(Z), q(Z, a).
+            r(#n, a) :- .
+            s(#n) :- !r(#n, b).
+        """)))
+        engine = sql.Engine(program)
+        self.assertEqual(engine.names, {asts.Predicate('p'): 0,
+                                        asts.Predicate('q'): 1,
+                                        asts.Predicate('r'): 2,
+                                        asts.Predicate('s'): 3})
+        self.assertEqual(
+            engine.select(program.rules[0]),
+            "SELECT DISTINCT a0.c0, a0.c1, a1.c2 "
+            "FROM r1_0 AS a0, r1_0 AS a1, r1_0 AS a2 "
+            "WHERE a1.c0 = a0.c0 AND a1.c1 = a0.c2 "
+            "AND a2.c0 = a0.c0 AND a2.c1 = a1.c2 AND a2.c2 = 'a' "
+            "AND NOT EXISTS "
+            "(SELECT 1 FROM r2_0 WHERE c0 = a0.c0 AND c1 = a1.c2)")
+        self.assertEqual(engine.select(program.rules[1]),
+                         "SELECT DISTINCT 'n', 'a'")
+        self.assertEqual(
+            engine.select(program.rules[2]),
+            "SELECT DISTINCT 'n' WHERE NOT EXISTS "
+            "(SELECT 1 FROM r2_0 WHERE c0 = 'n' AND c1 = 'b')")
+
+    def test_aggregates(self) -> None:
+        program = typecheck(desugar(parser.parse("""
+            p(count<X>) :- q(X).
+            r(X, sum<Y>, max<Y>) :- s(X, Y).
+        """)))
+        engine = sql.Engine(program)
+        self.assertEqual(
+            engine.select(program.rules[0]),
+            "SELECT DISTINCT a0.c0, CAST(COUNT(DISTINCT a0.c1) AS TEXT) "
+            "FROM r1_0 AS a0 GROUP BY a0.c0")
+        self.assertEqual(
+            engine.select(program.rules[1]),
+            "SELECT DISTINCT a0.c0, a0.c1, "
+            "CAST(SUM(DISTINCT a0.c2) AS TEXT), "
+            "CAST(MAX(CAST(a0.c2 AS INTEGER)) AS TEXT) "
+            "FROM r3_0 AS a0 GROUP BY a0.c0, a0.c1")
+
+        engine.connection.executemany('INSERT INTO r3_0 VALUES (?, ?, ?)',
+                                      [('n', 'a', '2'), ('n', 'a', '5'),
+                                       ('n', 'b', '4'), ('n', 'b', '04')])
+        engine.run(1)
+        self.assertEqual(set(engine.process().database[asts.Predicate('r')]),
+                         {('n', 'a', '7', '5'), ('n', 'b', '8', '4')})
+
+    def test_builtins(self) -> None:
+        program = typecheck(desugar(parser.parse("""
+            p(X, Z) :- q(X, Y), Z = Y + 1, Y < 3, !q(Y, Z).
+            r(Y) :- q(X, Y), X = a.
+        """)))
+        engine = sql.Engine(program)
+        self.assertEqual(
+            engine.select(program.rules[0]),
+            "SELECT DISTINCT a0.c0, a0.c1, "
+            "CAST(CAST(a0.c2 AS INTEGER) + CAST('1' AS INTEGER) AS TEXT) "
+            "FROM r1_0 AS a0 "
+            "WHERE CAST(a0.c2 AS INTEGER) < CAST('3' AS INTEGER) "
+            "AND NOT EXISTS (SELECT 1 FROM r1_0 WHERE c0 = a0.c0 AND "
+            "c1 = a0.c2 AND c2 = "
+            "CAST(CAST(a0.c2 AS INTEGER) + CAST('1' AS INTEGER) AS TEXT))")
+        self.assertEqual(
+            engine.select(program.rules[1]),
+            "SELECT DISTINCT a0.c0, a0.c2 FROM r1_0 AS a0 WHERE a0.c1 = 'a'")
+
+    def test_examples(self) -> None:
+        # With the same async delays, the sqlite engine and the interpreter
+        # end in the same state.
+        directory = os.path.join(os.path.dirname(__file__), '..', 'examples')
+        filenames = glob.glob(os.path.join(directory, '*.dedalus'))
+        for filename in sorted(filenames):
+            with open(filename) as f:
+                program = typecheck(desugar(parser.parse(f.read())))
+            expected = run(spawn(program, lambda: 2), 12)
+            engine = sql.Engine(program, lambda: 2)
+            engine.run(12)
+            self.assertEqual(str(engine.process()), str(expected), filename)
+
+    def test_process(self) -> None:
+        program = typecheck(desugar(parser.parse("""
+            p(#a, b) :- .
+            p(#a, c) :- .
+            q(#a) :- .
+            r(X)@next :- p(X).
+            s(X)@async :- p(X).
+        """)))
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'process.db')
+            engine = sql.Engine(program, lambda: 3, filename)
+            engine.run(2)
+            process = engine.process()
+            self.assertTrue(os.path.isfile(filename))
+
+            (p, q, r, s) = [asts.Predicate(x) for x in 'pqrs']
+            self.assertEqual(process.timestep, 2)
+            self.assertEqual(set(process.database[p]),
+                             {('a', 'b'), ('a', 'c')})
+            self.assertEqual(len(process.database[p]), 2)
+            self.assertTrue(('a', 'b') in process.database[p])
+            self.assertFalse(('a', 'd') in process.database[p])
+            self.assertEqual(set(process.database[q]), {('a',)})
+            self.assertEqual(set(process.async_buffer[2][r]),
+                             {('a', 'b'), ('a', 'c')})
+            self.assertEqual(sorted(process.async_buffer), [2, 3, 4])
+            self.assertEqual(set(process.async_buffer[4][s]),
+                             {('a', 'b'), ('a', 'c')})
+            engine.connection.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,9 @@
-from typing import Dict
+from typing import Dict, Set
 
 import networkx as nx
 
 import asts
+import builtin
 
 
 def _fixed_arities(program: asts.Program) -> None:
@@ -15,14 +16,27 @@ def _fixed_arities(program: asts.Program) -> None:
     """
     arities: Dict[str, int] = {}
     for rule in program.rules:
-        for atom in [rule.head] + [l.atom for l in rule.body]:
-            p = atom.predicate.x
-            arity = len(atom.terms)
-            if p in arities and arities[p] != arity:
-                msg = f'Predicate {p} has inconsistent arities.'
-                raise ValueError(msg)
-            else:
-                arities[p] = arity
+        arities.update(_fixed_arities_rule(rule, arities))
+
+def _fixed_arities_rule(rule: asts.Rule,
+                        arities: Dict[str, int]) \
+                        -> Dict[str, int]:
+    """
+    `_fixed_arities_rule(rule, arities)` checks that the arities of the
+    predicates in `rule` agree with each other and with `arities`, and
+    returns the arities of the predicates in `rule`.
+    """
+    rule_arities: Dict[str, int] = {}
+    for atom in [rule.head] + [l.atom for l in rule.body]:
+        p = atom.predicate.x
+        arity = len(atom.terms)
+        expected = rule_arities.get(p, arities.get(p))
+        if expected is not None and expected != arity:
+            msg = f'Predicate {p} has inconsistent arities.'
+            raise ValueError(msg)
+        else:
+            rule_arities[p] = arity
+    return rule_arities
 
 def _range_restricted(program: asts.Program) -> None:
     """
@@ -37,30 +51,56 @@ def _range_restricted(program: asts.Program) -> None:
     positive literal:
 
       p(X) :- !q(Y), r(Z).
-    """
-    def range_restricted_rule(rule: asts.Rule):
-        positive_atoms = [l.atom for l in rule.body if l.is_positive()]
-        negative_atoms = [l.atom for l in rule.body if l.is_negative()]
-        head_vars = {v.x for v in rule.head.variables()}
-        postive_vars = {v.x for a in positive_atoms for v in a.variables()}
-        negative_vars = {v.x for a in negative_atoms for v in a.variables()}
-
-        if not (head_vars <= postive_vars):
-            unrestricted_head_vars = head_vars - postive_vars
-            msg = (f'The head variables {unrestricted_head_vars} in the rule '
-                   f'"{rule}" do not appear in any positive literal in the '
-                   f'body of the rule.')
-            raise ValueError(msg)
 
-        if not (negative_vars <= postive_vars):
-            unrestricted_body_vars = negative_vars - postive_vars
-            msg = (f'The body variables {unrestricted_body_vars} in the rule '
-                   f'"{rule}" do not appear in any positive literal in the '
-                   f'body of the rule.')
-            raise ValueError(msg)
+    A variable can also be bound by a built-in predicate that equates it to an
+    expression of bound variables (see `asts.Builtin.assignment`), and every
+    variable of a built-in predicate must be bound. For example, these rules
+    are range restricted:
+
+      p(Z) :- q(X), Z = X + 1.
+      p(Y) :- q(X), Y = X * 2, Z = Y + 1, Z < 10.
+
+    These rules are not:
 
+      p(Z) :- q(X), Z > X.
+      p(X) :- q(X), X = Y + 1.
+    """
     for rule in program.rules:
-        range_restricted_rule(rule)
+        _range_restricted_rule(rule)
+
+def _range_restricted_rule(rule: asts.Rule) -> None:
+    positive_atoms = [l.atom for l in rule.body if l.is_positive()]
+    negative_atoms = [l.atom for l in rule.body if l.is_negative()]
+    head_vars = {v.x for v in rule.head.variables()}
+    head_vars |= {a.x for a in rule.head.aggregates()}
+    postive_vars = {v.x for a in positive_atoms for v in a.variables()}
+    negative_vars = {v.x for a in negative_atoms for v in a.variables()}
+
+    # Variables bound by built-in predicates count as positive.
+    pending = list(rule.builtins)
+    builtin.ready(pending, postive_vars)
+    if len(pending) > 0:
+        unrestricted_builtin_vars = {v.x for b in pending
+                                         for v in b.variables()
+                                         if v.x not in postive_vars}
+        msg = (f'The variables {unrestricted_builtin_vars} of the built-in '
+               f'predicates of the rule "{rule}" are not bound by any '
+               f'positive literal or assignment in the body of the rule.')
+        raise ValueError(msg)
+
+    if not (head_vars <= postive_vars):
+        unrestricted_head_vars = head_vars - postive_vars
+        msg = (f'The head variables {unrestricted_head_vars} in the rule '
+               f'"{rule}" do not appear in any positive literal in the '
+               f'body of the rule.')
+        raise ValueError(msg)
+
+    if not (negative_vars <= postive_vars):
+        unrestricted_body_vars = negative_vars - postive_vars
+        msg = (f'The body variables {unrestricted_body_vars} in the rule '
+               f'"{rule}" do not appear in any positive literal in the '
+               f'body of the rule.')
+        raise ValueError(msg)
 
 def _timestamp_restricted(program: asts.Program) -> None:
     """
@@ -76,8 +116,60 @@ def _timestamp_restricted(program: asts.Program) -> None:
         p(x)@42 :- p(x).
     """
     for rule in program.rules:
-        if rule.is_constant_time() and len(rule.body) != 0:
-            msg = f'The constant time rule "{rule}" has a non-empty body.'
+        _timestamp_restricted_rule(rule)
+
+def _timestamp_restricted_rule(rule: asts.Rule) -> None:
+    if rule.is_constant_time() and len(rule.body) != 0:
+        msg = f'The constant time rule "{rule}" has a non-empty body.'
+        raise ValueError(msg)
+
+def _aggregates_restricted(program: asts.Program) -> None:
+    """
+    Aggregates (e.g. `count<X>`) can only appear in the head of a rule, and
+    their functions must be one of `asts.AGGREGATES`. For example, these rules
+    are well-formed:
+
+        num_items(#L, count<X>) :- item(#L, X).
+        stats(#L, K, min<V>, max<V>) :- value(#L, K, V).
+
+    This rule is not:
+
+        p(#L, X) :- q(#L, count<X>).
+
+    Like negation, aggregation must be stratified (see `asts.Program.pdg`).
+    """
+    for rule in program.rules:
+        _aggregates_restricted_rule(rule)
+
+def _aggregates_restricted_rule(rule: asts.Rule) -> None:
+    for aggregate in rule.head.aggregates():
+        if aggregate.function not in asts.AGGREGATES:
+            msg = (f'The aggregate {aggregate} of rule "{rule}" is not one of '
+                   f'{", ".join(asts.AGGREGATES)}.')
+            raise ValueError(msg)
+
+    for literal in rule.body:
+        if len(literal.atom.aggregates()) > 0:
+            msg = (f'The body of rule "{rule}" contains an aggregate. '
+                   f'Aggregates can only appear in the head of a rule.')
+            raise ValueError(msg)
+
+def _builtins_restricted(program: asts.Program) -> None:
+    """
+    The operators of built-in predicates must be in `asts.COMPARISONS` and
+    `asts.OPERATORS`. The parser only produces such built-in predicates, but
+    other ASTs may not.
+    """
+    for rule in program.rules:
+        _builtins_restricted_rule(rule)
+
+def _builtins_restricted_rule(rule: asts.Rule) -> None:
+    for b in rule.builtins:
+        operators = [e.op for e in [b.left, b.right]
+                          if isinstance(e, asts.Arithmetic)]
+        if (b.op not in asts.COMPARISONS or
+            any(op not in asts.OPERATORS for op in operators)):
+            msg = f'The built-in predicate {b} of rule "{rule}" is invalid.'
             raise ValueError(msg)
 
 def _location_restricted(program: asts.Program) -> None:
@@ -104,39 +196,39 @@ def _location_restricted(program: asts.Program) -> None:
       p(#Y) :- q(#X, Y), r(#X, Y).
       p(#Y)@next :- q(#X, Y), r(#X, Y).
     """
-    def location_restricted_rule(rule: asts.Rule):
-        for atom in [rule.head] + [l.atom for l in rule.body]:
-            if len(atom.terms) == 0:
-                msg = (f'Atom {atom} of rule "{rule}" does not have a '
-                       f'location specifier.')
-                raise ValueError(msg)
-
-            if not atom.terms[0].is_location:
-                msg = (f'The first term of atom {atom} of rule "{rule}" is '
-                       f'not a location specifier.')
-                raise ValueError(msg)
-
-            if any(t.is_location for t in atom.terms[1:]):
-                msg = (f'The atom {atom} of rule "{rule}" contains a location '
-                        f'term that does not appear at the head of the atom.')
-                raise ValueError(msg)
-
-        head_location = rule.head.terms[0]
-        body_locations = {l.atom.terms[0] for l in rule.body}
-        locations = {head_location} | body_locations
-
-        if len(body_locations) > 1:
-            msg = (f'The body of rule "{rule}" contains multiple locations: '
-                   f'{body_locations}.')
+    for rule in program.rules:
+        _location_restricted_rule(rule)
+
+def _location_restricted_rule(rule: asts.Rule) -> None:
+    for atom in [rule.head] + [l.atom for l in rule.body]:
+        if len(atom.terms) == 0:
+            msg = (f'Atom {atom} of rule "{rule}" does not have a '
+                   f'location specifier.')
             raise ValueError(msg)
 
-        if (rule.is_deductive() or rule.is_inductive()) and len(locations) != 1:
-            msg = (f'The head and body of rule "{rule}" contain different '
-                   f'locations. Only async rules are allowed to do this.')
+        if not atom.terms[0].is_location:
+            msg = (f'The first term of atom {atom} of rule "{rule}" is '
+                   f'not a location specifier.')
             raise ValueError(msg)
 
-    for rule in program.rules:
-        location_restricted_rule(rule)
+        if any(t.is_location for t in atom.terms[1:]):
+            msg = (f'The atom {atom} of rule "{rule}" contains a location '
+                    f'term that does not appear at the head of the atom.')
+            raise ValueError(msg)
+
+    head_location = rule.head.terms[0]
+    body_locations = {l.atom.terms[0] for l in rule.body}
+    locations = {head_location} | body_locations
+
+    if len(body_locations) > 1:
+        msg = (f'The body of rule "{rule}" contains multiple locations: '
+               f'{body_locations}.')
+        raise ValueError(msg)
+
+    if (rule.is_deductive() or rule.is_inductive()) and len(locations) != 1:
+        msg = (f'The head and body of rule "{rule}" contain different '
+               f'locations. Only async rules are allowed to do this.')
+        raise ValueError(msg)
 
 def _stratified_deductive_pdg(program: asts.Program) -> None:
     def is_negative_cycle(g, cycle):
@@ -164,10 +256,117 @@ def typecheck(program: asts.Program) -> asts.Program:
     _fixed_arities(program)
     _range_restricted(program)
     _timestamp_restricted(program)
+    _aggregates_restricted(program)
+    _builtins_restricted(program)
     _location_restricted(program)
     _stratified_deductive_pdg(program)
     return program
 
+class Typechecker:
+    """
+    A `Typechecker` typechecks a program one rule at a time. Typechecking a
+    program with `typecheck` looks at every rule and enumerates every cycle
+    of the deductive PDG, so typechecking a program every time a rule is
+    added to it (e.g. in the REPL) takes time quadratic in the size of the
+    program, or worse. A `Typechecker` instead remembers the arity of every
+    predicate and the deductive PDG of the rules added so far, and
+    typechecks a new rule by checking
+
+      1. the arities of its predicates against the known arities,
+      2. that it is range, timestamp, aggregate, built-in, and location
+         restricted, and
+      3. if it's a deductive rule, that the strongly connected component of
+         the PDG that contains its head, which is the only one its edges can
+         change, has no negative edges.
+
+    For example:
+
+        typechecker = Typechecker(program)
+        typechecker.add(rule) # Raises a ValueError if rule is ill-typed.
+    """
+    def __init__(self, program: asts.Program = None) -> None:
+        self.arities: Dict[str, int] = {}
+        # Every deductive rule `p :- ..., q, ...` adds an edge from q to p,
+        # whether or not q is the head of a deductive rule. Every predicate in
+        # a cycle is, so this graph has the same cycles as the deductive PDG.
+        self.pdg = nx.DiGraph()
+        if program is not None:
+            typecheck(program)
+            for rule in program.rules:
+                self._add(rule)
+
+    def _edges(self, rule: asts.Rule) -> Dict[asts.Predicate, bool]:
+        edges: Dict[asts.Predicate, bool] = {}
+        if rule.is_deductive():
+            p = rule.head.predicate
+            for literal in rule.body:
+                q = literal.atom.predicate
+                edges[q] = (edges.get(q, False) or literal.is_negative() or
+                            rule.is_aggregate() or
+                            (self.pdg.has_edge(q, p) and
+                             self.pdg[q][p]['negative']))
+        return edges
+
+    def check(self, rule: asts.Rule) -> None:
+        """
+        `typechecker.check(rule)` raises a ValueError if adding `rule` to the
+        program would make it ill-typed.
+        """
+        _fixed_arities_rule(rule, self.arities)
+        _range_restricted_rule(rule)
+        _timestamp_restricted_rule(rule)
+        _aggregates_restricted_rule(rule)
+        _builtins_restricted_rule(rule)
+        _location_restricted_rule(rule)
+
+        edges = self._edges(rule)
+        if len(edges) == 0:
+            return
+
+        # The new edges all end at p, so the component of p consists of p and
+        # the descendants of p that reach p, or the source of a new edge,
+        # through other descendants of p.
+        p = rule.head.predicate
+        descendants = {p}
+        if p in self.pdg:
+            descendants |= nx.descendants(self.pdg, p)
+        component: Set[asts.Predicate] = set()
+        frontier = [q for q in [p] + list(edges) if q in descendants]
+        while len(frontier) > 0:
+            q = frontier.pop()
+            if q in component:
+                continue
+            component.add(q)
+            if q in self.pdg:
+                frontier.extend(r for r in self.pdg.predecessors(q)
+                                  if r in descendants)
+
+        negative_edges = [(q, p) for (q, negative) in edges.items()
+                          if negative and q in component]
+        negative_edges += [(q, r) for q in component if q in self.pdg
+                                  for r in self.pdg.successors(q)
+                                  if r in component and
+                                     self.pdg[q][r]['negative']]
+        if len(negative_edges) > 0:
+            msg = (f'Adding the rule "{rule}" makes the deductive rules of '
+                   f'this program unstratifiable. The following negative '
+                   f'edges are in a cycle through {p}: {negative_edges}.')
+            raise ValueError(msg)
+
+    def add(self, rule: asts.Rule) -> None:
+        """
+        `typechecker.add(rule)` typechecks `rule` (see `check`) and adds it
+        to the program.
+        """
+        self.check(rule)
+        self._add(rule)
+
+    def _add(self, rule: asts.Rule) -> None:
+        self.arities.update(_fixed_arities_rule(rule, self.arities))
+        p = rule.head.predicate
+        for (q, negative) in self._edges(rule).items():
+            self.pdg.add_edge(q, p, negative=negative)
+
 def typechecks(program: asts.Program) -> bool:
     try:
         typecheck(program)
@@ -2,23 +2,58 @@ import unittest
 
 from desugar import desugar
 from parser import parse
-from typecheck import typecheck
+from typecheck import Typechecker, typecheck
 
 class TestTypecheck(unittest.TestCase):
-    def test_good_programs(self) -> None:
-        good_programs = [
-            "p(#a, a) :- .",
-            "p(X) :- p(X).",
-            "p(X, Y, Z) :- p(X, Y, Z).",
-            "p(#a) :- q(#a), r(#a), s(#a).",
-            "p(#X) :- q(#X), r(#X), s(#X).",
-            "p(#X, X, Y, Z) :- q(#X, X), r(#X, Y), s(#X, Z).",
-            "p(#X, X, Y, Z)@next :- q(#X, X), r(#X, Y), s(#X, Z).",
-            "p(#Y)@async :- q(#X, X), r(#X, Y), s(#X, Z).",
-            "p(#Z)@async :- q(#X, X), r(#X, Y), s(#X, Z).",
-        ]
+    good_programs = [
+        "p(#a, a) :- .",
+        "p(X) :- p(X).",
+        "p(X, Y, Z) :- p(X, Y, Z).",
+        "p(#a) :- q(#a), r(#a), s(#a).",
+        "p(#X) :- q(#X), r(#X), s(#X).",
+        "p(#X, X, Y, Z) :- q(#X, X), r(#X, Y), s(#X, Z).",
+        "p(#X, X, Y, Z)@next :- q(#X, X), r(#X, Y), s(#X, Z).",
+        "p(#Y)@async :- q(#X, X), r(#X, Y), s(#X, Z).",
+        "p(#Z)@async :- q(#X, X), r(#X, Y), s(#X, Z).",
+        "p(count<X>) :- q(X).",
+        "p(#X, Y, sum<Z>, max<Z>)@next :- q(#X, Y, Z).",
+        "p(Z) :- q(X), Z = X + 1.",
+        "p(X, Z) :- q(X), Z = Y * 2, Y = X - 1, Z > X.",
+        "p(X) :- q(X), !r(Y), Y = X.",
+    ]
+
+    bad_programs = [
+        # Inconsistent arities.
+        "p(X, Y) :- p(X), p(Y).",
+
+        # Range restricted.
+        "p(X) :- .",
+        "p(X, Y, Z) :- .",
+        "p(X) :- q(X), !r(Y).",
+        "p(X, Y) :- q(X), !r(Y).",
+
+        # Timestamp restricted.
+        "p(X)@42 :- q(X).",
 
-        for good_program in good_programs:
+        # Location restricted.
+        "p(#X) :- q(X), r(#X).",
+        "p(#X) :- q(#X), r(#X, #Z).",
+        "p(#X) :- q(#X), r(#Y).",
+        "p(#Y) :- q(#X), r(#X, Y).",
+        "p(#Y)@next :- q(#X), r(#X, Y).",
+
+        # Aggregates.
+        "p(count<Y>) :- q(X).",
+        "p(X, count<Y>) :- p(X, Y).",
+
+        # Built-in predicates.
+        "p(Z) :- q(X), Z > X.",
+        "p(X) :- q(X), X = Y + 1.",
+        "p(X, Y) :- q(X), X + 1 = Y + 1.",
+    ]
+
+    def test_good_programs(self) -> None:
+        for good_program in self.good_programs:
             try:
                 program = parse(good_program)
                 program = desugar(program)
@@ -28,32 +63,53 @@ class TestTypecheck(unittest.TestCase):
                 raise e
 
     def test_bad_programs(self) -> None:
-        bad_programs = [
-            # Inconsistent arities.
-            "p(X, Y) :- p(X), p(Y).",
-
-            # Range restricted.
-            "p(X) :- .",
-            "p(X, Y, Z) :- .",
-            "p(X) :- q(X), !r(Y).",
-            "p(X, Y) :- q(X), !r(Y).",
-
-            # Timestamp restricted.
-            "p(X)@42 :- q(X).",
-
-            # Location restricted.
-            "p(#X) :- q(X), r(#X).",
-            "p(#X) :- q(#X), r(#X, #Z).",
-            "p(#X) :- q(#X), r(#Y).",
-            "p(#Y) :- q(#X), r(#X, Y).",
-            "p(#Y)@next :- q(#X), r(#X, Y).",
-        ]
-
-        for bad_program in bad_programs:
+        for bad_program in self.bad_programs:
             with self.assertRaises(ValueError):
                 program = parse(bad_program)
                 program = desugar(program)
                 program = typecheck(program)
 
+    def test_typechecker(self) -> None:
+        for good_program in self.good_programs:
+            typechecker = Typechecker()
+            for rule in desugar(parse(good_program)).rules:
+                typechecker.add(rule)
+
+        for bad_program in self.bad_programs:
+            with self.assertRaises(ValueError):
+                typechecker = Typechecker()
+                for rule in desugar(parse(bad_program)).rules:
+                    typechecker.add(rule)
+
+        # Rules are checked against the rules already added.
+        typechecker = Typechecker(desugar(parse("""
+            p(X) :- q(X).
+            q(X) :- r(X), !s(X).
+            s(X) :- t(X).
+        """)))
+        bad_rules = [
+            "p(X, Y) :- q(X), r(Y).",
+            "s(X) :- q(X).",
+            "s(X) :- p(X).",
+            "t(X) :- s(X), !p(X).",
+        ]
+        for bad_rule in bad_rules:
+            with self.assertRaises(ValueError):
+                typechecker.add(desugar(parse(bad_rule)).rules[0])
+        good_rules = [
+            "r(X) :- p(X), q(X).",
+            "t(X) :- u(X).",
+            "u(X) :- t(X).",
+            "v(X) :- !p(X), r(X).",
+            "s(X)@next :- p(X).",
+            "w(count<X>) :- s(X).",
+        ]
+        for good_rule in good_rules:
+            typechecker.add(desugar(parse(good_rule)).rules[0])
+        with self.assertRaises(ValueError):
+            typechecker.add(desugar(parse("t(X) :- !u(X), v(X).")).rules[0])
+        with self.assertRaises(ValueError):
+            typechecker.add(desugar(parse("s(X) :- w(X).")).rules[0])
+
 if __name__ == '__main__':
     unittest.main()
@@ -7,7 +7,17 @@ function new_graph(elements) {
         selector: 'node',
         style: {
           'background-color': '#666',
-          'label': 'data(id)'
+          'label': 'data(label)'
+        }
+      },
+      {
+        // A collapsed strongly connected component.
+        selector: 'node[members]',
+        style: {
+          'shape': 'round-rectangle',
+          'background-color': '#779ecb',
+          'width': function(node) { return 20 + 4 * node.data('size'); },
+          'height': function(node) { return 20 + 4 * node.data('size'); },
         }
       },
       {
@@ -31,19 +41,32 @@ function new_graph(elements) {
         }
       }
     ],
+    // Nodes are positioned by the server.
     layout: {
-      name: 'breadthfirst',
+      name: 'preset',
     }
   });
 }
 
-function json_to_elements(json) {
+// Converts a view of a PDG returned by `/layout` to cytoscape elements.
+function layout_to_elements(json) {
   var nodes = [];
   for (var i = 0; i < json.nodes.length; ++i) {
     var node = json.nodes[i];
+    var label = node.members ?
+      node.members.slice(0, 3).join(', ') +
+        (node.size > 3 ? ', ... (' + node.size + ')' : '') :
+      node.id;
     nodes.push({
       group: 'nodes',
-      data: { id: node.id[0] },
+      data: {
+        id: node.id,
+        label: label,
+        component: node.component,
+        size: node.size,
+        members: node.members,
+      },
+      position: { x: node.x, y: node.y },
     });
   }
 
@@ -55,8 +78,8 @@ function json_to_elements(json) {
       data: {
         negative: edge.negative,
         async: edge.async,
-        source: edge.source[0],
-        target: edge.target[0],
+        source: edge.source,
+        target: edge.target,
       },
     });
   }
@@ -64,25 +87,148 @@ function json_to_elements(json) {
   return nodes.concat(edges);
 }
 
+// Updates the graph in place, adding and removing only the nodes and edges
+// that changed. Nodes are positioned by the server, so nothing else moves.
+function update_graph(cy, elements) {
+  var ids = {};
+  for (var i = 0; i < elements.length; ++i) {
+    var data = elements[i].data;
+    if (elements[i].group == 'edges') {
+      data.id = data.source + '->' + data.target +
+                (data.negative ? '!' : '') + (data.async ? '@' : '');
+    }
+    ids[data.id] = true;
+  }
+
+  var removed = cy.elements().filter(function(e) { return !ids[e.id()]; });
+  var added = elements.filter(function(e) {
+    return cy.getElementById(e.data.id).length == 0;
+  });
+  if (removed.length == 0 && added.length == 0) {
+    return;
+  }
+  cy.remove(removed);
+  cy.add(added);
+}
+
 function main() {
   var app = new Vue({
     el: '#app',
     data: {
       input: '',
-      cy: new_graph([]),
+      error: '',
+      program: null,
+      expanded: [],
+      timesteps: 20,
+      timestep: null,
+      relations: {},
+      source: null,
+      cy: null,
+    },
+    // The graph is created once Vue has rendered its container.
+    mounted: function() {
+      var app = this;
+      this.cy = new_graph([]);
+      this.cy.on('tap', 'node', function(event) {
+        app.toggle(event.target);
+      });
     },
     methods: {
+      set_program: function(response) {
+        if (response.error) {
+          this.error = response.error;
+          return;
+        }
+        this.error = '';
+        if (this.program != response.id) {
+          this.program = response.id;
+          this.expanded = [];
+        }
+        this.update_layout();
+      },
+      // Fetches the view of the PDG with the components in `expanded`
+      // expanded.
+      update_layout: function() {
+        var request = new XMLHttpRequest();
+        var app = this;
+        request.onload = function() {
+          var elements = layout_to_elements(JSON.parse(request.responseText));
+          update_graph(app.cy, elements);
+        };
+        request.open('GET', '/layout?program=' + this.program +
+                            '&expand=' + this.expanded.join(','));
+        request.send();
+      },
+      // Expands a collapsed component, or collapses an expanded one.
+      toggle: function(node) {
+        var c = node.data('component');
+        if (node.data('size') == 1) {
+          return;
+        }
+        var i = this.expanded.indexOf(c);
+        if (i == -1) {
+          this.expanded.push(c);
+        } else {
+          this.expanded.splice(i, 1);
+        }
+        this.update_layout();
+      },
       update_pdg: function() {
-        var json = JSON.parse(this.input);
-        var elements = json_to_elements(json);
-        this.cy.destroy();
-        this.cy = new_graph(elements);
-        this.cy.destroy();
-        this.cy = new_graph(elements);
+        var request = new XMLHttpRequest();
+        var app = this;
+        request.onload = function() {
+          app.set_program(JSON.parse(request.responseText));
+        };
+        request.open('POST', '/program');
+        request.send(this.input);
+      },
+      // Streams the deltas of a run of the program and applies them to the
+      // relations.
+      run: function() {
+        if (this.source) {
+          this.source.close();
+        }
+        this.relations = {};
+        this.timestep = null;
+        var url = '/run?program=' + this.program +
+                  '&timesteps=' + this.timesteps;
+        var app = this;
+        this.source = new EventSource(url);
+        this.source.onmessage = function(event) {
+          var delta = JSON.parse(event.data);
+          var relations = Object.assign({}, app.relations);
+          for (var p in delta.removed) {
+            var removed = {};
+            delta.removed[p].forEach(function(t) {
+              removed[JSON.stringify(t)] = true;
+            });
+            relations[p] = relations[p].filter(function(t) {
+              return !removed[JSON.stringify(t)];
+            });
+          }
+          for (var p in delta.added) {
+            relations[p] = (relations[p] || []).concat(delta.added[p]);
+          }
+          app.relations = relations;
+          app.timestep = delta.timestep;
+        };
+        this.source.addEventListener('end', function() {
+          app.source.close();
+        });
       },
     },
   });
 
+  var request = new XMLHttpRequest();
+  request.onload = function() {
+    if (request.status == 200) {
+      var response = JSON.parse(request.responseText);
+      app.input = response.source;
+      app.set_program(response);
+    }
+  };
+  request.open('GET', '/program');
+  request.send();
 }
 
 window.onload = main;